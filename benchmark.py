@@ -0,0 +1,454 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import platform
+import sys
+import time
+import numpy as np
+
+from bike import Bike
+from feasibility import screenFeasibility
+from kinematics import calcFrame, solveCycle, solveFrame
+from population import RiderBatch
+from rider import Rider
+
+
+BENCHMARK_VERSION = 1
+
+
+def readExampleConfigs():
+    """
+    Read the example bike and rider configurations used by every benchmark.
+
+    :return: The bike configuration dictionary, and a dictionary of rider names to rider configurations.
+    """
+    with open('bike.json') as f:
+        bc = json.load(f)
+    with open('rider.json') as f:
+        rcs = json.load(f)
+
+    return bc, rcs
+
+
+def createRider(bc, rc):
+    """
+    Create a bike and a rider on it, with the crank at zero.
+
+    :return: The bike and rider.
+    """
+    bike = Bike(bc)
+    bike.calcBikePositions()
+    bike.calcCrankLoc(theta=0.0)
+    rider = Rider(rc, bike)
+    rider.calcRiderHipPos()
+
+    return bike, rider
+
+
+# Each benchmark takes a seeded random generator, builds its workload, and returns a function that runs the i'th
+# operation of the workload. Inputs are generated up front so only the operation itself is timed.
+
+def benchFourBarCalcAngles(rng):
+    bc, rcs = readExampleConfigs()
+    bike, rider = createRider(bc, rcs['rider1'])
+    rider.calcRiderLowerBody(0.0)
+    fourBar = rider.fourBarLegs.fourBar
+    theta2 = rng.uniform(0.0, 2*math.pi, 4096)
+
+    def step(i):
+        fourBar.calcAngles(theta2[i % 4096])
+
+    return step
+
+
+def benchFourBarSetO2O4Pt(rng):
+    bc, rcs = readExampleConfigs()
+    bike, rider = createRider(bc, rcs['rider1'])
+    rider.calcRiderLowerBody(0.0)
+    fourBar = rider.fourBarLegs
+
+    # Pedal contact points around the crank circle, with the hip moving slightly so the pivots always change
+    crankAngle = rng.uniform(0.0, 2*math.pi, 4096)
+    O2 = bc['crankLength'] * np.stack([np.cos(crankAngle), np.sin(crankAngle)], axis=-1)
+    O4 = np.array([rider.hipX, rider.hipY]) + rng.normal(0.0, 1.0, (4096, 2))
+    theta2 = math.pi - rng.uniform(0.0, 0.75, 4096)
+
+    def step(i):
+        j = i % 4096
+        fourBar.setO2O4Pt(O2[j], O4[j], theta2[j])
+
+    return step
+
+
+def benchCalculatePedalAndFoot(rng):
+    bc, rcs = readExampleConfigs()
+    bike, rider = createRider(bc, rcs['rider1'])
+    crankAngle = rng.uniform(0.0, 360.0, 4096)
+
+    def step(i):
+        rider.calculatePedalAndFoot(crankAngle[i % 4096])
+
+    return step
+
+
+def benchCalcRiderLowerBody(rng):
+    bc, rcs = readExampleConfigs()
+    bike, rider = createRider(bc, rcs['rider1'])
+    crankAngle = rng.uniform(0.0, 360.0, 4096)
+
+    def step(i):
+        j = i % 4096
+        bike.calcCrankLoc(theta=-crankAngle[j])
+        rider.calcRiderLowerBody(crankAngle[j])
+
+        # Don't let the angle history grow without limit
+        if len(rider.crankAngle) >= 4096:
+            del rider.crankAngle[:], rider.kneeAngle[:], rider.hipAngle[:]
+
+    return step
+
+
+def benchCalcBikePositions(rng):
+    bc, rcs = readExampleConfigs()
+    bikes = []
+    for scale in rng.normal(1.0, 0.02, 64):
+        bike = Bike(dict(bc, seatTube=bc['seatTube'] * scale))
+        bikes.append(bike)
+
+    def step(i):
+        bikes[i % 64].calcBikePositions()
+
+    return step
+
+
+def benchSolveFrame(rng):
+    bc, rcs = readExampleConfigs()
+    # A catalogue of frames, with every length varied
+    frameBcs = [{key: value * rng.normal(1.0, 0.03, 1024) for key, value in bc.items()} for i in range(8)]
+
+    def step(i):
+        solveFrame(frameBcs[i % 8])
+
+    return step
+
+
+def benchRiderCycle(rng):
+    bc, rcs = readExampleConfigs()
+    bike = Bike(bc)
+    bike.calcBikePositions()
+    riders = [Rider(rc, bike) for rc in rcs.values()]
+    crankAngles = np.linspace(0, 360, 360, endpoint=False) + rng.uniform(0.0, 1.0)
+
+    def step(i):
+        # One revolution of the four riders, through the same calls as main.py
+        for rider in riders:
+            del rider.crankAngle[:], rider.kneeAngle[:], rider.hipAngle[:]
+        for crankAngleDeg in crankAngles:
+            bike.calcCrankLoc(theta=-crankAngleDeg)
+            for rider in riders:
+                rider.calcRiderLowerBody(crankAngleDeg)
+                rider.calcUpperBody()
+
+    return step
+
+
+def benchOverlayFrame(rng):
+    bc, rcs = readExampleConfigs()
+    bike = Bike(bc)
+    bike.calcBikePositions()
+
+    # Many riders overlaid on one bike, with the example riders' pedal and foot sizes but their own legs
+    riders = []
+    for i in range(32):
+        rc = dict(rcs['rider%d' % (1 + i % 4)])
+        rc['knee2AnkleLength'] += rng.uniform(-10.0, 10.0)
+        rc['hip2KneeLength'] += rng.uniform(-10.0, 10.0)
+        riders.append(Rider(rc, bike))
+    crankAngle = rng.uniform(0.0, 360.0, 4096)
+
+    def step(i):
+        # One frame of every rider
+        crankAngleDeg = crankAngle[i % 4096]
+        bike.calcCrankLoc(theta=-crankAngleDeg)
+        for rider in riders:
+            rider.calcRiderLowerBody(crankAngleDeg)
+            if len(rider.crankAngle) >= 4096:
+                del rider.crankAngle[:], rider.kneeAngle[:], rider.hipAngle[:]
+
+    return step
+
+
+def benchBatchCycle(rng):
+    bc, rcs = readExampleConfigs()
+    frame = calcFrame(bc)
+    arrays = RiderBatch.fromConfigs(rcs).arrays
+    crankAngles = np.linspace(0, 360, 360, endpoint=False) + rng.uniform(0.0, 1.0)
+
+    def step(i):
+        solveCycle(frame, arrays, crankAngles)
+
+    return step
+
+
+def benchScreenFeasibility(rng):
+    bc, rcs = readExampleConfigs()
+    frame = calcFrame(bc)
+    # A population of riders, scattered widely enough that some can't reach
+    batch = RiderBatch.fromConfigs(rcs)
+    idx = rng.integers(0, len(batch), 4096)
+    arrays = {key: values[idx] * rng.normal(1.0, 0.1, len(idx)) for key, values in batch.arrays.items()}
+
+    def step(i):
+        screenFeasibility(frame, arrays)
+
+    return step
+
+
+def setupAggFigure(bc, rcs):
+    """
+    Create the main.py figure, bike and riders on the Agg backend.
+    """
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    import matplotlib.pyplot as plt
+    from renderer import createFigure
+
+    fig, ax1, ax2, ax3 = createFigure()
+    bike = Bike(bc, ax=ax1)
+    bike.calcBikePositions()
+    riders = [Rider(rc, bike, ax=ax1) for rc in rcs.values()]
+    bike.drawBikePositions()
+    for rider in riders:
+        rider.drawSeat()
+
+    return plt, fig, bike, riders, ax2, ax3
+
+
+def benchAggFrame(rng):
+    bc, rcs = readExampleConfigs()
+    plt, fig, bike, riders, ax2, ax3 = setupAggFigure(bc, rcs)
+    crankAngles = np.linspace(0, 360, 4096, endpoint=False) + rng.uniform(0.0, 1.0)
+
+    def step(i):
+        # A frame of the main.py animation loop, drawing the whole figure
+        crankAngleDeg = crankAngles[i % 4096]
+        bike.calcCrankLoc(theta=-crankAngleDeg)
+        bike.drawCrank()
+        for rider in riders:
+            rider.calcAndDrawAll(crankAngleDeg)
+        for rider in riders:
+            rider.drawAngleLines(ax2, ax3)
+            if len(rider.crankAngle) >= 4096:
+                del rider.crankAngle[:], rider.kneeAngle[:], rider.hipAngle[:]
+        ax2.relim()
+        ax2.autoscale_view()
+        ax3.relim()
+        ax3.autoscale_view()
+        fig.canvas.draw()
+
+    return step
+
+
+def benchAggBlitFrame(rng):
+    bc, rcs = readExampleConfigs()
+    plt, fig, bike, riders, ax2, ax3 = setupAggFigure(bc, rcs)
+    from renderer import BlitRenderer
+    crankAngles = np.linspace(0, 360, 4096, endpoint=False) + rng.uniform(0.0, 1.0)
+    renderer = BlitRenderer(fig, bike, riders, ax2, ax3, fps=None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        renderer.setup(crankAngles[0])
+
+    def step(i):
+        renderer.drawFrame(crankAngles[i % 4096])
+        for rider in riders:
+            if len(rider.crankAngle) >= 4096:
+                del rider.crankAngle[:], rider.kneeAngle[:], rider.hipAngle[:]
+
+    return step
+
+
+def benchSliderUpdate(rng):
+    bc, rcs = readExampleConfigs()
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    from interactive import InteractiveFit
+    fit = InteractiveFit(bc, rcs)
+    fit.setup()
+    slider = fit.riderSliders['seatHeight']
+    seatHeight = rng.uniform(slider.valmin, slider.valmax, 4096)
+
+    def step(i):
+        # Drag a rider slider, solving the rider's cycle and blitting its artists
+        slider.set_val(seatHeight[i % 4096])
+
+    return step
+
+
+BENCHMARKS = {
+    'fourBarCalcAngles': benchFourBarCalcAngles,
+    'fourBarSetO2O4Pt': benchFourBarSetO2O4Pt,
+    'calculatePedalAndFoot': benchCalculatePedalAndFoot,
+    'calcRiderLowerBody': benchCalcRiderLowerBody,
+    'calcBikePositions': benchCalcBikePositions,
+    'solveFrame': benchSolveFrame,
+    'riderCycle': benchRiderCycle,
+    'overlayFrame': benchOverlayFrame,
+    'batchCycle': benchBatchCycle,
+    'screenFeasibility': benchScreenFeasibility,
+    'aggFrame': benchAggFrame,
+    'aggBlitFrame': benchAggBlitFrame,
+    'sliderUpdate': benchSliderUpdate,
+}
+
+
+def runBenchmark(setup, seed=0, samples=200, minSampleTime=2e-3, warmupTime=0.1):
+    """
+    Time a benchmark.
+
+    Fast operations are run several times per sample, so timer overhead doesn't dominate, with the number of runs
+    per sample chosen so a sample takes at least minSampleTime.
+
+    :param setup: A benchmark setup function from BENCHMARKS.
+    :param seed: The random seed the workload is generated from.
+    :param samples: The number of timed samples.
+    :param minSampleTime: The minimum time per sample in seconds.
+    :param warmupTime: The time to run the operation for before timing, in seconds.
+    :return: A dictionary of the operations per second, and the mean and percentile latencies of one operation in
+             microseconds.
+    """
+    # Printed min/max angles aren't part of the output
+    with contextlib.redirect_stdout(io.StringIO()):
+        step = setup(np.random.default_rng(seed))
+
+        # Warm up and calibrate the runs per sample
+        i = 0
+        runsPerSample = 1
+        startTime = time.perf_counter()
+        while True:
+            sampleStart = time.perf_counter()
+            for _ in range(runsPerSample):
+                step(i)
+                i += 1
+            sampleTime = time.perf_counter() - sampleStart
+            if time.perf_counter() - startTime >= warmupTime and sampleTime >= minSampleTime:
+                break
+            if sampleTime < minSampleTime:
+                runsPerSample *= 2
+
+        # Timed samples
+        times = np.empty(samples)
+        for sample in range(samples):
+            sampleStart = time.perf_counter()
+            for _ in range(runsPerSample):
+                step(i)
+                i += 1
+            times[sample] = (time.perf_counter() - sampleStart) / runsPerSample
+
+    if 'matplotlib.pyplot' in sys.modules:
+        sys.modules['matplotlib.pyplot'].close('all')
+
+    return {'throughput': float(1.0 / np.mean(times)),
+            'mean': float(1e6 * np.mean(times)),
+            'p50': float(1e6 * np.percentile(times, 50)),
+            'p90': float(1e6 * np.percentile(times, 90)),
+            'p99': float(1e6 * np.percentile(times, 99)),
+            'min': float(1e6 * np.min(times)),
+            'samples': samples,
+            'runsPerSample': runsPerSample}
+
+
+def runSuite(names=None, seed=0, samples=200, progress=None):
+    """
+    Run benchmarks from BENCHMARKS.
+
+    :param names: The names of the benchmarks to run, or None for all.
+    :param seed: The random seed the workloads are generated from.
+    :param samples: The number of timed samples per benchmark.
+    :param progress: Optional callable, called with each benchmark name and result as it finishes.
+    :return: A dictionary of run metadata and results, which can be saved as JSON.
+    """
+    names = list(BENCHMARKS.keys()) if names is None else names
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError('Unknown benchmark %s, must be one of %s.' % (name, ', '.join(BENCHMARKS.keys())))
+
+    results = {}
+    for name in names:
+        results[name] = runBenchmark(BENCHMARKS[name], seed=seed, samples=samples)
+        if progress is not None:
+            progress(name, results[name])
+
+    return {'version': BENCHMARK_VERSION,
+            'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'python': platform.python_version(),
+                     'numpy': np.__version__,
+                     'platform': platform.platform(),
+                     'seed': seed},
+            'results': results}
+
+
+def compareResults(baseline, current, threshold=0.1, stat='p50'):
+    """
+    Compare two benchmark runs.
+
+    :param baseline: The baseline run, from runSuite or a saved JSON file.
+    :param current: The run to compare against the baseline.
+    :param threshold: The proportion a latency may increase by before counting as a regression.
+    :param stat: The latency statistic to compare.
+    :return: A list of (name, baseline latency, current latency, ratio, regressed) tuples, for benchmarks in both runs.
+    """
+    comparison = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        baselineLatency = baseline['results'][name][stat]
+        ratio = result[stat] / baselineLatency
+        comparison.append((name, baselineLatency, result[stat], ratio, ratio > 1.0 + threshold))
+
+    return comparison
+
+
+def printResult(name, result):
+    print('%-22s %12.1f ops/s  mean %10.2f us  p50 %10.2f us  p90 %10.2f us  p99 %10.2f us' % (
+        name, result['throughput'], result['mean'], result['p50'], result['p90'], result['p99']))
+
+
+def printComparison(comparison, stat='p50'):
+    for name, baselineLatency, latency, ratio, regressed in comparison:
+        print('%-22s %s %10.2f us -> %10.2f us  %+7.1f%%%s' % (
+            name, stat, baselineLatency, latency, 100 * (ratio - 1.0), '  REGRESSION' if regressed else ''))
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the geometry and rendering hot paths.')
+    parser.add_argument('--only', nargs='+', default=None, choices=list(BENCHMARKS.keys()), help='The benchmarks to run.')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed the workloads are generated from.')
+    parser.add_argument('--samples', type=int, default=200, help='The number of timed samples per benchmark.')
+    parser.add_argument('--save', default=None, help='Save the results to this JSON file.')
+    parser.add_argument('--compare', default=None, help='A saved JSON file to compare the results against.')
+    parser.add_argument('--against', default=None, help='Compare this saved JSON file against --compare instead of running.')
+    parser.add_argument('--threshold', type=float, default=10.0, help='The latency increase, in percent, counted as a regression.')
+    parser.add_argument('--stat', default='p50', choices=['mean', 'p50', 'p90', 'p99', 'min'], help='The latency statistic to compare.')
+    args = parser.parse_args()
+
+    if args.against is not None:
+        with open(args.against) as f:
+            run = json.load(f)
+    else:
+        run = runSuite(args.only, seed=args.seed, samples=args.samples, progress=printResult)
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(run, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparison = compareResults(baseline, run, args.threshold / 100.0, args.stat)
+        print()
+        printComparison(comparison, args.stat)
+        if any(regressed for *_, regressed in comparison):
+            sys.exit(1)
@@ -1,7 +1,71 @@
+import collections
 import math
 import numpy as np
 
 
+class CrankContext:
+    """
+    Crank angle dependent values shared by every rider on one bike, for the current crank angle.
+
+    The foot angles are calculated once per crank angle. Riders also store geometry that only depends on a few of
+    their configuration values here, keyed by those values, so riders with the same values share it. Shared
+    arrays are kept between crank angles and overwritten, so nothing is allocated per frame. Only the most
+    recently used arrays are kept, so keys left behind by riders whose configuration changed are dropped.
+    """
+    def __init__(self, maxShared=64):
+        """
+        :param maxShared: The number of shared arrays to keep.
+        """
+        self.maxShared = maxShared
+        self.crankAngleDeg = None
+        self.crankLoc = None
+        self.footAngleRad1 = None
+        self.footAngleRad2 = None
+
+        # Shared arrays by key, least recently used first, and the keys already calculated for the current crank angle
+        self.shared = collections.OrderedDict()
+        self.solvedKeys = set()
+
+    def update(self, crankAngleDeg, crankLoc):
+        """
+        Move to a new crank angle.
+
+        :param crankAngleDeg: The angle of the main crank, as given to Rider.calcRiderLowerBody.
+        :param crankLoc: The (c1x, c1y, c2x, c2y) crank locations from Bike.calcCrankLoc.
+        """
+        self.crankAngleDeg = crankAngleDeg
+        self.crankLoc = crankLoc
+
+        # Calculate foot angle using experimental relationship
+        self.footAngleRad1 = math.radians(22 * math.sin(math.radians(-(crankAngleDeg) + 190 + 90)) + 20.76)
+        self.footAngleRad2 = math.radians(22 * math.sin(math.radians(-(crankAngleDeg + 180) + 190 + 90)) + 20.76)
+
+        self.solvedKeys.clear()
+
+    def getShared(self, key, size):
+        """
+        Get the shared array for a key.
+
+        :param key: A hashable key of the values the array depends on.
+        :param size: The length of the array.
+        :return: The array, and whether it has already been calculated for the current crank angle. If not, the
+                 caller should fill it in.
+        """
+        array = self.shared.get(key)
+        if array is None:
+            array = self.shared[key] = np.empty(size)
+            if len(self.shared) > self.maxShared:
+                evictedKey, _ = self.shared.popitem(last=False)
+                self.solvedKeys.discard(evictedKey)
+        else:
+            self.shared.move_to_end(key)
+        if key in self.solvedKeys:
+            return array, True
+        self.solvedKeys.add(key)
+
+        return array, False
+
+
 class Bike:
     """
     Contains methods for calculating positions of the bike frame, wheels, crank and pedals.
@@ -9,6 +73,7 @@ class Bike:
     def __init__(self, bc, ax=None):
         """
         :param bc: The bike configuration dictionary.
+        :param ax: The axes object to plot on, or None to use the current pyplot axes when first drawing.
         """
         self.bc = bc
         self.ax = ax
@@ -52,6 +117,81 @@ class Bike:
 
         self.crankLine = None
 
+        # Frame lines by name, reused when the frame is drawn again, and those the last drawBikePositions moved
+        self.frameLines = {}
+        self.movedFrameLines = []
+
+        # The frame dictionary for the rider kinematics, see getFrame
+        self.frame = None
+
+        self.crankContext = CrankContext()
+
+
+
+    def getAxes(self):
+        """
+        Get the axes to draw on, using the current pyplot axes if none were given. Pyplot is only imported here, so
+        the bike can be used for calculations without loading matplotlib.
+
+        :return: The axes object.
+        """
+        if self.ax is None:
+            import matplotlib.pyplot as plt
+            self.ax = plt.gca()
+
+        return self.ax
+
+    def plotFrameLine(self, name, x, y, *args, **kwargs):
+        """
+        Plot a line of the frame, or move it if it has already been plotted, so the frame can be drawn again
+        after the configuration changes. Lines that are plotted or moved are added to movedFrameLines.
+
+        :param name: The name of the line.
+        :param x: The x coordinates.
+        :param y: The y coordinates.
+        :param args: The format string, passed to plot when first plotted.
+        :param kwargs: The line properties, passed to plot when first plotted.
+        """
+        line = self.frameLines.get(name)
+        if line is None:
+            line, = self.getAxes().plot(x, y, *args, **kwargs)
+            self.frameLines[name] = line
+        elif np.array_equal(line.get_xdata(), x) and np.array_equal(line.get_ydata(), y):
+            return
+        else:
+            line.set_data(x, y)
+        self.movedFrameLines.append(line)
+
+    def setConfig(self, changes):
+        """
+        Change bike configuration values and calculate the bike positions again. The frames of the riders on the
+        bike must be updated after, see Rider.setConfig.
+
+        :param changes: A dictionary of bike configuration keys to their new values.
+        """
+        oldBc = self.bc
+        self.bc = dict(self.bc)
+        self.bc.update(changes)
+        try:
+            self.calcBikePositions()
+        except ValueError:
+            # Keep the previous frame
+            self.bc = oldBc
+            self.calcBikePositions()
+            raise ValueError('The frame can\'t be built with %s.' % ', '.join('%s %s' % item for item in changes.items()))
+
+    def getFrame(self):
+        """
+        Get the frame positions the rider kinematics depend on, only collecting them again when the bike positions
+        are calculated again.
+
+        :return: The frame dictionary, see kinematics.calcFrame.
+        """
+        if self.frame is None:
+            from kinematics import frameFromBike
+            self.frame = frameFromBike(self)
+
+        return self.frame
 
 
     def calcBikePositions(self):
@@ -59,6 +199,7 @@ class Bike:
         Calculate all the positions required to draw the bike.
         Excludes the seat, seat post, cranks and pedals.
         """
+        self.frame = None
         self.calcChainStayLine()
         self.calcRearWheelLoc()
         self.calcFrontWheelLoc()
@@ -73,6 +214,7 @@ class Bike:
         """
         Draws the bike, without the seat, seat post, cranks or pedals.
         """
+        del self.movedFrameLines[:]
         self.drawChainStayLine()
         self.drawRearWheel()
         self.drawFrontWheel()
@@ -99,7 +241,7 @@ class Bike:
         """
         Draw the chain stay line.
         """
-        self.ax.plot([0, self.rearWheelLoc[0]], [0, self.rearWheelLoc[1]], c=self.color)
+        self.plotFrameLine('chainStay', [0, self.rearWheelLoc[0]], [0, self.rearWheelLoc[1]], c=self.color)
 
     def calcRearWheelLoc(self):
         """
@@ -114,7 +256,7 @@ class Bike:
         Draw the rear wheel circle.
         """
         # Plot Rear Wheel
-        self.ax.plot(self.xrw, self.yrw, 'r')
+        self.plotFrameLine('rearWheel', self.xrw, self.yrw, 'r')
 
     def calcFrontWheelLoc(self):
         """
@@ -129,7 +271,7 @@ class Bike:
         Draw the front wheel circle.
         """
         # Plot Front Wheel
-        self.ax.plot(self.xfw, self.yfw, 'r')
+        self.plotFrameLine('frontWheel', self.xfw, self.yfw, 'r')
 
     def calcSeatTubeLine(self):
         """
@@ -146,14 +288,14 @@ class Bike:
         """
         Draw the seat tube line.
         """
-        self.ax.plot([0, self.xst], [0, self.yst], c=self.color)
+        self.plotFrameLine('seatTube', [0, self.xst], [0, self.yst], c=self.color)
 
     def drawSeatStay(self):
         """
         Draw the seat stay.
         """
         # Plot Seat Stay
-        self.ax.plot([self.rearWheelLoc[0], self.xst], [self.rearWheelLoc[1], self.yst], c=self.color)
+        self.plotFrameLine('seatStay', [self.rearWheelLoc[0], self.xst], [self.rearWheelLoc[1], self.yst], c=self.color)
 
     def calcTopForkLoc(self):
         """
@@ -176,14 +318,14 @@ class Bike:
         """
         Draw the down tube.
         """
-        self.ax.plot([0, self.xfork], [0, self.yfork], c=self.color)
+        self.plotFrameLine('downTube', [0, self.xfork], [0, self.yfork], c=self.color)
 
     def drawFrontFork(self):
         """
         Draw the front fork.
         """
         # Plot front fork
-        self.ax.plot([self.frontWheelLoc[0], self.xfork], [self.frontWheelLoc[1], self.yfork], c=self.color)
+        self.plotFrameLine('frontFork', [self.frontWheelLoc[0], self.xfork], [self.frontWheelLoc[1], self.yfork], c=self.color)
 
     def calcFrontBarLoc(self):
         """
@@ -207,14 +349,14 @@ class Bike:
         """
         Draw the front bar line.
         """
-        self.ax.plot([self.xst, self.xfb], [self.yst, self.yfb], c=self.color)
+        self.plotFrameLine('frontBar', [self.xst, self.xfb], [self.yst, self.yfb], c=self.color)
 
     def drawHeadTube(self):
         """
         Draw the head tube.
         """
         # Plot head tube
-        self.ax.plot([self.xfb, self.xfork], [self.yfb, self.yfork], c=self.color)
+        self.plotFrameLine('headTube', [self.xfb, self.xfork], [self.yfb, self.yfork], c=self.color)
 
     def calcHandleBarLoc(self):
         """
@@ -237,8 +379,8 @@ class Bike:
         """
         Draw the handle bar.
         """
-        self.ax.plot([self.xfb, self.handleBarPostPosX], [self.yfb, self.handleBarPostPosY], c=self.color)
-        self.ax.plot([self.handleBarPostPosX, self.handleBarEndPosX], [self.handleBarPostPosY, self.handleBarEndPosY], c=self.color)
+        self.plotFrameLine('handleBarPost', [self.xfb, self.handleBarPostPosX], [self.yfb, self.handleBarPostPosY], c=self.color)
+        self.plotFrameLine('handleBar', [self.handleBarPostPosX, self.handleBarEndPosX], [self.handleBarPostPosY, self.handleBarEndPosY], c=self.color)
 
     def calcLeverPos(self):
         """
@@ -255,7 +397,7 @@ class Bike:
         """
         Draw the levers.
         """
-        self.ax.plot([self.handleBarEndPosX, self.leverX], [self.handleBarEndPosY, self.leverY], c=self.color)
+        self.plotFrameLine('lever', [self.handleBarEndPosX, self.leverX], [self.handleBarEndPosY, self.leverY], c=self.color)
 
     def calcCrankLoc(self, theta):
         """
@@ -272,12 +414,28 @@ class Bike:
         self.c2x = (self.bc['crankLength'] * math.cos(thetaRad + math.pi))
         self.c2y = (self.bc['crankLength'] * math.sin(thetaRad + math.pi))
 
+    def getCrankContext(self, crankAngleDeg):
+        """
+        Get the values shared by every rider for a crank angle, only recalculating them when the crank angle or
+        crank location changes.
+
+        :param crankAngleDeg: The angle of the main crank, as given to Rider.calcRiderLowerBody.
+        :return: The CrankContext.
+        """
+        context = self.crankContext
+        crankLoc = context.crankLoc
+        if (crankAngleDeg != context.crankAngleDeg or crankLoc is None or self.c1x != crankLoc[0] or
+                self.c1y != crankLoc[1] or self.c2x != crankLoc[2] or self.c2y != crankLoc[3]):
+            context.update(crankAngleDeg, (self.c1x, self.c1y, self.c2x, self.c2y))
+
+        return context
+
     def drawCrank(self):
         """
         Draw the cranks.
         """
         if self.crankLine is None:
-            self.crankLine, = self.ax.plot([], [], 'b')
+            self.crankLine, = self.getAxes().plot([], [], 'b')
 
         self.crankLine.set_data([self.c1x, self.c2x], [self.c1y, self.c2y])
 
@@ -0,0 +1,163 @@
+import json
+import time
+import numpy as np
+
+from kinematics import calcAnkleOffset, calcAnkleXY, calcFrame, calcHipCosine, calcHipPos, calcToeXY, crankArray
+
+
+CLEARANCE_STATS = ('toeClearance', 'toeClearanceCrankAngle', 'kneeClearance', 'kneeClearanceCrankAngle')
+
+# The handlebar and lever segments the knee is checked against, as frame keys of their end points
+BAR_SEGMENTS = ((('frontBarX', 'frontBarY'), ('handleBarPostX', 'handleBarPostY')),
+                (('handleBarPostX', 'handleBarPostY'), ('handleBarEndX', 'handleBarEndY')),
+                (('handleBarEndX', 'handleBarEndY'), ('leverX', 'leverY')))
+
+
+def calcToeAndKneeXY(frame, rc, crankAngleDeg):
+    """
+    Solve only the toe and knee positions of the driven leg for an array of crank angles, as separate x and y
+    arrays. The other leg follows the same path half a revolution later, so one leg over a whole revolution covers
+    both.
+
+    :param frame: The frame dictionary, see kinematics.calcFrame. Values may be arrays.
+    :param rc: The rider configuration dictionary. Values may be arrays.
+    :param crankAngleDeg: A 1D array of crank angles in degrees.
+    :return: The toe x, toe y, knee x and knee y arrays, with shape S + (N,). Knees are NaN where the legs can't
+             reach.
+    """
+    ankleX, ankleY = calcAnkleXY(frame, rc, crankAngleDeg)
+    toeX, toeY = calcToeXY(ankleX, ankleY, rc, crankAngleDeg)
+
+    # The knee is off the hip to ankle line by the angle opposite the shin, using the cosine rule
+    hip = calcHipPos(frame, rc)
+    dx, dy, AO4LenSq = calcAnkleOffset(ankleX, ankleY, hip)
+    hip2KneeLength = crankArray(rc['hip2KneeLength'])
+    cosOpp = calcHipCosine(AO4LenSq, crankArray(rc['knee2AnkleLength']), hip2KneeLength)
+    sinOppSq = 1.0 - cosOpp**2
+    sinOpp = np.sqrt(np.where(sinOppSq > 0, sinOppSq, np.nan))
+
+    # Rotate the hip to ankle direction so the knee points forwards, scaled in place to the thigh length
+    thighScale = hip2KneeLength / np.sqrt(AO4LenSq)
+    cosOpp *= thighScale
+    sinOpp *= thighScale
+    kneeX = dx * cosOpp
+    kneeX -= dy * sinOpp
+    kneeX += hip[..., 0:1]
+    kneeY = dy * cosOpp
+    kneeY += dx * sinOpp
+    kneeY += hip[..., 1:2]
+
+    return toeX, toeY, kneeX, kneeY
+
+
+def solveToeAndKnee(frame, rc, crankAngleDeg):
+    """
+    Solve only the toe and knee positions of the driven leg for an array of crank angles, see calcToeAndKneeXY.
+
+    :return: The [x,y] toe and knee positions, with shape S + (N, 2). Knees are NaN where the legs can't reach.
+    """
+    toeX, toeY, kneeX, kneeY = calcToeAndKneeXY(frame, rc, crankAngleDeg)
+
+    return np.stack(np.broadcast_arrays(toeX, toeY), axis=-1), np.stack(np.broadcast_arrays(kneeX, kneeY), axis=-1)
+
+
+def calcSegmentDistanceSq(x, y, startX, startY, endX, endY):
+    """
+    Calculate the squared distances from points to a line segment.
+
+    :param x: The x coordinates of the points, with shape S + (N,).
+    :param y: The y coordinates of the points, with shape S + (N,).
+    :param startX: The x coordinate of the start of the segment, with shape S.
+    :param startY: The y coordinate of the start of the segment, with shape S.
+    :param endX: The x coordinate of the end of the segment, with shape S.
+    :param endY: The y coordinate of the end of the segment, with shape S.
+    :return: The squared distances, with shape S + (N,).
+    """
+    startX = np.asarray(startX, dtype=float)[..., np.newaxis]
+    startY = np.asarray(startY, dtype=float)[..., np.newaxis]
+    segmentX = np.asarray(endX, dtype=float)[..., np.newaxis] - startX
+    segmentY = np.asarray(endY, dtype=float)[..., np.newaxis] - startY
+    offsetX = x - startX
+    offsetY = y - startY
+
+    # Proportion along the segment of the nearest point
+    proportion = ((offsetX * segmentX) + (offsetY * segmentY)) / ((segmentX**2) + (segmentY**2))
+    np.clip(proportion, 0.0, 1.0, out=proportion)
+    offsetX -= proportion * segmentX
+    offsetY -= proportion * segmentY
+
+    return (offsetX**2) + (offsetY**2)
+
+
+def findSmallest(distanceSq, crankAngleDeg, offset=0.0):
+    """
+    Find the smallest distance along the last axis, ignoring NaN.
+
+    :param distanceSq: The squared distances, with shape S + (N,).
+    :param crankAngleDeg: The N crank angles.
+    :param offset: Subtracted from the smallest distance, such as a radius.
+    :return: The smallest distances less the offset, and their crank angles, NaN where every distance is NaN.
+    """
+    idx = np.argmin(np.where(np.isnan(distanceSq), np.inf, distanceSq), axis=-1)
+    smallest = np.take_along_axis(distanceSq, idx[..., np.newaxis], axis=-1)[..., 0]
+    valid = ~np.isnan(smallest)
+
+    return np.where(valid, np.sqrt(smallest) - offset, np.nan), np.where(valid, crankAngleDeg[idx], np.nan)
+
+
+def solveClearance(frame, rc, crankAngleDeg, traces=False):
+    """
+    Find the smallest clearances between the rider and the bike over a crank revolution, in one vectorized pass.
+
+    The toe is checked against the front wheel, and the knee against the handlebar and the levers, all in the
+    side view. A negative clearance means they overlap in the side view, so the toe would hit the wheel when
+    steering, or the knee would hit the bars. Distances are compared squared, and only the smallest of each is
+    square rooted.
+
+    :param frame: The frame dictionary, see kinematics.calcFrame. Values may be arrays.
+    :param rc: The rider configuration dictionary. Values may be arrays.
+    :param crankAngleDeg: A 1D array of crank angles in degrees.
+    :param traces: Whether to also return the clearances at every crank angle.
+    :return: A dictionary of CLEARANCE_STATS, with shape S, giving the smallest clearances and the crank angles
+             they occur at. Knee clearances ignore crank angles the legs can't reach, and are NaN if none can be.
+             With traces, also toeClearanceTrace and kneeClearanceTrace with shape S + (N,).
+    """
+    crankAngleDeg = np.asarray(crankAngleDeg, dtype=float)
+    toeX, toeY, kneeX, kneeY = calcToeAndKneeXY(frame, rc, crankAngleDeg)
+
+    # Toe to the front wheel centre
+    wheelRadius = np.asarray(frame['wheelRadius'], dtype=float)
+    toeDistanceSq = ((toeX - np.asarray(frame['frontWheelX'], dtype=float)[..., np.newaxis])**2 +
+                     (toeY - np.asarray(frame['frontWheelY'], dtype=float)[..., np.newaxis])**2)
+
+    # Knee to the nearest bar segment
+    kneeDistanceSq = None
+    for (startXKey, startYKey), (endXKey, endYKey) in BAR_SEGMENTS:
+        distanceSq = calcSegmentDistanceSq(kneeX, kneeY, frame[startXKey], frame[startYKey], frame[endXKey], frame[endYKey])
+        kneeDistanceSq = distanceSq if kneeDistanceSq is None else np.fmin(kneeDistanceSq, distanceSq, out=kneeDistanceSq)
+
+    result = {}
+    result['toeClearance'], result['toeClearanceCrankAngle'] = findSmallest(toeDistanceSq, crankAngleDeg, wheelRadius)
+    result['kneeClearance'], result['kneeClearanceCrankAngle'] = findSmallest(kneeDistanceSq, crankAngleDeg)
+    if traces:
+        result['toeClearanceTrace'] = np.sqrt(toeDistanceSq) - wheelRadius[..., np.newaxis]
+        result['kneeClearanceTrace'] = np.sqrt(kneeDistanceSq)
+
+    return result
+
+
+if __name__ == '__main__':
+    with open('bike.json') as f:
+        bc = json.load(f)
+    with open('rider.json') as f:
+        rcs = json.load(f)
+    frame = calcFrame(bc)
+    crankAngles = np.linspace(0, 360, 360, endpoint=False)
+
+    for riderName, rc in rcs.items():
+        startTime = time.perf_counter()
+        clearance = solveClearance(frame, rc, crankAngles)
+        elapsed = time.perf_counter() - startTime
+        print('%s, toe to front wheel: %.1f mm at %.0f deg, knee to bars: %.1f mm at %.0f deg (%.2f ms)' % (
+            riderName, clearance['toeClearance'], clearance['toeClearanceCrankAngle'], clearance['kneeClearance'],
+            clearance['kneeClearanceCrankAngle'], 1000 * elapsed))
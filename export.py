@@ -0,0 +1,294 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
+
+from trajectory import writeTrajectory
+
+
+# Frame images and video segments are named by their first frame index, so they sort into order
+FRAME_PATTERN = 'frame_%05d.png'
+SEGMENT_PATTERN = 'segment_%05d.mp4'
+
+# Pad to even dimensions, which H.264 needs
+H264_ARGS = ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+
+EXPORT_FORMATS = ('.mp4', '.gif', '')
+
+# GIF frame delays are whole centiseconds, and browsers play shorter delays than this at 10 centiseconds
+GIF_MIN_DELAY = 2
+
+
+class FrameWriter:
+    """
+    Draws the main.py figure with the Agg backend in a worker process, replaying rider poses from a trajectory
+    file, and saves frames as PNG images or encodes them into video segments.
+    """
+    def __init__(self, trajectoryPath, frameDir, dpi=None, palette=False):
+        """
+        :param trajectoryPath: The trajectory file holding the riders' poses, see trajectory.writeTrajectory.
+        :param frameDir: The directory to write the frame images or video segments to.
+        :param dpi: The figure resolution, defaults to the figure's own.
+        :param palette: Whether to save the frames with an adaptive palette, as used by GIFs.
+        """
+        # Pyplot is only imported here, after the backend is chosen
+        import matplotlib
+        matplotlib.use('Agg', force=True)
+        from renderer import RIDER_COLORS, BlitRenderer, createFigure
+        from trajectory import TrajectoryFile
+
+        self.frameDir = frameDir
+        self.palette = palette
+
+        self.trajectory = TrajectoryFile(trajectoryPath)
+        self.fig, ax1, ax2, ax3 = createFigure()
+        if dpi is not None:
+            self.fig.set_dpi(dpi)
+        self.bike = self.trajectory.createBike(ax=ax1)
+        self.riders = []
+        for i in range(len(self.trajectory)):
+            seatColor, riderColor = RIDER_COLORS[i % len(RIDER_COLORS)]
+            self.riders.append(self.trajectory.createRider(i, self.bike, seatColor=seatColor, riderColor=riderColor,
+                                                           riderAlpha=0.5, ax=ax1))
+        self.bike.drawBikePositions()
+        for rider in self.riders:
+            rider.drawSeat()
+
+        self.renderer = BlitRenderer(self.fig, self.bike, self.riders, ax2, ax3, fps=None)
+        self.renderer.setup(0.0)
+
+    def drawFrame(self, crankAngleDeg):
+        """
+        Draw a frame.
+
+        :param crankAngleDeg: The crank angle to draw at.
+        :return: The frame as an RGB PIL image.
+        """
+        from PIL import Image
+
+        self.renderer.drawFrame(crankAngleDeg % 360.0)
+        for rider in self.riders:
+            # Drop the stored angles, which only matter when animating on screen
+            del rider.crankAngle[:], rider.kneeAngle[:], rider.hipAngle[:]
+
+        return Image.frombuffer('RGBA', self.getSize(), self.fig.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1).convert('RGB')
+
+    def getSize(self):
+        """
+        :return: The frame width and height in pixels.
+        """
+        return self.fig.canvas.get_width_height()
+
+    def writeFrame(self, index, crankAngleDeg):
+        """
+        Draw a frame and save it as a PNG image.
+
+        :param index: The frame index, used for the file name.
+        :param crankAngleDeg: The crank angle to draw at.
+        """
+        from PIL import Image
+
+        image = self.drawFrame(crankAngleDeg)
+        if self.palette:
+            image = image.quantize(255, method=Image.Quantize.FASTOCTREE)
+        image.save(os.path.join(self.frameDir, FRAME_PATTERN % index), compress_level=1)
+
+    def writeSegment(self, path, crankAngles, fps):
+        """
+        Draw frames and encode them straight into a video segment with ffmpeg, without saving any images.
+
+        :param path: The .mp4 segment file to write.
+        :param crankAngles: The crank angle of each frame.
+        :param fps: The frame rate.
+        """
+        width, height = self.getSize()
+        encoder = subprocess.Popen(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                                    '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', '-'] + H264_ARGS + [path],
+                                   stdin=subprocess.PIPE)
+        try:
+            for crankAngleDeg in crankAngles:
+                encoder.stdin.write(self.drawFrame(crankAngleDeg).tobytes())
+        finally:
+            encoder.stdin.close()
+            if encoder.wait() != 0:
+                raise RuntimeError('ffmpeg failed to encode %s.' % path)
+
+    def close(self):
+        import matplotlib.pyplot as plt
+
+        plt.close(self.fig)
+        self.trajectory.close()
+
+
+# The frame writer of this worker process, the crank angle of every frame, and the video frame rate, or None to
+# write PNG images
+workerWriter = None
+workerCrankAngles = None
+workerFps = None
+
+
+def initWorker(trajectoryPath, frameDir, crankAngles, fps, dpi, palette):
+    """
+    Set up a worker process's figure once, so only frame ranges need to be sent per task.
+    """
+    global workerWriter, workerCrankAngles, workerFps
+    workerWriter = FrameWriter(trajectoryPath, frameDir, dpi, palette)
+    workerCrankAngles = crankAngles
+    workerFps = fps
+
+
+def writeFrames(chunk):
+    """
+    Write a contiguous range of frames in a worker, as PNG images or as one video segment.
+
+    :param chunk: The (start, stop) frame indices.
+    :return: The chunk.
+    """
+    start, stop = chunk
+    if workerFps is not None:
+        workerWriter.writeSegment(os.path.join(workerWriter.frameDir, SEGMENT_PATTERN % start), workerCrankAngles[start:stop], workerFps)
+    else:
+        for i in range(start, stop):
+            workerWriter.writeFrame(i, workerCrankAngles[i])
+
+    return chunk
+
+
+def calcGifDelay(fps):
+    """
+    Calculate the GIF frame delay for a frame rate, rounded up to whole centiseconds and no shorter than
+    GIF_MIN_DELAY, so it plays at the same speed in every viewer.
+
+    :param fps: The frame rate.
+    :return: The frame delay in centiseconds.
+    """
+    return max(GIF_MIN_DELAY, int(math.ceil((100.0 / fps) - 1e-9)))
+
+
+def stitchFrames(frameDir, chunks, path, fps):
+    """
+    Join the video segments or frame images, in order, into a video or animated GIF.
+
+    :param frameDir: The directory holding the video segments or frame images.
+    :param chunks: The (start, stop) frame indices of every segment, in order.
+    :param path: The .mp4 or .gif file to write.
+    :param fps: The frame rate.
+    """
+    if path.lower().endswith('.mp4'):
+        # Every segment starts on a key frame, so they are joined without encoding again
+        listPath = os.path.join(frameDir, 'segments.txt')
+        with open(listPath, 'w') as f:
+            for start, stop in chunks:
+                f.write('file \'%s\'\n' % os.path.join(frameDir, SEGMENT_PATTERN % start))
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', listPath, '-c', 'copy', path], check=True)
+    else:
+        from PIL import Image
+
+        frames = [Image.open(os.path.join(frameDir, FRAME_PATTERN % i)) for i in range(chunks[-1][1])]
+        frames[0].save(path, save_all=True, append_images=frames[1:], duration=10 * calcGifDelay(fps), loop=0)
+
+
+def exportAnimation(bc, rcs, path, frames=360, revolutions=1.0, fps=60.0, dpi=None, processes=None, chunkSize=None,
+                    samples=360, progress=None):
+    """
+    Render the riders on the bike through the crank cycle, as in main.py, to a video, GIF or PNG images.
+
+    The riders are solved once into a trajectory file, then the frames are split into ranges across a process
+    pool. Each worker draws its frames from the stored poses with the Agg backend. For videos, each range is piped
+    straight into ffmpeg as one segment, and the segments are joined in order at the end. Otherwise each frame is
+    saved as a PNG image, and GIFs are joined from them in order.
+
+    :param bc: The bike configuration dictionary.
+    :param rcs: A dictionary of rider names to rider configurations.
+    :param path: An .mp4 file, which needs ffmpeg, a .gif file, or a directory to write the PNG frames to.
+    :param frames: The number of frames.
+    :param revolutions: The number of crank revolutions over the frames.
+    :param fps: The frame rate of videos and GIFs. GIFs faster than 50 fps, or whose frame time isn't whole
+                centiseconds, have their frame delay rounded up, and drop frames to keep playing in real time.
+    :param dpi: The figure resolution, defaults to the figure's own.
+    :param processes: The number of worker processes, defaults to the CPU count.
+    :param chunkSize: The number of frames a worker draws per task, defaults to splitting the frames four ways per
+                      process.
+    :param samples: The number of crank angles per revolution to solve the riders at. Frames between them are
+                    interpolated.
+    :param progress: Optional callable, called with (framesDone, totalFrames) as ranges of frames complete.
+    :return: The number of frames written.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format %s, must be an .mp4 file, a .gif file or a directory.' % extension)
+    if extension == '.mp4' and shutil.which('ffmpeg') is None:
+        raise RuntimeError('Exporting MP4 files needs ffmpeg on the PATH.')
+
+    if extension == '.gif':
+        # Keep the same playing time with the longer GIF frame delay
+        frames = max(1, int(round(frames * 100.0 / (fps * calcGifDelay(fps)))))
+
+    processes = processes or os.cpu_count()
+    if chunkSize is None:
+        chunkSize = max(1, -(-frames // (processes * 4)))
+    crankAngles = np.arange(frames) * (360.0 * revolutions / frames)
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        if extension == '':
+            frameDir = path
+            os.makedirs(frameDir, exist_ok=True)
+        else:
+            frameDir = tempDir
+
+        # Solve the poses once, for every worker to replay
+        trajectoryPath = os.path.join(tempDir, 'riders.traj')
+        writeTrajectory(trajectoryPath, bc, rcs, samples=samples)
+
+        chunks = [(start, min(start + chunkSize, frames)) for start in range(0, frames, chunkSize)]
+        initArgs = (trajectoryPath, frameDir, crankAngles, fps if extension == '.mp4' else None, dpi, extension == '.gif')
+        done = 0
+        with multiprocessing.Pool(processes, initializer=initWorker, initargs=initArgs) as pool:
+            for start, stop in pool.imap_unordered(writeFrames, chunks):
+                done += stop - start
+                if progress is not None:
+                    progress(done, frames)
+
+        if extension != '':
+            stitchFrames(frameDir, chunks, path, fps)
+
+    return frames
+
+
+def printProgress(done, total):
+    """
+    Print the export progress on a single line.
+    """
+    print('\rDrawn %d/%d frames (%.0f%%)' % (done, total, 100.0 * done / total), end='' if done < total else '\n')
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the riders on the bike through the crank cycle to a video, GIF or PNG images.')
+    parser.add_argument('out', help='An .mp4 file, which needs ffmpeg, a .gif file, or a directory for PNG frames.')
+    parser.add_argument('--bike', default='bike.json', help='The bike configuration file.')
+    parser.add_argument('--riders', default='rider.json', help='The rider configuration file.')
+    parser.add_argument('--frames', type=int, default=360, help='The number of frames.')
+    parser.add_argument('--revolutions', type=float, default=1.0, help='The number of crank revolutions over the frames.')
+    parser.add_argument('--fps', type=float, default=60.0, help='The frame rate of videos and GIFs. GIF frame delays are '
+                        'whole centiseconds of at least 2, so faster GIFs drop frames to play in real time.')
+    parser.add_argument('--dpi', type=float, default=None, help='The figure resolution, defaults to the figure\'s own.')
+    parser.add_argument('--processes', type=int, default=None, help='The number of worker processes, defaults to the CPU count.')
+    args = parser.parse_args()
+
+    with open(args.bike) as f:
+        bc = json.load(f)
+    with open(args.riders) as f:
+        rcs = json.load(f)
+
+    startTime = time.perf_counter()
+    frames = exportAnimation(bc, rcs, args.out, frames=args.frames, revolutions=args.revolutions, fps=args.fps, dpi=args.dpi,
+                    processes=args.processes, progress=printProgress)
+    elapsed = time.perf_counter() - startTime
+    print('Exported %d frames to %s in %.2f s, %.1f frames/s' % (frames, args.out, elapsed, frames / elapsed))
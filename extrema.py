@@ -0,0 +1,225 @@
+import json
+import time
+import numpy as np
+
+from kinematics import SENSITIVITY_PARAMS, calcFrame, solveJointAngleDerivatives, solveJointAngles
+
+
+EXTREMA_STATS = ('kneeMin', 'kneeMax', 'hipMin', 'hipMax')
+
+# Bisection steps used to find the edges of unreachable ranges of crank angles
+EDGE_ITERATIONS = 48
+
+
+def calcAngleRates(frame, rc, crankAngleDeg):
+    """
+    Calculate the rates of change of the knee and hip angles with crank angle.
+
+    :param frame: The frame dictionary, see kinematics.calcFrame. Values may be arrays.
+    :param rc: The rider configuration dictionary. Values may be arrays.
+    :param crankAngleDeg: The crank angles in degrees, see kinematics.solveJointAngles.
+    :return: The knee and hip angle rates, in degrees per degree of crank angle.
+    """
+    derivatives = solveJointAngleDerivatives(frame, rc, crankAngleDeg)
+
+    return derivatives.kneeRate, derivatives.hipRate
+
+
+def gatherIndices(mask, count):
+    """
+    Gather the indices of the True values along the last axis, padded to the same count for every configuration.
+
+    :param mask: Boolean array of shape S + (N,).
+    :param count: The number of indices to gather.
+    :return: The indices and whether each was True, both with shape S + (count,).
+    """
+    idx = np.argsort(~mask, axis=-1, kind='stable')[..., :count]
+    return idx, np.take_along_axis(mask, idx, axis=-1)
+
+
+def findExtrema(frame, rc, coarseSamples=36, xtol=1e-3, maxIterations=30, params=()):
+    """
+    Find the knee and hip angle extrema over a crank revolution, and the crank angles they occur at.
+
+    A coarse uniform pass finds the samples that are local extrema. Each is bracketed by its neighbouring samples,
+    and the root of the exact angle rate within the bracket is found with the Illinois method, with every bracket of
+    every configuration refined together. Only the extrema are refined, so far fewer crank angles are solved than
+    a uniform grid of the same precision would need.
+
+    Where some crank angles can't be reached, the legs are straight or fully bent at the edges of the unreachable
+    ranges, so the extrema can be there instead. These edges are found by bisection between the coarse samples
+    either side, so cost EDGE_ITERATIONS solves each.
+
+    :param frame: The frame dictionary, see kinematics.calcFrame. Values may be arrays.
+    :param rc: The rider configuration dictionary. Values may be arrays.
+    :param coarseSamples: The number of crank angles in the coarse pass.
+    :param xtol: The bracket width in degrees of crank angle to stop refining at.
+    :param maxIterations: The maximum number of refining iterations.
+    :param params: Configuration keys from kinematics.SENSITIVITY_PARAMS to calculate the extrema sensitivities to.
+    :return: A dictionary of EXTREMA_STATS, their crank angles as kneeMinCrankAngle and so on, and the reachable
+             flags, with shape S. Also the number of crank angles solved per configuration, as solves. With params,
+             also sensitivity, a dictionary of EXTREMA_STATS to dictionaries of params to arrays with shape S.
+    """
+    crankStep = 360.0 / coarseSamples
+    crankAngles = np.arange(coarseSamples) * crankStep
+    kneeAngle, hipAngle, reachable = solveJointAngles(frame, rc, crankAngles)
+    solves = coarseSamples
+
+    # Local extrema of the coarse samples, as maxima of sign * angle. Comparisons with NaN are False, so samples
+    # next to unreachable crank angles aren't refined.
+    candidates = []
+    for stat, angles, sign in (('kneeMin', kneeAngle, -1.0), ('kneeMax', kneeAngle, 1.0),
+                               ('hipMin', hipAngle, -1.0), ('hipMax', hipAngle, 1.0)):
+        values = sign * angles
+        isPeak = (values >= np.roll(values, 1, axis=-1)) & (values > np.roll(values, -1, axis=-1))
+        count = max(int(np.max(np.count_nonzero(isPeak, axis=-1))), 1)
+        idx, valid = gatherIndices(isPeak, count)
+        candidates.append((stat, sign, idx, valid))
+
+    # Refine every candidate together, along one candidate axis
+    isKnee = np.concatenate([np.full(idx.shape, stat.startswith('knee')) for stat, _, idx, _ in candidates], axis=-1)
+    signs = np.concatenate([np.full(idx.shape, sign) for _, sign, idx, _ in candidates], axis=-1)
+    centre = np.concatenate([crankAngles[idx] for _, _, idx, _ in candidates], axis=-1)
+    active = np.concatenate([valid for _, _, _, valid in candidates], axis=-1)
+
+    def rate(crankAngleDeg):
+        kneeRate, hipRate = calcAngleRates(frame, rc, crankAngleDeg)
+        return signs * np.where(isKnee, kneeRate, hipRate)
+
+    # The rate of sign * angle falls through zero at each maximum
+    lower = centre - crankStep
+    upper = centre + crankStep
+    lowerRate = rate(lower)
+    upperRate = rate(upper)
+    solves += 2 * centre.shape[-1]
+
+    # Brackets reaching crank angles the legs can't reach have an unreachable range edge between the centre and
+    # that end, even when the coarse samples miss the range
+    nearEdges = [(active & np.isnan(lowerRate), lower), (active & np.isnan(upperRate), upper)]
+    active &= (lowerRate > 0) & (upperRate < 0)
+    lowerRate = np.where(active, lowerRate, 1.0)
+    upperRate = np.where(active, upperRate, -1.0)
+
+    side = np.zeros(centre.shape, dtype=int)
+    for iteration in range(maxIterations):
+        active &= (upper - lower) > xtol
+        if not np.any(active):
+            break
+
+        # False position, falling back to bisection if it leaves the bracket
+        guess = upper - (upperRate * (upper - lower) / (upperRate - lowerRate))
+        guess = np.where(np.isfinite(guess) & (guess > lower) & (guess < upper), guess, (lower + upper) / 2)
+        guessRate = rate(guess)
+        solves += centre.shape[-1]
+
+        # The guess can land in an unreachable range too narrow for the coarse samples to find
+        unreachable = active & np.isnan(guessRate)
+        if np.any(unreachable):
+            nearEdges.append((unreachable, guess))
+            active &= ~unreachable
+
+        # Keep the bracket, halving the rate at an end kept twice in a row so both ends converge
+        moveLower = active & (guessRate > 0)
+        moveUpper = active & ~(guessRate > 0)
+        upperRate = np.where(moveLower & (side == 1), upperRate / 2, upperRate)
+        lowerRate = np.where(moveUpper & (side == -1), lowerRate / 2, lowerRate)
+        lower = np.where(moveLower, guess, lower)
+        lowerRate = np.where(moveLower, guessRate, lowerRate)
+        upper = np.where(moveUpper, guess, upper)
+        upperRate = np.where(moveUpper, guessRate, upperRate)
+        side = np.where(moveLower, 1, np.where(moveUpper, -1, side))
+
+    # Angles at the refined crank angles, interpolating the rate's root within the final bracket
+    refinedCrank = np.where(active | (upper - lower <= xtol),
+                            lower - (lowerRate * (upper - lower) / (upperRate - lowerRate)), centre)
+    refinedCrank = np.where(np.isfinite(refinedCrank), refinedCrank, centre)
+    refinedKnee, refinedHip, refinedReachable = solveJointAngles(frame, rc, refinedCrank)
+    solves += centre.shape[-1]
+    refinedValues = signs * np.where(isKnee, refinedKnee, refinedHip)
+    refinedValues = np.where(refinedReachable, refinedValues, np.nan)
+
+    # Edges of unreachable ranges of crank angles, from coarse samples either side of them and from the brackets
+    isEdge = reachable != np.roll(reachable, -1, axis=-1)
+    idx, edgeValid = gatherIndices(isEdge, int(np.max(np.count_nonzero(isEdge, axis=-1))))
+    lower = [crankAngles[idx]] + [centre for _, _ in nearEdges]
+    upper = [crankAngles[idx] + crankStep] + [end for _, end in nearEdges]
+    lowerReachable = [np.take_along_axis(reachable, idx, axis=-1)] + [np.ones(centre.shape, dtype=bool) for _ in nearEdges]
+    edgeValid = np.concatenate([edgeValid] + [valid for valid, _ in nearEdges], axis=-1)
+    hasEdges = np.any(edgeValid)
+    if hasEdges:
+        lower = np.concatenate(lower, axis=-1)
+        upper = np.concatenate(upper, axis=-1)
+        lowerReachable = np.concatenate(lowerReachable, axis=-1)
+
+        # Angles change with the square root of the distance from an edge, so bisect to near machine precision
+        for iteration in range(EDGE_ITERATIONS):
+            middle = (lower + upper) / 2
+            _, _, middleReachable = solveJointAngles(frame, rc, middle)
+            solves += edgeValid.shape[-1]
+            moveLower = middleReachable == lowerReachable
+            lower = np.where(moveLower, middle, lower)
+            upper = np.where(moveLower, upper, middle)
+        edgeCrank = np.where(lowerReachable, lower, upper)
+        edgeKnee, edgeHip, _ = solveJointAngles(frame, rc, edgeCrank)
+        solves += edgeValid.shape[-1]
+        edgeKnee = np.where(edgeValid, edgeKnee, np.nan)
+        edgeHip = np.where(edgeValid, edgeHip, np.nan)
+
+    result = {'reachable': np.all(reachable, axis=-1) & ~np.any(edgeValid, axis=-1), 'solves': solves}
+    start = 0
+    for stat, sign, idx, valid in candidates:
+        stop = start + idx.shape[-1]
+        angles = kneeAngle if stat.startswith('knee') else hipAngle
+
+        # The best of the refined candidates, the unreachable range edges and every coarse sample
+        values = [np.where(valid, refinedValues[..., start:stop], np.nan), sign * angles]
+        crank = [refinedCrank[..., start:stop], np.broadcast_to(crankAngles, angles.shape)]
+        if hasEdges:
+            values.append(sign * (edgeKnee if stat.startswith('knee') else edgeHip))
+            crank.append(edgeCrank)
+        values = np.concatenate(values, axis=-1)
+        crank = np.concatenate(crank, axis=-1)
+        best = np.argmax(np.where(np.isnan(values), -np.inf, values), axis=-1)[..., np.newaxis]
+        anyReachable = np.any(~np.isnan(values), axis=-1)
+        result[stat] = np.where(anyReachable, sign * np.take_along_axis(values, best, axis=-1)[..., 0], np.nan)
+        result[stat + 'CrankAngle'] = np.where(anyReachable, np.take_along_axis(crank, best, axis=-1)[..., 0] % 360.0, np.nan)
+        start = stop
+
+    # The rate is zero at an extremum, so by the envelope theorem the extremum changes with a configuration value
+    # as the angle does at that crank angle. This doesn't hold at the edge of an unreachable range.
+    if len(params) > 0:
+        extremaCrank = np.stack([result[stat + 'CrankAngle'] for stat in EXTREMA_STATS], axis=-1)
+        derivatives = solveJointAngleDerivatives(frame, rc, extremaCrank, params)
+        result['sensitivity'] = {}
+        for i, stat in enumerate(EXTREMA_STATS):
+            sensitivity = derivatives.kneeSensitivity if stat.startswith('knee') else derivatives.hipSensitivity
+            result['sensitivity'][stat] = {param: np.where(result['reachable'], sensitivity[param][..., i], np.nan)
+                                           for param in params}
+        solves += len(EXTREMA_STATS)
+        result['solves'] = solves
+
+    return result
+
+
+
+if __name__ == '__main__':
+    with open('bike.json') as f:
+        bc = json.load(f)
+    with open('rider.json') as f:
+        rcs = json.load(f)
+    frame = calcFrame(bc)
+
+    for riderName, rc in rcs.items():
+        startTime = time.perf_counter()
+        extrema = findExtrema(frame, rc)
+        elapsed = time.perf_counter() - startTime
+        print('%s, %d crank angles solved in %.2f ms' % (riderName, extrema['solves'], 1000 * elapsed))
+        for stat in EXTREMA_STATS:
+            print('    %s: %.4f deg at %.3f deg' % (stat, extrema[stat], extrema[stat + 'CrankAngle']))
+
+    # Sensitivity report for the first rider
+    extrema = findExtrema(frame, rcs['rider1'], params=SENSITIVITY_PARAMS)
+    print('\nrider1 extrema sensitivities, in degrees per unit')
+    print('%-24s' % '' + ''.join('%12s' % stat for stat in EXTREMA_STATS))
+    for param in SENSITIVITY_PARAMS:
+        print('%-24s' % param + ''.join('%12.4f' % extrema['sensitivity'][stat][param] for stat in EXTREMA_STATS))
@@ -0,0 +1,182 @@
+import json
+import numpy as np
+
+from kinematics import calcFrame, calcHipPos, solveJointAngles
+
+
+FEASIBILITY_STATS = ('legFeasible', 'legAlwaysFeasible', 'legFeasibleFraction', 'upperFeasible')
+FEASIBILITY_FLAGS = ('legFeasible', 'legAlwaysFeasible', 'upperFeasible')
+
+
+def calcAssemblyBand(O2ALen, ABLen, BO4Len):
+    """
+    Calculate the range of ground link lengths a four bar link can be assembled with, at some input angle.
+    By the triangle inequality, the distance from A to O4 must lie between the difference and the sum of the
+    coupler and output lengths, and A is within the input length of O2.
+
+    :param O2ALen: The length(s) of the input link.
+    :param ABLen: The length(s) of the coupler link.
+    :param BO4Len: The length(s) of the output link.
+    :return: The smallest and largest O2-O4 lengths.
+    """
+    return np.maximum(np.abs(ABLen - BO4Len) - O2ALen, 0.0), ABLen + BO4Len + O2ALen
+
+
+def calcGrashofBand(O2ALen, ABLen, BO4Len):
+    """
+    Calculate the range of ground link lengths a four bar link can be assembled with at every input angle.
+    This is the Grashof condition for the input link being a crank, so it can make full revolutions.
+
+    :param O2ALen: The length(s) of the input link.
+    :param ABLen: The length(s) of the coupler link.
+    :param BO4Len: The length(s) of the output link.
+    :return: The smallest and largest O2-O4 lengths. The band is empty when the smallest is larger.
+    """
+    return np.abs(ABLen - BO4Len) + O2ALen, ABLen + BO4Len - O2ALen
+
+
+def calcPedalCircle(frame, rc):
+    """
+    Calculate where the hip is relative to the pedal circle around the bottom bracket.
+
+    :param frame: The frame dictionary, see kinematics.calcFrame. Values may be arrays.
+    :param rc: The rider configuration dictionary. Values may be arrays.
+    :return: The bottom bracket to hip distance, the angle of the hip from the bottom bracket in radians, and the
+             crank length.
+    """
+    hip = calcHipPos(frame, rc)
+    return np.hypot(hip[..., 0], hip[..., 1]), np.arctan2(hip[..., 1], hip[..., 0]), np.asarray(frame['crankLength'], dtype=float)
+
+
+def calcCrankArcs(hipDist, hipAngle, crankLength, minDist, maxDist):
+    """
+    Calculate the crank angles where the hip to pedal distance lies within a band.
+
+    The pedal distance only depends on the angle between the crank and the hip, so the band gives two arcs
+    placed symmetrically about the hip direction, which join into one when the band covers the nearest or
+    furthest pedal position.
+
+    :param hipDist: The bottom bracket to hip distance(s).
+    :param hipAngle: The angle(s) of the hip from the bottom bracket, in radians.
+    :param crankLength: The crank length(s).
+    :param minDist: The smallest hip to pedal distance(s) in the band.
+    :param maxDist: The largest hip to pedal distance(s) in the band.
+    :return: The arcs, with shape S + (2, 2) holding the start and end crank angle of each arc in degrees. Arcs
+             run from start to end in increasing crank angle, starting in [0, 360). Empty arcs are NaN.
+    """
+    # Cosine rule for the angle between the crank and the hip direction, at the edges of the band
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cosNear = ((hipDist**2) + (crankLength**2) - (minDist**2)) / (2 * hipDist * crankLength)
+        cosFar = ((hipDist**2) + (crankLength**2) - (maxDist**2)) / (2 * hipDist * crankLength)
+    empty = (minDist > maxDist) | (cosFar > 1.0) | (cosNear < -1.0)
+    nearAngle = np.arccos(np.clip(cosNear, -1.0, 1.0))
+    farAngle = np.arccos(np.clip(cosFar, -1.0, 1.0))
+
+    # The pedal angle is minus the crank angle
+    starts = np.stack(np.broadcast_arrays(-hipAngle - farAngle, -hipAngle + nearAngle), axis=-1)
+    ends = starts + (farAngle - nearAngle)[..., np.newaxis]
+    arcs = np.degrees(np.stack([starts, ends], axis=-1))
+    arcs -= 360.0 * np.floor(arcs[..., 0:1] / 360.0)
+
+    return np.where(empty[..., np.newaxis, np.newaxis], np.nan, arcs)
+
+
+def inCrankArcs(crankAngleDeg, arcs):
+    """
+    Check which crank angles lie on a set of arcs.
+
+    :param crankAngleDeg: A 1D array of crank angles in degrees.
+    :param arcs: The arcs, with shape S + (M, 2), see calcCrankArcs.
+    :return: The flags, with shape S + (N,).
+    """
+    crankAngleDeg = np.asarray(crankAngleDeg, dtype=float)
+    starts = arcs[..., np.newaxis, 0]
+    offsets = np.mod(crankAngleDeg - starts, 360.0)
+    return np.any(offsets <= arcs[..., np.newaxis, 1] - starts, axis=-2)
+
+
+def calcLegArcs(frame, rc, always=False):
+    """
+    Calculate the crank angles where the legs can be assembled.
+
+    The ankle lies within the foot lever length of the pedal, whatever the foot angle, so the legs can only be
+    assembled where the hip to pedal distance is in the assembly band of the leg four bar link, and are always
+    assembled where it is in the Grashof band.
+
+    :param frame: The frame dictionary, see kinematics.calcFrame. Values may be arrays.
+    :param rc: The rider configuration dictionary. Values may be arrays.
+    :param always: Whether to give the arcs where the legs are always assembled, instead of where they might be.
+    :return: The arcs, with shape S + (2, 2), see calcCrankArcs.
+    """
+    footLeverLength = np.asarray(rc['footContactProportion'], dtype=float) * rc['footLength']
+    band = calcGrashofBand if always else calcAssemblyBand
+    minDist, maxDist = band(footLeverLength, np.asarray(rc['knee2AnkleLength'], dtype=float), rc['hip2KneeLength'])
+
+    return calcCrankArcs(*calcPedalCircle(frame, rc), minDist, maxDist)
+
+
+def screenFeasibility(frame, rc):
+    """
+    Screen configurations for whether the rider can be assembled, without solving any crank angles.
+
+    Configurations that fail legFeasible can't reach the pedals at any crank angle, so don't need solving. Those
+    passing legAlwaysFeasible reach the pedals at every crank angle. The rest only reach over part of the crank
+    circle, bounded by legFeasibleFraction. The torso angle is fixed when solving, so upperFeasible only says
+    whether some torso angle lets the arms reach the hands.
+
+    :param frame: The frame dictionary, see kinematics.calcFrame. Values may be arrays.
+    :param rc: The rider configuration dictionary. Values may be arrays.
+    :return: A dictionary of FEASIBILITY_STATS to arrays with shape S.
+    """
+    hipDist, hipAngle, crankLength = calcPedalCircle(frame, rc)
+    footLeverLength = np.asarray(rc['footContactProportion'], dtype=float) * rc['footLength']
+    knee2AnkleLength = np.asarray(rc['knee2AnkleLength'], dtype=float)
+    hip2KneeLength = np.asarray(rc['hip2KneeLength'], dtype=float)
+
+    # Legs, from the nearest and furthest pedal positions
+    nearDist = np.abs(hipDist - crankLength)
+    farDist = hipDist + crankLength
+    minDist, maxDist = calcAssemblyBand(footLeverLength, knee2AnkleLength, hip2KneeLength)
+    minAlwaysDist, maxAlwaysDist = calcGrashofBand(footLeverLength, knee2AnkleLength, hip2KneeLength)
+    arcs = calcCrankArcs(hipDist, hipAngle, crankLength, minDist, maxDist)
+    arcLength = np.nansum(arcs[..., 1] - arcs[..., 0], axis=-1)
+
+    # Arms, with the shoulder anywhere on a circle around the hip
+    hip = calcHipPos(frame, rc)
+    hip2Hands = np.hypot(frame['handsPosX'] - hip[..., 0], frame['handsPosY'] - hip[..., 1])
+    minHandsDist, maxHandsDist = calcAssemblyBand(np.asarray(rc['hip2ShoulderLength'], dtype=float),
+                                                  np.asarray(rc['shoulder2ElbowLength'], dtype=float),
+                                                  rc['elbow2WristContactLength'])
+
+    return {'legFeasible': (farDist >= minDist) & (nearDist <= maxDist) & (minDist <= maxDist),
+            'legAlwaysFeasible': (nearDist >= minAlwaysDist) & (farDist <= maxAlwaysDist),
+            'legFeasibleFraction': np.minimum(arcLength / 360.0, 1.0),
+            'upperFeasible': (hip2Hands >= minHandsDist) & (hip2Hands <= maxHandsDist)}
+
+
+def takeConfigs(config, mask):
+    """
+    Select the configurations where a mask is set, from a configuration dictionary that may hold arrays.
+
+    :param config: The frame or rider configuration dictionary. Array values must broadcast to the mask.
+    :param mask: The boolean mask.
+    :return: A configuration dictionary with 1D arrays of the selected values. Scalar values are kept as they are.
+    """
+    return {key: np.broadcast_to(value, mask.shape)[mask] if np.ndim(value) > 0 else value for key, value in config.items()}
+
+
+
+if __name__ == '__main__':
+    with open('bike.json') as f:
+        bc = json.load(f)
+    with open('rider.json') as f:
+        rcs = json.load(f)
+
+    frame = calcFrame(bc)
+    crankAngles = np.linspace(0, 360, 360, endpoint=False)
+    for name, rc in rcs.items():
+        screen = screenFeasibility(frame, rc)
+        _, _, reachable = solveJointAngles(frame, rc, crankAngles)
+        print('%10s legs: %-5s always: %-5s arms: %-5s at most %.0f%% of the crank circle, solved %.0f%%' % (
+            name, screen['legFeasible'], screen['legAlwaysFeasible'], screen['upperFeasible'],
+            100.0 * screen['legFeasibleFraction'], 100.0 * np.mean(reachable)))
@@ -0,0 +1,532 @@
+import argparse
+import asyncio
+import collections
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from kinematics import calcFrame
+from population import POPULATION_STATS, RiderBatch
+from resultCache import canonicalConfig
+
+
+# Every key of bike.json and of a rider in rider.json must be given
+BIKE_KEYS = ('chainStay', 'wheelBase', 'wheelDiameter', 'seatTube', 'seatStay', 'bottomBracketDrop', 'forkLength',
+             'downTube', 'topTube', 'headTube', 'handleBarPost', 'handleBarLength', 'handleBar2FrontWheel',
+             'crankLength', 'leverLength')
+RIDER_KEYS = ('seatHeight', 'seatLengthFwd', 'seatLengthAft', 'seatRiderOffsetX', 'seatRiderOffsetY',
+              'hip2ShoulderLength', 'hip2KneeLength', 'knee2AnkleLength', 'footLength', 'footContactProportion',
+              'pedalLength', 'shoulder2ElbowLength', 'elbow2WristContactLength', 'wrist2FingerHoldPoint',
+              'hip2HorizontalAngleDeg')
+
+DEFAULT_SAMPLES = 360
+MAX_SAMPLES = 3600
+MAX_BODY_BYTES = 1024 * 1024
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class FitServiceError(Exception):
+    """
+    Raised by FitClient when the service returns an error.
+    """
+    def __init__(self, status, message):
+        super().__init__('%d %s' % (status, message))
+        self.status = status
+        self.message = message
+
+
+def encodeJSON(value):
+    """
+    Encode a response as JSON bytes, with NaN as null.
+    """
+    def convert(value):
+        if isinstance(value, dict):
+            return {key: convert(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [convert(item) for item in value]
+        if isinstance(value, float) and not math.isfinite(value):
+            return None
+        return value
+
+    return json.dumps(convert(value), separators=(',', ':'), allow_nan=False).encode('utf-8')
+
+
+def errorBody(message):
+    return encodeJSON({'error': message})
+
+
+def parseRequest(body):
+    """
+    Parse and check a cycle request.
+
+    A request is a JSON object with a bike configuration, a rider configuration, and optionally the number of
+    crank angles per revolution and whether to return the knee and hip angles at every crank angle:
+    {"bike": {...}, "rider": {...}, "samples": 360, "traces": false}
+
+    :param body: The request body bytes.
+    :return: The bike configuration, rider configuration, samples and traces flag.
+    """
+    try:
+        request = json.loads(body)
+    except ValueError:
+        raise ValueError('The request body must be JSON.')
+    if not isinstance(request, dict):
+        raise ValueError('The request must be a JSON object.')
+
+    configs = []
+    for name, keys in (('bike', BIKE_KEYS), ('rider', RIDER_KEYS)):
+        config = request.get(name)
+        if not isinstance(config, dict):
+            raise ValueError('The request must have a %s configuration object.' % name)
+        missing = [key for key in keys if key not in config]
+        if len(missing) > 0:
+            raise ValueError('The %s configuration is missing %s.' % (name, ', '.join(missing)))
+        for key in keys:
+            value = config[key]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise ValueError('The %s configuration value %s must be a number.' % (name, key))
+        configs.append({key: float(config[key]) for key in keys})
+
+    samples = request.get('samples', DEFAULT_SAMPLES)
+    if isinstance(samples, bool) or not isinstance(samples, int) or not 1 <= samples <= MAX_SAMPLES:
+        raise ValueError('samples must be an integer from 1 to %d.' % MAX_SAMPLES)
+    traces = request.get('traces', False)
+    if not isinstance(traces, bool):
+        raise ValueError('traces must be true or false.')
+
+    return configs[0], configs[1], samples, traces
+
+
+def calcConfigKey(config):
+    """
+    :return: A canonical string for a configuration dictionary, for matching identical requests.
+    """
+    return json.dumps(canonicalConfig(config), sort_keys=True, separators=(',', ':'))
+
+
+# Frames solved by this worker process, by bike configuration key
+workerFrames = collections.OrderedDict()
+WORKER_FRAMES = 64
+
+
+def getWorkerFrame(bikeKey, bc):
+    """
+    Get the frame for a bike configuration, reusing it across batches in this worker process.
+    """
+    frame = workerFrames.get(bikeKey)
+    if frame is None:
+        try:
+            frame = calcFrame(bc)
+        except (ValueError, ZeroDivisionError):
+            raise ValueError('The frame can\'t be built from the bike configuration.')
+        workerFrames[bikeKey] = frame
+        if len(workerFrames) > WORKER_FRAMES:
+            workerFrames.popitem(last=False)
+    else:
+        workerFrames.move_to_end(bikeKey)
+
+    return frame
+
+
+def evaluateRequests(requests):
+    """
+    Evaluate a batch of cycle requests in a worker process. Riders on the same bike with the same number of crank
+    angles are solved together as a RiderBatch.
+
+    :param requests: A list of (bike key, bike configuration, rider configuration, samples, traces) tuples.
+    :return: A list of (HTTP status, JSON body bytes) tuples, in request order.
+    """
+    groups = collections.defaultdict(list)
+    for i, (bikeKey, bc, rc, samples, traces) in enumerate(requests):
+        groups[(bikeKey, samples)].append(i)
+
+    results = [None] * len(requests)
+    for (bikeKey, samples), idx in groups.items():
+        crankAngles = np.linspace(0, 360, samples, endpoint=False)
+        try:
+            frame = getWorkerFrame(bikeKey, requests[idx[0]][1])
+        except ValueError as e:
+            for i in idx:
+                results[i] = (400, errorBody(str(e)))
+            continue
+
+        batch = RiderBatch.fromConfigs([requests[i][2] for i in idx])
+        metrics, angleTraces = batch.evaluate(frame, crankAngles, traces=True)
+        for j, i in enumerate(idx):
+            response = {'extrema': {stat: metrics[stat][j].item() for stat in POPULATION_STATS}}
+            if requests[i][4]:
+                response['traces'] = {'crankAngle': crankAngles.tolist(),
+                                      'kneeAngle': angleTraces[j, 0].astype(float).tolist(),
+                                      'hipAngle': angleTraces[j, 1].astype(float).tolist()}
+            results[i] = (200, encodeJSON(response))
+
+    return results
+
+
+class FitService:
+    """
+    An asyncio HTTP service that evaluates riders on bikes over a crank revolution.
+
+    POST /cycle takes a request as in parseRequest, and returns the rider's POPULATION_STATS, and optionally the
+    knee and hip angles at every crank angle. GET /stats returns the service counters.
+
+    Recent responses are kept in an in-memory LRU, and identical requests that are already being solved wait for
+    the same result instead of being solved again. Other requests go on a bounded queue, and are rejected with
+    503 when it is full, so clients back off instead of the server's memory growing. Dispatchers take the queued
+    requests in batches and solve them in a process pool, so the event loop only parses and routes.
+    """
+    def __init__(self, workers=None, queueSize=1024, cacheSize=4096, maxBatch=64):
+        """
+        :param workers: The number of worker processes, defaults to the CPU count.
+        :param queueSize: The number of requests that may wait to be solved.
+        :param cacheSize: The number of responses kept in the LRU.
+        :param maxBatch: The most requests sent to a worker at once.
+        """
+        self.workers = workers or os.cpu_count()
+        self.queueSize = queueSize
+        self.cacheSize = cacheSize
+        self.maxBatch = maxBatch
+
+        self.queue = None
+        self.executor = None
+        self.dispatchers = []
+        self.server = None
+        # Open connection writers to their readers
+        self.connections = {}
+
+        # Request keys to (status, body) responses, least recently used first
+        self.cache = collections.OrderedDict()
+        # Request keys to futures of the requests being solved
+        self.inflight = {}
+
+        self.counters = {'requests': 0, 'hits': 0, 'coalesced': 0, 'solved': 0, 'rejected': 0, 'batches': 0}
+
+    async def start(self, host='127.0.0.1', port=8765, unixPath=None):
+        """
+        Start the worker pool and listen for connections.
+
+        :param host: The host to listen on.
+        :param port: The TCP port to listen on. Use 0 for any free port.
+        :param unixPath: A Unix socket path to listen on instead of TCP.
+        :return: The asyncio server.
+        """
+        self.queue = asyncio.Queue(self.queueSize)
+        self.executor = ProcessPoolExecutor(self.workers)
+        self.dispatchers = [asyncio.create_task(self.dispatch()) for i in range(self.workers)]
+        if unixPath is not None:
+            self.server = await asyncio.start_unix_server(self.handleConnection, unixPath)
+        else:
+            self.server = await asyncio.start_server(self.handleConnection, host, port)
+
+        return self.server
+
+    async def close(self, timeout=5.0):
+        """
+        Stop listening, answer the requests being solved with 503, close the open connections, and shut down the
+        dispatchers and worker pool.
+
+        :param timeout: The seconds to wait for connections to send their last response, after which they're dropped.
+        """
+        if self.server is not None:
+            self.server.close()
+        # Idle keep-alive connections see the end of their stream, and busy ones close after their response
+        for reader in self.connections.values():
+            reader.feed_eof()
+        for dispatcher in self.dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        for future in self.inflight.values():
+            if not future.done():
+                future.set_result((503, errorBody('The service is shutting down.')))
+        self.inflight.clear()
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*[writer.wait_closed() for writer in self.connections],
+                                                  return_exceptions=True), timeout)
+        except asyncio.TimeoutError:
+            # Drop connections whose clients aren't reading their response
+            for writer in self.connections:
+                writer.transport.abort()
+        if self.server is not None:
+            await self.server.wait_closed()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    async def evaluate(self, bc, rc, samples=DEFAULT_SAMPLES, traces=False):
+        """
+        Evaluate a request, from the LRU, an identical request being solved, or the worker pool.
+
+        :return: The HTTP status and JSON body bytes.
+        """
+        self.counters['requests'] += 1
+        bikeKey = calcConfigKey(bc)
+        key = '%s|%s|%d|%d' % (bikeKey, calcConfigKey(rc), samples, traces)
+
+        response = self.cache.get(key)
+        if response is not None:
+            self.cache.move_to_end(key)
+            self.counters['hits'] += 1
+            return response
+
+        future = self.inflight.get(key)
+        if future is not None:
+            self.counters['coalesced'] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((key, future, (bikeKey, bc, rc, samples, traces)))
+        except asyncio.QueueFull:
+            self.counters['rejected'] += 1
+            return 503, errorBody('The service is busy, try again later.')
+        self.inflight[key] = future
+
+        return await asyncio.shield(future)
+
+    async def dispatch(self):
+        """
+        Send batches of queued requests to the worker pool, and resolve their futures.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            jobs = [await self.queue.get()]
+            while len(jobs) < self.maxBatch and not self.queue.empty():
+                jobs.append(self.queue.get_nowait())
+
+            try:
+                results = await loop.run_in_executor(self.executor, evaluateRequests, [job[2] for job in jobs])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                results = [(500, errorBody('Evaluation failed: %s' % e))] * len(jobs)
+            self.counters['batches'] += 1
+            self.counters['solved'] += len(jobs)
+
+            for (key, future, request), response in zip(jobs, results):
+                if response[0] != 500:
+                    self.cache[key] = response
+                    if len(self.cache) > self.cacheSize:
+                        self.cache.popitem(last=False)
+                del self.inflight[key]
+                future.set_result(response)
+
+    async def route(self, method, path, body):
+        """
+        :return: The HTTP status and JSON body bytes for a request.
+        """
+        if path == '/cycle':
+            if method != 'POST':
+                return 405, errorBody('Use POST for /cycle.')
+            try:
+                bc, rc, samples, traces = parseRequest(body)
+            except ValueError as e:
+                return 400, errorBody(str(e))
+            return await self.evaluate(bc, rc, samples, traces)
+        elif path == '/stats':
+            return 200, encodeJSON(dict(self.counters, queued=self.queue.qsize(), inflight=len(self.inflight),
+                                        cached=len(self.cache)))
+
+        return 404, errorBody('Unknown path %s.' % path)
+
+    async def handleConnection(self, reader, writer):
+        """
+        Serve HTTP/1.1 requests on a connection, keeping it open between requests until the service closes.
+        """
+        self.connections[writer] = reader
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+                parts = requestLine.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                keepAlive = len(parts) == 3 and parts[2] == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                if len(parts) != 3 or length < 0:
+                    status, body = 400, errorBody('Malformed request.')
+                    keepAlive = False
+                elif length > MAX_BODY_BYTES:
+                    status, body = 413, errorBody('The request body must be at most %d bytes.' % MAX_BODY_BYTES)
+                    keepAlive = False
+                else:
+                    status, body = await self.route(parts[0], parts[1], await reader.readexactly(length))
+                    # Tell the client the connection won't be reused once the service is closing
+                    keepAlive = keepAlive and self.server.is_serving()
+
+                writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n%s\r\n' % (
+                    status, HTTP_REASONS[status].encode('latin-1'), len(body),
+                    b'' if keepAlive else b'Connection: close\r\n') + body)
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self.connections[writer]
+            writer.close()
+
+
+class FitClient:
+    """
+    A client for FitService, keeping one HTTP/1.1 connection open. Requests on one client are sent one at a time,
+    so use several clients for concurrent requests.
+    """
+    def __init__(self, host='127.0.0.1', port=8765, unixPath=None):
+        """
+        :param host: The service host.
+        :param port: The service TCP port.
+        :param unixPath: The service Unix socket path, used instead of TCP if given.
+        """
+        self.host = host
+        self.port = port
+        self.unixPath = unixPath
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        if self.unixPath is not None:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.unixPath)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.writer = None
+
+    async def request(self, method, path, payload=None):
+        """
+        Send a request and read its response.
+
+        :param method: The HTTP method.
+        :param path: The request path.
+        :param payload: Optional JSON body.
+        :return: The HTTP status and the decoded JSON response.
+        """
+        body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        async with self.lock:
+            if self.writer is None:
+                await self.connect()
+            self.writer.write(b'%s %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n' % (
+                method.encode('latin-1'), path.encode('latin-1'), self.host.encode('latin-1'), len(body)) + body)
+            await self.writer.drain()
+
+            status = int((await self.reader.readline()).split()[1])
+            headers = {}
+            while True:
+                line = await self.reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            response = json.loads(await self.reader.readexactly(int(headers['content-length'])))
+            if headers.get('connection', '').lower() == 'close':
+                await self.close()
+
+        return status, response
+
+    async def evaluate(self, bc, rc, samples=DEFAULT_SAMPLES, traces=False):
+        """
+        Evaluate a rider on a bike.
+
+        :param bc: The bike configuration dictionary, as in bike.json.
+        :param rc: The rider configuration dictionary, as in rider.json.
+        :param samples: The number of crank angles per revolution.
+        :param traces: Whether to also return the knee and hip angles at every crank angle.
+        :return: The response dictionary, with extrema and optionally traces. Unavailable values are None, and the
+                 traces have single precision, as in RiderBatch.evaluate.
+        """
+        status, response = await self.request('POST', '/cycle', {'bike': bc, 'rider': rc, 'samples': samples, 'traces': traces})
+        if status != 200:
+            raise FitServiceError(status, response.get('error', ''))
+
+        return response
+
+
+async def serve(args):
+    service = FitService(args.workers, args.queue_size, args.cache_size)
+    await service.start(args.host, args.port, args.unix)
+    print('Serving on %s' % (args.unix or '%s:%d' % (args.host, args.port)))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.close()
+
+
+async def bench(args):
+    """
+    Send requests from many concurrent clients, drawn from a pool of distinct riders, and report the throughput.
+    """
+    with open(args.bike) as f:
+        bc = json.load(f)
+    with open(args.riders) as f:
+        rcs = list(json.load(f).values())
+    rng = np.random.default_rng(0)
+    riders = [{key: value * rng.normal(1.0, 0.02) for key, value in rcs[i % len(rcs)].items()} for i in range(args.distinct)]
+
+    clients = [FitClient(args.host, args.port, args.unix) for i in range(args.concurrency)]
+    latencies = []
+    rejected = []
+
+    async def run(client, count):
+        for i in range(count):
+            startTime = time.perf_counter()
+            try:
+                await client.evaluate(bc, riders[int(rng.integers(len(riders)))], args.samples)
+            except FitServiceError as e:
+                if e.status != 503:
+                    raise
+                rejected.append(time.perf_counter() - startTime)
+                continue
+            latencies.append(time.perf_counter() - startTime)
+        await client.close()
+
+    startTime = time.perf_counter()
+    await asyncio.gather(*[run(client, args.requests // args.concurrency) for client in clients])
+    elapsed = time.perf_counter() - startTime
+    status, stats = await FitClient(args.host, args.port, args.unix).request('GET', '/stats')
+    print('%d requests in %.2f s, %.0f requests/s, p50 %.2f ms, p99 %.2f ms, %d rejected as busy' % (
+        len(latencies), elapsed, len(latencies) / elapsed, 1e3 * np.percentile(latencies, 50), 1e3 * np.percentile(latencies, 99),
+        len(rejected)))
+    print('Service counters:', stats)
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve rider cycle evaluations over HTTP, or benchmark a running service.')
+    parser.add_argument('command', choices=('serve', 'bench'), help='Run the service, or send requests to one.')
+    parser.add_argument('--host', default='127.0.0.1', help='The host to listen on or connect to.')
+    parser.add_argument('--port', type=int, default=8765, help='The TCP port to listen on or connect to.')
+    parser.add_argument('--unix', help='A Unix socket path to use instead of TCP.')
+    parser.add_argument('--workers', type=int, help='The number of worker processes, defaults to the CPU count.')
+    parser.add_argument('--queue-size', type=int, default=1024, help='The number of requests that may wait to be solved.')
+    parser.add_argument('--cache-size', type=int, default=4096, help='The number of responses kept in memory.')
+    parser.add_argument('--bike', default='bike.json', help='The bike configuration file to benchmark with.')
+    parser.add_argument('--riders', default='rider.json', help='The rider configuration file to benchmark with.')
+    parser.add_argument('--requests', type=int, default=20000, help='The number of requests to benchmark with.')
+    parser.add_argument('--concurrency', type=int, default=64, help='The number of concurrent benchmark clients.')
+    parser.add_argument('--distinct', type=int, default=1000, help='The number of distinct riders to benchmark with.')
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES, help='The number of crank angles per revolution.')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args) if args.command == 'serve' else bench(args))
+    except KeyboardInterrupt:
+        pass
@@ -1,6 +1,5 @@
 import math
 import numpy as np
-import matplotlib.pyplot as plt
 
 
 class FourBarLink:
@@ -8,27 +7,35 @@ class FourBarLink:
     Adjusts for O2 and O4 not lying on the x axes.
     """
     def __init__(self, O2, O4, O2ALen, ABLen, BO4Len, theta2=0.0):
-        self.O2 = np.array(O2)
-        self.O4 = np.array(O4)
+        self.O2 = np.array(O2, dtype=float)
+        self.O4 = np.array(O4, dtype=float)
         self.O2ALen = O2ALen
         self.ABLen = ABLen
         self.BO4Len = BO4Len
         self.theta2 = theta2
 
-        self.O2s = None
-        self.O4s = None
+        # Points are updated in place, so solving doesn't allocate new arrays
+        self.O2s = np.zeros(2)
+        self.O4s = np.zeros(2)
 
-        self.O2n = None
-        self.O4n = None
-        self.Ann = None
-        self.Bnn = None
+        self.O2n = np.zeros(2)
+        self.O4n = np.zeros(2)
+        self.Ann = np.zeros(2)
+        self.Bnn = np.zeros(2)
+
+        self.adjustedO2O4Angle = None
+        self.rotCos = None
+        self.rotSin = None
+        self.rotMatrix = np.zeros((2, 2))
+        self.rotBackMatrix = np.zeros((2, 2))
+        self.solvedTheta2 = None
 
         # Rotate points to lie on the x axes
         self.translateAndRotate2XAxes()
 
         # Create horizontal 4 bar link
-        self.fourBar = FourBarHorizontalLink(self.O2s.tolist(), self.O4s.tolist(), self.O2ALen, self.ABLen, self.BO4Len, self.theta2 + self.adjustedO2O4Angle)
-        self.fourBar.calcAngles(self.theta2)
+        self.fourBar = FourBarHorizontalLink(self.O2s, self.O4s, self.O2ALen, self.ABLen, self.BO4Len, self.theta2 + self.adjustedO2O4Angle)
+        self.calcAngles(self.theta2)
 
         # Counter rotate resultant points
         self.rotateBack()
@@ -39,47 +46,86 @@ class FourBarLink:
         Rotate points so that O2 and O4 lie on the x axes.
         """
         # Shift O2 point to the origin
-        self.O2s = self.O2 - self.O2
-        self.O4s = self.O4 - self.O2
+        dx = self.O4[0] - self.O2[0]
+        dy = self.O4[1] - self.O2[1]
+
+        self.adjustedO2O4Angle = math.pi - math.atan2(-dy, -dx)
+        self.rotCos = math.cos(self.adjustedO2O4Angle)
+        self.rotSin = math.sin(self.adjustedO2O4Angle)
+        self.rotMatrix[0, 0] = self.rotCos
+        self.rotMatrix[0, 1] = -self.rotSin
+        self.rotMatrix[1, 0] = self.rotSin
+        self.rotMatrix[1, 1] = self.rotCos
+        self.rotBackMatrix[0, 0] = self.rotCos
+        self.rotBackMatrix[0, 1] = self.rotSin
+        self.rotBackMatrix[1, 0] = -self.rotSin
+        self.rotBackMatrix[1, 1] = self.rotCos
+        self.O2s[0] = 0.0
+        self.O2s[1] = 0.0
+        self.O4s[0] = (self.rotCos * dx) - (self.rotSin * dy)
+        self.O4s[1] = (self.rotSin * dx) + (self.rotCos * dy)
+
+        # The pinned points don't move when solving, so only need rotating back when they change
+        self.rotatePointBack(self.O2s, self.O2n)
+        self.rotatePointBack(self.O4s, self.O4n)
+
+    def rotatePointBack(self, point, out):
+        """
+        Rotate a point from the x axes back to the original axes.
 
-        self.adjustedO2O4Angle = math.pi - math.atan2(self.O2s[1] - self.O4s[1], self.O2s[0] - self.O4s[0])
-        rotMatrix = np.array([[math.cos(self.adjustedO2O4Angle), -math.sin(self.adjustedO2O4Angle)],
-                              [math.sin(self.adjustedO2O4Angle), math.cos(self.adjustedO2O4Angle)]])
-        self.O2s = np.dot(rotMatrix, self.O2s)
-        self.O4s = np.dot(rotMatrix, self.O4s)
+        :param point: The [x,y] coordinates on the x axes.
+        :param out: The array to write the [x,y] coordinates on the original axes to.
+        """
+        x = point[0]
+        y = point[1]
+        out[0] = (self.rotCos * x) + (self.rotSin * y) + self.O2[0]
+        out[1] = (self.rotCos * y) - (self.rotSin * x) + self.O2[1]
 
     def rotateBack(self):
         """
         Rotate the points back after solving the four bar link positions.
         """
-        rotMatrix = np.array([[math.cos(-self.adjustedO2O4Angle), -math.sin(-self.adjustedO2O4Angle)],
-                              [math.sin(-self.adjustedO2O4Angle), math.cos(-self.adjustedO2O4Angle)]])
-        self.O2n = np.dot(rotMatrix, np.array([[self.fourBar.O2[0]], [self.fourBar.O2[1]]])).flatten() + self.O2
-        self.O4n = np.dot(rotMatrix, np.array([[self.fourBar.O4[0]], [self.fourBar.O4[1]]])).flatten() + self.O2
-        self.Ann = np.dot(rotMatrix, np.array([[self.fourBar.An[0]], [self.fourBar.An[1]]])).flatten() + self.O2
-        self.Bnn = np.dot(rotMatrix, np.array([[self.fourBar.Bn1[0]], [self.fourBar.Bn1[1]]])).flatten() + self.O2
+        self.rotatePointBack(self.fourBar.An, self.Ann)
+        self.rotatePointBack(self.fourBar.Bn1, self.Bnn)
+        self.solvedTheta2 = self.theta2
+
+    def pivotsChanged(self, O2, O4):
+        """
+        Check whether new O2 or O4 points differ from the current ones.
+
+        :param O2: The [x,y] coordinates for the new O2 point.
+        :param O4: The [x,y] coordinates for the new O4 point.
+        """
+        return O2[0] != self.O2[0] or O2[1] != self.O2[1] or O4[0] != self.O4[0] or O4[1] != self.O4[1]
 
     def setO2O4Pt(self, O2, O4, theta2):
         """
         Update the O2 and O4 points.
+        Only the stages that depend on changed inputs are recalculated, so the rotation and coefficients are reused
+        when the points don't move, and nothing is solved when theta2 doesn't change either.
 
         :param O2: The [x,y] coordinates for the new point.
         :param O4: The [x,y] coordinates for the new point.
         :param theta2: The angle between the r2 line and the r1 line
         """
-        self.O2 = O2
-        self.O4 = O4
-        self.theta2 = theta2
+        if self.pivotsChanged(O2, O4):
+            self.O2[0] = O2[0]
+            self.O2[1] = O2[1]
+            self.O4[0] = O4[0]
+            self.O4[1] = O4[1]
 
-        # Rotate points to lie on the x axes
-        self.translateAndRotate2XAxes()
+            # Rotate points to lie on the x axes
+            self.translateAndRotate2XAxes()
 
-        # Update four bar link
-        self.fourBar = FourBarHorizontalLink(self.O2s.tolist(), self.O4s.tolist(), self.O2ALen, self.ABLen, self.BO4Len, self.theta2 + self.adjustedO2O4Angle)
-        self.calcAngles(self.theta2)
+            # Update four bar link
+            self.fourBar.setO2O4Pt(self.O2s, self.O4s)
+            self.solvedTheta2 = None
 
-        # Counter rotate resultant points
-        self.rotateBack()
+        if theta2 != self.solvedTheta2:
+            self.calcAngles(theta2)
+
+            # Counter rotate resultant points
+            self.rotateBack()
 
 
     def setO4Pt(self, O4, theta2):
@@ -89,18 +135,23 @@ class FourBarLink:
         :param O4: The [x,y] coordinates for the new point.
         :param theta2: The angle between the r2 line and the r1 line
         """
-        self.O4 = O4
-        self.theta2 = theta2
+        self.setO2O4Pt(self.O2, O4, theta2)
 
-        # Rotate points to lie on the x axes
-        self.translateAndRotate2XAxes()
 
-        # Update four bar link
-        self.fourBar.setO4Pt(self.O4s.tolist(), self.theta2 + self.adjustedO2O4Angle)
-        self.calcAngles(self.theta2)
+    def setLinkLengths(self, O2ALen, ABLen, BO4Len):
+        """
+        Update the link lengths. The link is solved again on the next call to setO2O4Pt.
 
-        # Counter rotate resultant points
-        self.rotateBack()
+        :param O2ALen: The length of the input link.
+        :param ABLen: The length of the coupler link.
+        :param BO4Len: The length of the output link.
+        """
+        if O2ALen != self.O2ALen or ABLen != self.ABLen or BO4Len != self.BO4Len:
+            self.O2ALen = O2ALen
+            self.ABLen = ABLen
+            self.BO4Len = BO4Len
+            self.fourBar.setLinkLengths(O2ALen, ABLen, BO4Len)
+            self.solvedTheta2 = None
 
 
     def calcAngles(self, theta2):
@@ -110,14 +161,105 @@ class FourBarLink:
 
 
 
+class FourBarLinkBatch:
+    """
+    Solves many four bar links at once using NumPy arrays.
+
+    Gives the same points as FourBarLink, but O2, O4, the link lengths and theta2 may all be arrays. The pivots
+    hold their [x,y] coordinates along the last axis, and all inputs are broadcast against each other.
+    Both assembly branches are solved. Links that can't be assembled are marked False in valid, and their B
+    points and theta4 angles are set to NaN.
+    """
+    def __init__(self, O2, O4, O2ALen, ABLen, BO4Len, theta2=0.0):
+        """
+        :param O2: The [x,y] coordinates of the driven pivot, with shape (..., 2).
+        :param O4: The [x,y] coordinates of the output pivot, with shape (..., 2).
+        :param O2ALen: The length(s) of the input link.
+        :param ABLen: The length(s) of the coupler link.
+        :param BO4Len: The length(s) of the output link.
+        :param theta2: The angle(s) of the O2-A link to the horizontal, in radians.
+        """
+        self.O2 = np.asarray(O2, dtype=float)
+        self.O4 = np.asarray(O4, dtype=float)
+        self.O2ALen = np.asarray(O2ALen, dtype=float)
+        self.ABLen = np.asarray(ABLen, dtype=float)
+        self.BO4Len = np.asarray(BO4Len, dtype=float)
+        self.theta2 = None
+
+        self.adjustedO2O4Angle = None
+        self.d = None
+
+        self.k1 = None
+        self.k2 = None
+        self.k3 = None
+
+        self.valid = None
+        self.theta41 = None
+        self.theta42 = None
+
+        self.Ann = None
+        self.Bnn1 = None
+        self.Bnn2 = None
+
+        self.calcKCoeffs()
+        self.calcAngles(theta2)
+
+    def calcKCoeffs(self):
+        """
+        Calculate the rotation onto the x axes and the k coefficients for every link.
+        These only depend on the pivots and link lengths, so are reused for every driving angle.
+        """
+        dx = self.O4[..., 0] - self.O2[..., 0]
+        dy = self.O4[..., 1] - self.O2[..., 1]
+        self.adjustedO2O4Angle = math.pi - np.arctan2(-dy, -dx)
+
+        a = self.O2ALen
+        b = self.ABLen
+        c = self.BO4Len
+        self.d = np.sqrt(dx**2 + dy**2)
+
+        self.k1 = self.d / a
+        self.k2 = self.d / c
+        self.k3 = (a**2 + c**2 + self.d**2 - b**2) / (2*a*c)
+
+    def calcAngles(self, theta2):
+        """
+        Solve both assembly branches for an array of driving angles.
+
+        :param theta2: The angle(s) of the O2-A link to the horizontal, in radians.
+        """
+        self.theta2 = np.asarray(theta2, dtype=float)
+
+        # Driving angle relative to the O2-O4 line
+        theta2Rot = self.theta2 + self.adjustedO2O4Angle
+        cosTheta2 = np.cos(theta2Rot)
+        A = cosTheta2 - self.k1 - (self.k2 * cosTheta2) + self.k3
+        B = -2 * np.sin(theta2Rot)
+        C = self.k1 - ((self.k2 + 1) * cosTheta2) + self.k3
+
+        # Links with no real solution can't be assembled
+        disc = B**2 - 4 * A * C
+        self.valid = disc > 0
+        root = np.sqrt(np.where(self.valid, disc, 0.0))
+        self.theta41 = np.where(self.valid, 2 * np.arctan2(-B + root, 2 * A) - self.adjustedO2O4Angle, np.nan)
+        self.theta42 = np.where(self.valid, 2 * np.arctan2(-B - root, 2 * A) - self.adjustedO2O4Angle, np.nan)
+
+        # Calculate the points, already rotated back to the original axes
+        self.Ann = self.O2 + self.O2ALen[..., np.newaxis] * np.stack([np.cos(self.theta2), np.sin(self.theta2)], axis=-1)
+        self.Bnn1 = self.O4 + self.BO4Len[..., np.newaxis] * np.stack([np.cos(self.theta41), np.sin(self.theta41)], axis=-1)
+        self.Bnn2 = self.O4 + self.BO4Len[..., np.newaxis] * np.stack([np.cos(self.theta42), np.sin(self.theta42)], axis=-1)
+
+
+
+
 class FourBarHorizontalLink:
     """
     Assumes O2 and O4 line on the same horizontal line, with O4 to the right of O2.
     """
     def __init__(self, O2, O4, O2ALen, ABLen, BO4Len, theta2=0.0):
-        # Pinned Points
-        self.O2 = O2
-        self.O4 = O4
+        # Pinned Points, copied into lists that are updated in place
+        self.O2 = [float(O2[0]), float(O2[1])]
+        self.O4 = [float(O4[0]), float(O4[1])]
 
         # Link Lengths
         self.O2ALen = O2ALen
@@ -151,9 +293,12 @@ class FourBarHorizontalLink:
         self.theta41 = None
         self.theta42 = None
 
-        self.An = None
-        self.Bn1 = None
-        self.Bn2 = None
+        self.An = [0.0, 0.0]
+        self.Bn1 = [0.0, 0.0]
+        self.Bn2 = [0.0, 0.0]
+
+        # Whether the last calcAngles call could assemble the link
+        self.reachable = None
 
         self.fig = None
         self.l1 = None
@@ -171,7 +316,8 @@ class FourBarHorizontalLink:
         :param O4: The [x,y] coordinates for the new point.
         :param theta2: The angle between the r2 line and the r1 line
         """
-        self.O4 = O4
+        self.O4[0] = float(O4[0])
+        self.O4[1] = float(O4[1])
         self.theta2 = theta2
 
         # Recalculate positions
@@ -179,6 +325,38 @@ class FourBarHorizontalLink:
         self.calcKCoeffs()
         self.calcLetterCoeffs()
 
+    def setO2O4Pt(self, O2, O4):
+        """
+        Update both pinned points. The k coefficients are only recalculated if the O2-O4 length changes.
+
+        :param O2: The [x,y] coordinates for the new O2 point.
+        :param O4: The [x,y] coordinates for the new O4 point.
+        """
+        self.O2[0] = float(O2[0])
+        self.O2[1] = float(O2[1])
+        self.O4[0] = float(O4[0])
+        self.O4[1] = float(O4[1])
+
+        prevD = self.d
+        self.calcVectorLengths()
+        if self.d != prevD:
+            self.calcKCoeffs()
+
+    def setLinkLengths(self, O2ALen, ABLen, BO4Len):
+        """
+        Update the link lengths and their coefficients.
+
+        :param O2ALen: The length of the input link.
+        :param ABLen: The length of the coupler link.
+        :param BO4Len: The length of the output link.
+        """
+        self.O2ALen = O2ALen
+        self.ABLen = ABLen
+        self.BO4Len = BO4Len
+
+        self.calcVectorLengths()
+        self.calcKCoeffs()
+
     def calcVectorLengths(self):
         # Calculate lengths
         # O2O4
@@ -213,14 +391,20 @@ class FourBarHorizontalLink:
         # Calculate bar angles
         #self.theta31 = 2 * math.atan2(-self.E + math.sqrt(self.E**2 - (4 * self.D * self.F)), 2 * self.D)
         #self.theta32 = 2 * math.atan2(-self.E - math.sqrt(self.E**2 - (4 * self.D * self.F)), 2 * self.D)
-        if self.B**2 > 4 * self.A * self.C:
+        self.reachable = self.B**2 > 4 * self.A * self.C
+
+        # The input link can always be placed, so A is set even when the link can't be assembled
+        self.An[0] = self.O2[0] + (self.a*math.cos(self.theta2))
+        self.An[1] = self.O2[1] + (self.a*math.sin(self.theta2))
+        if self.reachable:
             self.theta41 = 2 * math.atan2(-self.B + math.sqrt(self.B**2 - 4 * self.A * self.C), 2 * self.A)
             self.theta42 = 2 * math.atan2(-self.B - math.sqrt(self.B**2 - 4 * self.A * self.C), 2 * self.A)
 
-            # Calculate new positions for the points
-            self.An =  [self.O2[0] + (self.a*math.cos(self.theta2)), self.O2[1] + (self.a*math.sin(self.theta2))]
-            self.Bn1 = [self.O4[0] + (self.c*math.cos(self.theta41)), self.O4[1] + (self.c*math.sin(self.theta41))]
-            self.Bn2 = [self.O4[0] + (self.c*math.cos(self.theta42)), self.O4[1] + (self.c*math.sin(self.theta42))]
+            # Calculate new positions for the points, in place
+            self.Bn1[0] = self.O4[0] + (self.c*math.cos(self.theta41))
+            self.Bn1[1] = self.O4[1] + (self.c*math.sin(self.theta41))
+            self.Bn2[0] = self.O4[0] + (self.c*math.cos(self.theta42))
+            self.Bn2[1] = self.O4[1] + (self.c*math.sin(self.theta42))
 
             if self.checkDists:
                 r2 = math.sqrt((self.O2[0] - self.An[0]) ** 2 + (self.O2[1] - self.An[1]) ** 2)
@@ -230,12 +414,17 @@ class FourBarHorizontalLink:
                 # print('%.1f' % r2, '%.1f' % r3a, '%.1f' % r3b, '%.1f' % r4)
                 print('%.1f' % r2, '%.1f' % r3a, '%.1f' % r4)
         else:
-            self.An = [0.0, 0.0]
-            self.Bn1 = [0.0, 0.0]
-            self.Bn2 = [0.0, 0.0]
+            # Mark B as unsolved, as in FourBarLinkBatch
+            self.theta41 = math.nan
+            self.theta42 = math.nan
+            self.Bn1[:] = (math.nan, math.nan)
+            self.Bn2[:] = (math.nan, math.nan)
 
 
     def setupFig(self, fig=None):
+        # Only load pyplot when drawing, so the solvers can be used headless
+        import matplotlib.pyplot as plt
+
         if fig is None:
             self.fig = plt.figure()
         else:
@@ -249,6 +438,8 @@ class FourBarHorizontalLink:
 
 
     def plotLinks(self):
+        import matplotlib.pyplot as plt
+
         self.l1.set_data([self.O2[0], self.An[0], self.Bn1[0], self.O4[0]], [self.O2[1], self.An[1], self.Bn1[1], self.O4[1]])
         self.l2.set_data([self.O2[0], self.An[0], self.Bn2[0], self.O4[0]], [self.O2[1], self.An[1], self.Bn2[1], self.O4[1]])
         self.p1.set_data([self.O2[0], self.O4[0]], [self.O2[1], self.O4[1]])
@@ -259,6 +450,8 @@ class FourBarHorizontalLink:
 
 
 if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+
     # Define points
     O2 = [0.0, 0.0]
     #A = [3.0, 0.0]
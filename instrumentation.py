@@ -0,0 +1,205 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+
+# Methods with these prefixes are timed on the instrumented classes
+INSTRUMENTED_PREFIXES = ('calc', 'draw', 'solve', 'set', 'translate', 'rotate')
+
+
+class StageStats:
+    """
+    The call count and call durations of one instrumented stage.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.durations = []
+        self.unreachable = 0
+
+    def summarise(self):
+        """
+        :return: A dictionary of the call count, unreachable solves, and the total time in milliseconds, with the
+                 mean, percentile and maximum call times in microseconds.
+        """
+        durations = np.array(self.durations, dtype=float) / 1e3
+        return {'calls': self.calls,
+                'unreachable': self.unreachable,
+                'total': float(np.sum(durations) / 1e3),
+                'mean': float(np.mean(durations)),
+                'p50': float(np.percentile(durations, 50)),
+                'p90': float(np.percentile(durations, 90)),
+                'p99': float(np.percentile(durations, 99)),
+                'max': float(np.max(durations))}
+
+
+class Instrumentation:
+    """
+    Opt-in timing of the compute and draw stages of the bike, riders, four bar links and matplotlib.
+
+    Nothing is changed until enable is called, which replaces the stage methods on their classes with timing
+    wrappers. disable puts the original methods back, so there is no cost while instrumentation is off. Times
+    include any nested stages, and unreachable four bar solves are counted against FourBarHorizontalLink.calcAngles.
+    """
+    def __init__(self, maxEvents=1000000):
+        """
+        :param maxEvents: The maximum number of calls to keep for the Chrome trace. Stage statistics keep counting
+                          after this.
+        """
+        self.maxEvents = maxEvents
+        self.stages = {}
+        self.events = []
+        self.counterEvents = []
+        self.patches = []
+        self.startTime = None
+
+    def getStage(self, name):
+        if name not in self.stages:
+            self.stages[name] = StageStats(name)
+        return self.stages[name]
+
+    def wrap(self, owner, attrName, stageName, afterCall=None):
+        """
+        Replace a function on a class or module with a timing wrapper.
+
+        :param owner: The class or module holding the function.
+        :param attrName: The name of the function.
+        :param stageName: The name to record the calls under.
+        :param afterCall: Optional callable, called with the stage and the call arguments after each call.
+        """
+        owned = attrName in owner.__dict__
+        if owned:
+            original = owner.__dict__[attrName]
+        else:
+            # Inherited, such as Axes.relim, so shadow it on this class
+            original = next(base.__dict__[attrName] for base in owner.__mro__ if attrName in base.__dict__)
+        stage = self.getStage(stageName)
+        events = self.events
+        maxEvents = self.maxEvents
+        perfCounter = time.perf_counter_ns
+
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            start = perfCounter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                end = perfCounter()
+                stage.calls += 1
+                stage.durations.append(end - start)
+                if len(events) < maxEvents:
+                    events.append((stageName, start, end - start, threading.get_ident()))
+                if afterCall is not None:
+                    afterCall(stage, args)
+
+        setattr(owner, attrName, wrapper)
+        self.patches.append((owner, attrName, original if owned else None))
+
+    def wrapMethods(self, cls, prefixes=INSTRUMENTED_PREFIXES):
+        """
+        Wrap every plain method of a class whose name starts with one of the prefixes.
+        """
+        for attrName, value in list(cls.__dict__.items()):
+            if callable(value) and not isinstance(value, type) and attrName.startswith(prefixes):
+                self.wrap(cls, attrName, '%s.%s' % (cls.__name__, attrName),
+                          self.countUnreachable if (cls.__name__, attrName) == ('FourBarHorizontalLink', 'calcAngles') else None)
+
+    def countUnreachable(self, stage, args):
+        """
+        Count calcAngles calls where the link couldn't be assembled.
+        """
+        if not args[0].reachable:
+            stage.unreachable += 1
+            if len(self.counterEvents) < self.maxEvents:
+                self.counterEvents.append((time.perf_counter_ns(), stage.unreachable))
+
+    def enable(self):
+        """
+        Start timing. Matplotlib stages are only timed if pyplot has already been imported.
+        """
+        if len(self.patches) > 0:
+            return
+        from bike import Bike
+        from fourBarLink import FourBarHorizontalLink, FourBarLink
+        from rider import Rider
+
+        self.startTime = time.perf_counter_ns()
+        for cls in (Bike, Rider, FourBarLink, FourBarHorizontalLink):
+            self.wrapMethods(cls)
+        if 'renderer' in sys.modules:
+            self.wrapMethods(sys.modules['renderer'].BlitRenderer, ('setup', 'draw'))
+
+        if 'matplotlib.pyplot' in sys.modules:
+            import matplotlib.pyplot as plt
+            from matplotlib.axes import Axes
+            from matplotlib.lines import Line2D
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            self.wrap(Line2D, 'set_data', 'Line2D.set_data')
+            self.wrap(Axes, 'relim', 'Axes.relim')
+            self.wrap(Axes, 'autoscale_view', 'Axes.autoscale_view')
+            self.wrap(plt, 'pause', 'pyplot.pause')
+
+            # Time the canvas class of the open figures, which depends on the backend
+            canvasClasses = {type(plt.figure(num).canvas) for num in plt.get_fignums()} or {FigureCanvasAgg}
+            for canvasClass in canvasClasses:
+                for attrName in ('draw', 'blit', 'restore_region'):
+                    if hasattr(canvasClass, attrName):
+                        self.wrap(canvasClass, attrName, '%s.%s' % (canvasClass.__name__, attrName))
+
+    def disable(self):
+        """
+        Stop timing and restore the original methods. Recorded timings are kept.
+        """
+        for owner, attrName, original in reversed(self.patches):
+            if original is None:
+                delattr(owner, attrName)
+            else:
+                setattr(owner, attrName, original)
+        self.patches = []
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.disable()
+
+    def summarise(self):
+        """
+        :return: A dictionary of stage names to their statistics, for stages that were called, slowest first.
+        """
+        summary = {name: stage.summarise() for name, stage in self.stages.items() if stage.calls > 0}
+        return dict(sorted(summary.items(), key=lambda item: -item[1]['total']))
+
+    def formatSummary(self):
+        """
+        :return: The stage statistics as a text table.
+        """
+        lines = ['%-40s %8s %12s %10s %10s %10s %10s %10s %12s' % (
+            'Stage', 'Calls', 'Total (ms)', 'Mean (us)', 'p50 (us)', 'p90 (us)', 'p99 (us)', 'Max (us)', 'Unreachable')]
+        for name, stats in self.summarise().items():
+            lines.append('%-40s %8d %12.2f %10.2f %10.2f %10.2f %10.2f %10.2f %12s' % (
+                name, stats['calls'], stats['total'], stats['mean'], stats['p50'], stats['p90'], stats['p99'],
+                stats['max'], stats['unreachable'] if stats['unreachable'] > 0 else ''))
+
+        return '\n'.join(lines)
+
+    def writeChromeTrace(self, path):
+        """
+        Write the recorded calls as a Chrome trace JSON file, viewable in chrome://tracing or Perfetto.
+
+        :param path: The file to write.
+        """
+        pid = os.getpid()
+        trace = [{'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                  'ts': (start - self.startTime) / 1e3, 'dur': duration / 1e3}
+                 for name, start, duration, tid in self.events]
+        trace += [{'name': 'unreachableSolves', 'ph': 'C', 'pid': pid, 'ts': (ts - self.startTime) / 1e3,
+                   'args': {'count': count}} for ts, count in self.counterEvents]
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,402 @@
+import argparse
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.patches import Rectangle
+from matplotlib.widgets import RadioButtons, Slider
+
+from bike import Bike
+from kinematics import HANDS_FRAME_KEYS, SEAT_FRAME_KEYS
+from main import readConfigs
+from renderer import RIDER_COLORS, BlitRenderer, createFigure
+from rider import Rider
+
+
+# Rider configuration keys with sliders, and how far either side of the starting value they go
+RIDER_SLIDERS = (('seatHeight', 60.0), ('seatRiderOffsetX', 60.0), ('seatRiderOffsetY', 40.0),
+                 ('hip2KneeLength', 60.0), ('knee2AnkleLength', 60.0), ('footLength', 40.0),
+                 ('footContactProportion', 0.15), ('hip2HorizontalAngleDeg', 15.0))
+
+# Bike configuration keys with sliders, and how far either side of the starting value they go
+BIKE_SLIDERS = (('crankLength', 15.0), ('seatTube', 60.0), ('topTube', 60.0), ('downTube', 60.0),
+                ('handleBarPost', 60.0), ('handleBarLength', 60.0), ('leverLength', 40.0))
+
+
+class InteractiveFit:
+    """
+    Shows the riders on the bike at one crank angle, with sliders to change the bike and rider configurations.
+
+    Each rider is solved for a whole revolution at once into a pose cache, which also gives its knee and hip angle
+    curves. A rider slider only solves the selected rider again, reusing the bike's frame, while a bike slider
+    solves the frame and then every rider. The changed artists are then blitted over a cached background, with
+    the whole figure only redrawn when the angle axes have to grow.
+    """
+    def __init__(self, bc, rcs, samples=360):
+        """
+        :param bc: The bike configuration dictionary.
+        :param rcs: A dictionary of rider names to rider configurations.
+        :param samples: The number of crank angles each rider is solved at per revolution.
+        """
+        self.bc = bc
+        self.rcs = rcs
+        self.samples = samples
+        self.names = list(rcs.keys())
+
+        self.fig = None
+        self.axBike = None
+        self.axKnee = None
+        self.axHip = None
+        self.canvas = None
+
+        self.bike = None
+        self.riders = []
+        self.selected = 0
+        self.crankAngleDeg = 0.0
+
+        self.riderSliders = {}
+        self.bikeSliders = {}
+        self.crankSlider = None
+        self.riderButtons = None
+        self.statusText = None
+        self.sliderErasers = {}
+
+        self.background = None
+        self.movingArtists = []
+        self.layer = None
+        self.layerKey = None
+        self.staleSliders = set()
+        self.lastUpdateTime = None
+
+    def setup(self, fig=None):
+        """
+        Create the figure, bike, riders and sliders, and draw everything once.
+
+        :param fig: Optional figure from renderer.createFigure, as (fig, bike axes, knee axes, hip axes).
+        """
+        self.fig, self.axBike, self.axKnee, self.axHip = createFigure() if fig is None else fig
+        self.canvas = self.fig.canvas
+        self.fig.set_size_inches(13*1.5, 7*1.5)
+        self.fig.subplots_adjust(bottom=0.34)
+
+        # Create bike and riders, each solved for a whole revolution
+        self.bike = Bike(dict(self.bc), ax=self.axBike)
+        self.bike.calcBikePositions()
+        self.bike.drawBikePositions()
+        for i, name in enumerate(self.names):
+            seatColor, riderColor = RIDER_COLORS[i % len(RIDER_COLORS)]
+            rider = Rider(self.rcs[name], self.bike, seatColor=seatColor, riderColor=riderColor, ax=self.axBike)
+            rider.usePoseCache(self.samples)
+            rider.drawSeat()
+            rider.drawAngleLines(self.axKnee, self.axHip)
+            self.riders.append(rider)
+        self.drawCrank()
+        for rider in self.riders:
+            self.drawRider(rider)
+            self.drawAngleCurves(rider)
+        self.axKnee.set_xlim([0, 360])
+        self.fitAngleLimits(always=True)
+
+        # Create sliders
+        sliderHeight = 0.022
+        for i, (key, span) in enumerate(RIDER_SLIDERS):
+            ax = self.fig.add_axes([0.2, 0.27 - (0.03 * i), 0.25, sliderHeight])
+            self.riderSliders[key] = Slider(ax, key, 0.0, 1.0, valfmt='%.4g')
+            self.riderSliders[key].on_changed(lambda value, key=key: self.onRiderSlider(key, value))
+        for i, (key, span) in enumerate(BIKE_SLIDERS):
+            value = self.bc[key]
+            ax = self.fig.add_axes([0.62, 0.27 - (0.03 * i), 0.25, sliderHeight])
+            self.bikeSliders[key] = Slider(ax, key, value - span, value + span, valinit=value, valfmt='%.4g')
+            self.bikeSliders[key].on_changed(lambda value, key=key: self.onBikeSlider(key, value))
+        ax = self.fig.add_axes([0.62, 0.27 - (0.03 * len(BIKE_SLIDERS)), 0.25, sliderHeight])
+        self.crankSlider = Slider(ax, 'Crank Angle (Deg)', 0.0, 360.0, valinit=self.crankAngleDeg, valfmt='%.1f')
+        self.crankSlider.on_changed(self.onCrankSlider)
+
+        # Sliders are blitted, instead of redrawing the whole figure
+        sliders = [self.crankSlider] + list(self.riderSliders.values()) + list(self.bikeSliders.values())
+        for slider in sliders:
+            slider.drawon = False
+
+            # Slider axes don't draw a background, so clear the old handle with a patch padded by its radius
+            pad = 7.0 * self.fig.dpi / 72.0 / slider.ax.bbox.width
+            self.sliderErasers[slider] = slider.ax.add_patch(Rectangle(
+                (-pad, 0.0), 1.0 + (2.0 * pad), 1.0, transform=slider.ax.transAxes, facecolor=self.fig.get_facecolor(),
+                edgecolor='none', clip_on=False, animated=True))
+
+        # Choose the rider the rider sliders change
+        ax = self.fig.add_axes([0.01, 0.03, 0.08, 0.26])
+        ax.set_title('Rider', fontsize=10)
+        self.riderButtons = RadioButtons(ax, self.names)
+        self.riderButtons.on_clicked(self.onSelectRider)
+        self.statusText = self.fig.text(0.01, 0.005, '', fontsize=9)
+        self.selectRider(0)
+
+        # Collect artists that change with the configuration or crank angle
+        self.movingArtists = [self.bike.crankLine, self.statusText] + list(self.bike.frameLines.values())
+        # Slider labels are outside their axes, so would be drawn over themselves when a slider's axes are drawn
+        self.movingArtists += [slider.label for slider in sliders] + [slider.valtext for slider in sliders]
+        for rider in self.riders:
+            self.movingArtists += self.getRiderArtists(rider)
+        for artist in self.movingArtists:
+            artist.set_animated(True)
+
+        # Recapture the background whenever the whole figure is redrawn
+        self.canvas.mpl_connect('draw_event', self.onDraw)
+        self.canvas.draw()
+
+    def drawCrank(self):
+        """
+        Move the cranks to the current crank angle.
+        """
+        self.bike.calcCrankLoc(theta=-self.crankAngleDeg)
+        self.bike.drawCrank()
+
+    def drawRider(self, rider):
+        """
+        Move a rider's artists to its pose at the current crank angle, from its pose cache.
+
+        :param rider: The rider.
+        """
+        rider.calcRiderHipPos()
+        rider.currCrankAngle = self.crankAngleDeg % 360
+        rider.setPoseFromCache(self.crankAngleDeg)
+        rider.drawRiderLowerBody()
+        rider.calcUpperBody()
+        rider.drawUpperBody()
+        rider.currKneeAngleDot.set_data([rider.currCrankAngle], [rider.currKneeAngle])
+        rider.currHipAngleDot.set_data([rider.currCrankAngle], [rider.currHipAngle])
+
+    @staticmethod
+    def drawAngleCurves(rider):
+        """
+        Set a rider's knee and hip angle curves from its pose cache.
+
+        :param rider: The rider.
+        """
+        cycle = rider.poseCache.cycle
+        rider.kneeAngleLine.set_data(cycle.crankAngle, cycle.kneeAngle)
+        rider.hipAngleLine.set_data(cycle.crankAngle, cycle.hipAngle)
+
+    def fitAngleLimits(self, always=False):
+        """
+        Grow the angle axes limits to fit every rider's curves. Changing limits needs the whole figure redrawn, so
+        they're only changed when a curve no longer fits, unless always is set.
+
+        :param always: Whether to fit the limits even if every curve already fits.
+        :return: Whether the limits changed.
+        """
+        changed = False
+        for ax, name in ((self.axKnee, 'kneeAngle'), (self.axHip, 'hipAngle')):
+            values = [getattr(rider.poseCache.cycle, name) for rider in self.riders]
+            valueRange = [np.nanmin([np.nanmin(v) for v in values]), np.nanmax([np.nanmax(v) for v in values])]
+            if not np.all(np.isfinite(valueRange)):
+                continue
+            lower, upper = ax.get_ylim()
+            if always:
+                ax.set_ylim(BlitRenderer.padRange(valueRange))
+                changed = True
+            elif valueRange[0] < lower or valueRange[1] > upper:
+                # Leave room to keep dragging the same way without growing them again
+                ax.set_ylim(BlitRenderer.padRange([min(valueRange[0], lower), max(valueRange[1], upper)], 0.25))
+                changed = True
+
+        return changed
+
+    def selectRider(self, index):
+        """
+        Choose the rider the rider sliders change, and move the sliders to its configuration.
+
+        :param index: The index of the rider.
+        """
+        self.selected = index
+        rc = self.riders[index].rc
+        for key, span in RIDER_SLIDERS:
+            # Centred on, and marking, the rider's starting value
+            slider = self.riderSliders[key]
+            slider.valinit = self.rcs[self.names[index]][key]
+            slider.valmin = slider.valinit - span
+            slider.valmax = slider.valinit + span
+            slider.ax.set_xlim(slider.valmin, slider.valmax)
+            slider.vline.set_xdata([slider.valinit, slider.valinit])
+            slider.eventson = False
+            slider.set_val(rc[key])
+            slider.eventson = True
+
+    def onSelectRider(self, label):
+        """
+        Select a rider from the radio buttons, then redraw the whole figure for the moved sliders.
+        """
+        self.selectRider(self.names.index(label))
+        self.canvas.draw_idle()
+
+    def onRiderSlider(self, key, value):
+        """
+        Solve the selected rider again with a new configuration value, keeping the bike's frame.
+        """
+        startTime = time.perf_counter()
+        rider = self.riders[self.selected]
+        rider.setConfig({key: value})
+        rider.drawSeat()
+        self.drawRider(rider)
+        self.drawAngleCurves(rider)
+        self.finishUpdate(self.riderSliders[key], self.getRiderArtists(rider), startTime)
+
+    def onBikeSlider(self, key, value):
+        """
+        Solve the frame again with a new bike configuration value. The riders are only solved again if the seats or
+        cranks moved, and only the artists that moved are drawn again, over those that didn't, as for the rider
+        sliders.
+        """
+        startTime = time.perf_counter()
+        slider = self.bikeSliders[key]
+        oldFrame = self.bike.getFrame()
+        try:
+            self.bike.setConfig({key: value})
+        except ValueError as e:
+            # Put the slider back to the last frame that could be built
+            slider.eventson = False
+            slider.set_val(self.bike.bc[key])
+            slider.eventson = True
+            self.statusText.set_text(str(e))
+            self.blit(slider, [slider.valtext, self.statusText])
+            return
+
+        # Only the frame lines and rider artists that moved are drawn again
+        self.bike.drawBikePositions()
+        changed = list(self.bike.movedFrameLines)
+        frame = self.bike.getFrame()
+        crankMoved = frame['crankLength'] != oldFrame['crankLength']
+        seatMoved = any(frame[key] != oldFrame[key] for key in SEAT_FRAME_KEYS)
+        handsMoved = any(frame[key] != oldFrame[key] for key in HANDS_FRAME_KEYS)
+        if crankMoved:
+            self.drawCrank()
+            changed.append(self.bike.crankLine)
+        for rider in self.riders:
+            moved = set()
+            if crankMoved or seatMoved:
+                # Solve the legs again
+                rider.setConfig({})
+                rider.drawSeat()
+                self.drawRider(rider)
+                self.drawAngleCurves(rider)
+                moved.update([rider.legLine1, rider.kneeAngleLine, rider.hipAngleLine, rider.currKneeAngleDot,
+                              rider.currHipAngleDot])
+            if crankMoved:
+                # The pedals and feet only move with the crank
+                moved.update([rider.pedalLine1, rider.pedalLine2, rider.footLine1, rider.footLine2])
+            if seatMoved:
+                moved.update([rider.seatPostLine, rider.seatLine])
+            if seatMoved or handsMoved:
+                rider.calcUpperBody()
+                rider.drawUpperBody()
+                moved.add(rider.upperLine1)
+            changed += [artist for artist in self.getRiderArtists(rider) if artist in moved]
+        self.finishUpdate(slider, changed, startTime)
+
+    def onCrankSlider(self, value):
+        """
+        Move every rider to a new crank angle, from their pose caches.
+        """
+        startTime = time.perf_counter()
+        self.crankAngleDeg = value
+        self.drawCrank()
+        changed = [self.bike.crankLine]
+        for rider in self.riders:
+            self.drawRider(rider)
+            changed += self.getPoseArtists(rider)
+        self.finishUpdate(self.crankSlider, changed, startTime)
+
+    @staticmethod
+    def getPoseArtists(rider):
+        """
+        Get the artists of a rider that move with the crank.
+        """
+        return [rider.pedalLine1, rider.pedalLine2, rider.footLine1, rider.footLine2, rider.legLine1,
+                rider.currKneeAngleDot, rider.currHipAngleDot]
+
+    def getRiderArtists(self, rider):
+        """
+        Get every artist of a rider that changes with its configuration.
+        """
+        return [rider.seatPostLine, rider.seatLine, rider.upperLine1, rider.kneeAngleLine,
+                rider.hipAngleLine] + self.getPoseArtists(rider)
+
+    def finishUpdate(self, slider, changed, startTime):
+        """
+        Show an update, redrawing the whole figure only if the angle axes had to grow, and record its latency.
+
+        :param slider: The slider that changed.
+        :param changed: The moving artists that changed.
+        :param startTime: The perf_counter time the update started, used to show the time to solve it.
+        """
+        self.statusText.set_text('Solved in %.1f ms' % (1000 * (time.perf_counter() - startTime)))
+        if self.fitAngleLimits():
+            self.canvas.draw_idle()
+        else:
+            self.blit(slider, changed + [slider.valtext, self.statusText])
+        self.lastUpdateTime = time.perf_counter() - startTime
+
+    def onDraw(self, event):
+        """
+        Cache the static background after a full redraw, then draw the moving artists back over it.
+        """
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.staleSliders.clear()
+        self.layerKey = None
+        for artist in self.movingArtists:
+            self.fig.draw_artist(artist)
+
+    def blit(self, slider, changed):
+        """
+        Draw a changed slider and the changed moving artists over a cached layer, then blit.
+
+        The layer is the background with every moving artist that isn't changing drawn over it. It's kept while
+        the same slider keeps changing the same artists, such as while dragging it, so only the changed artists
+        are drawn each update.
+
+        :param slider: The slider that changed.
+        :param changed: The moving artists that changed, including the slider's value text.
+        """
+        if self.background is None:
+            self.canvas.draw_idle()
+            return
+
+        layerKey = (slider, frozenset(changed))
+        if layerKey != self.layerKey:
+            # Bring the background up to date with the sliders moved since it was captured
+            self.canvas.restore_region(self.background)
+            if self.staleSliders:
+                for staleSlider in self.staleSliders:
+                    self.fig.draw_artist(self.sliderErasers[staleSlider])
+                    self.fig.draw_artist(staleSlider.ax)
+                self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+                self.staleSliders.clear()
+
+            for artist in self.movingArtists:
+                if artist not in layerKey[1]:
+                    self.fig.draw_artist(artist)
+            self.layer = self.canvas.copy_from_bbox(self.fig.bbox)
+            self.layerKey = layerKey
+        else:
+            self.canvas.restore_region(self.layer)
+
+        # Clear the slider's old state, while its label and value text are moving artists
+        self.fig.draw_artist(self.sliderErasers[slider])
+        self.fig.draw_artist(slider.ax)
+        self.staleSliders.add(slider)
+        for artist in changed:
+            self.fig.draw_artist(artist)
+        self.canvas.blit(self.fig.bbox)
+        self.canvas.flush_events()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Adjust the bike and rider configurations with sliders.')
+    parser.add_argument('--bike', default='bike.json', help='The bike configuration file.')
+    parser.add_argument('--riders', default='rider.json', help='The rider configuration file.')
+    parser.add_argument('--samples', type=int, default=360, help='The number of crank angles each rider is solved at per revolution.')
+    args = parser.parse_args()
+
+    bc, rcs = readConfigs(args.bike, args.riders, verbose=False)
+    fit = InteractiveFit(bc, rcs, args.samples)
+    fit.setup()
+    plt.show()
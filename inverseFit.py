@@ -0,0 +1,228 @@
+import json
+import time
+import numpy as np
+
+from kinematics import calcExtrema, calcFrame, calcFrameArrays, solveJointAngles
+
+
+FIT_STATS = ('kneeMin', 'kneeMax', 'hipMin', 'hipMax')
+
+# The factor the dampings grow by after a round of steps that all fail to improve
+DAMPING_GROWTH = 1e4
+
+
+class FitResult:
+    """
+    The outcome of fitting free configuration parameters to target joint angles.
+    """
+    def __init__(self):
+        self.params = {}
+        self.stats = {}
+        self.objective = None
+        self.converged = False
+        self.iterations = 0
+        self.evaluations = 0
+        self.message = ''
+
+    def __repr__(self):
+        return 'FitResult(params=%s, converged=%s, iterations=%d, evaluations=%d, objective=%.3g, message=%r)' % (
+            self.params, self.converged, self.iterations, self.evaluations, self.objective, self.message)
+
+
+class InverseFit:
+    """
+    Finds bike or rider configuration values, such as seatHeight, that put the knee and hip extrema within target
+    bounds.
+
+    Each extremum outside its bounds gives a residual, the distance to the nearest bound. The residuals are driven
+    to zero with damped Gauss-Newton steps from the starting configuration, clipped to the parameter bounds. The
+    Jacobian comes from finite differences, and several damping values are tried per iteration, with every
+    candidate of a round solved in one batched cycle evaluation. When no step improves, the dampings grow, as in
+    Levenberg-Marquardt, until one does or the steps become too small. Taking the minimum norm step means that when
+    there are more free parameters than targets, the fit makes the smallest change needed.
+    """
+    def __init__(self, bc, rc, targets, freeParams, crankSamples=180, gridPoints=9):
+        """
+        :param bc: The bike configuration dictionary.
+        :param rc: The rider configuration dictionary.
+        :param targets: A dictionary of kneeMin, kneeMax, hipMin or hipMax to a (lower, upper) tuple in degrees.
+                        Either bound may be None, and a single number requires the extremum to equal it.
+        :param freeParams: A dictionary of bike or rider configuration keys to their (lower, upper) search bounds.
+        :param crankSamples: The number of crank angles to evaluate per revolution.
+        :param gridPoints: The number of candidates per free parameter when searching for a reachable start.
+        """
+        self.bc = bc
+        self.rc = rc
+        self.targets = {}
+        for stat, bounds in targets.items():
+            if stat not in FIT_STATS:
+                raise ValueError('Unknown fit target %s, must be one of %s.' % (stat, ', '.join(FIT_STATS)))
+            if np.isscalar(bounds):
+                bounds = (bounds, bounds)
+            self.targets[stat] = (-np.inf if bounds[0] is None else bounds[0], np.inf if bounds[1] is None else bounds[1])
+
+        self.keys = list(freeParams.keys())
+        for key in self.keys:
+            if key not in rc and key not in bc:
+                raise ValueError('Unknown free parameter %s, must be a bike or rider configuration key.' % key)
+        self.lower = np.array([freeParams[key][0] for key in self.keys], dtype=float)
+        self.upper = np.array([freeParams[key][1] for key in self.keys], dtype=float)
+        self.scale = np.where(self.upper > self.lower, self.upper - self.lower, 1.0)
+        self.start = np.clip([rc[key] if key in rc else bc[key] for key in self.keys], self.lower, self.upper)
+
+        self.crankAngles = np.linspace(0, 360, crankSamples, endpoint=False)
+        self.gridPoints = gridPoints
+        self.baseFrame = calcFrame(bc)
+
+    def evaluate(self, candidates):
+        """
+        Evaluate the joint angle extrema and target residuals for many candidates at once.
+
+        :param candidates: An array of shape (n, len(keys)) of free parameter values.
+        :return: The extrema dictionary, the residuals with shape (n, len(targets)) and the objective, the sum of
+                 squared residuals, for each candidate. Unreachable candidates have an objective of inf.
+        """
+        n = len(candidates)
+        rc = dict(self.rc)
+        bikeParams = {}
+        for i, key in enumerate(self.keys):
+            if key in self.rc:
+                rc[key] = candidates[:, i]
+            else:
+                bikeParams[key] = candidates[:, i]
+        frame, _ = calcFrameArrays(self.bc, bikeParams, n, self.baseFrame)
+        extrema = calcExtrema(*solveJointAngles(frame, rc, self.crankAngles))
+
+        # Distance of each extremum outside its bounds
+        residuals = np.stack([extrema[stat] - np.clip(extrema[stat], lower, upper)
+                              for stat, (lower, upper) in self.targets.items()], axis=-1)
+        objective = np.sum(residuals**2, axis=-1)
+        objective = np.where(extrema['reachable'] & np.isfinite(objective), objective, np.inf)
+
+        return extrema, residuals, objective
+
+    def findReachableStart(self):
+        """
+        Search a grid over the parameter bounds for the best reachable candidate, closest to the start.
+
+        :return: The candidate, or None if no candidate on the grid is reachable, and the number of evaluations.
+        """
+        axes = [np.linspace(lo, hi, self.gridPoints) if hi > lo else np.array([lo]) for lo, hi in zip(self.lower, self.upper)]
+        candidates = np.stack([grid.ravel() for grid in np.meshgrid(*axes, indexing='ij')], axis=-1)
+        _, _, objective = self.evaluate(candidates)
+        if not np.any(np.isfinite(objective)):
+            return None, len(candidates)
+        distance = np.sqrt(np.sum(((candidates - self.start) / self.scale)**2, axis=-1))
+
+        return candidates[np.lexsort((distance, objective))[0]], len(candidates)
+
+    def solve(self, xtol=1e-3, ftol=1e-6, maxIterations=50, step=1e-5, dampings=(1e-6, 1e-3, 1e-1, 1e1)):
+        """
+        Search for free parameter values that meet the targets.
+
+        :param xtol: The smallest step, as a proportion of each parameter's bounds, before stopping.
+        :param ftol: The largest objective, in squared degrees, counted as meeting the targets.
+        :param maxIterations: The maximum number of iterations.
+        :param step: The finite difference step, as a proportion of each parameter's bounds.
+        :param dampings: The damping values to try first each iteration. If none improves, they are grown by
+                         DAMPING_GROWTH until one does, or every step is smaller than xtol.
+        :return: A FitResult.
+        """
+        result = FitResult()
+        nParams = len(self.keys)
+        dampings = np.asarray(dampings, dtype=float)
+        x = self.start
+        _, residual, objective = self.evaluate(x[np.newaxis])
+        result.evaluations += 1
+        if not np.isfinite(objective[0]):
+            x, evaluations = self.findReachableStart()
+            result.evaluations += evaluations
+            if x is None:
+                result.message = 'No candidate could reach the pedals within the parameter bounds.'
+                result.params = {key: float(value) for key, value in zip(self.keys, self.start)}
+                result.objective = np.inf
+                return result
+
+        for iteration in range(1, maxIterations + 1):
+            result.iterations = iteration
+
+            # Current point and finite difference points, stepping away from the nearest bound
+            h = step * self.scale * np.where(x + (step * self.scale) <= self.upper, 1.0, -1.0)
+            candidates = np.vstack([x, x + np.diag(h)])
+            extrema, residuals, objective = self.evaluate(candidates)
+            result.evaluations += len(candidates)
+            residual = residuals[0]
+            result.objective = float(objective[0])
+            result.stats = {stat: float(extrema[stat][0]) for stat in FIT_STATS}
+            if result.objective <= ftol:
+                result.converged = True
+                result.message = 'Targets met.'
+                break
+
+            # Minimum norm damped Gauss-Newton steps, in units of each parameter's bounds. If no damping improves
+            # on the current point, try larger ones, shortening the steps towards gradient descent.
+            jacobian = (residuals[1:] - residual).T / (h / self.scale)
+            jacobian = np.where(np.isfinite(jacobian), jacobian, 0.0)
+
+            # Hold parameters at a bound the descent direction points out of, as clipping their steps would throw
+            # away the other parameters' share of the step
+            gradient = jacobian.T @ residual
+            atBound = ((x <= self.lower) & (gradient > 0.0)) | ((x >= self.upper) & (gradient < 0.0))
+            jacobian[:, atBound] = 0.0
+            trialDampings = dampings
+            while True:
+                trials = np.empty((len(trialDampings), nParams))
+                for i, damping in enumerate(trialDampings):
+                    normal = (jacobian @ jacobian.T) + (damping * np.eye(len(residual)))
+                    trials[i] = np.clip(x - (self.scale * (jacobian.T @ np.linalg.solve(normal, residual))), self.lower, self.upper)
+                trialExtrema, _, trialObjective = self.evaluate(trials)
+                result.evaluations += len(trials)
+                stepSizes = np.max(np.abs(trials - x) / self.scale, axis=-1)
+                bestTrial = np.argmin(trialObjective)
+                if trialObjective[bestTrial] < objective[0] or np.max(stepSizes) < xtol:
+                    break
+                trialDampings = trialDampings * DAMPING_GROWTH
+
+            if trialObjective[bestTrial] >= objective[0]:
+                result.message = 'Targets can\'t be met within the parameter bounds, closest values returned.'
+                break
+            x = trials[bestTrial]
+            result.objective = float(trialObjective[bestTrial])
+            result.stats = {stat: float(trialExtrema[stat][bestTrial]) for stat in FIT_STATS}
+            if stepSizes[bestTrial] < xtol:
+                result.message = 'Targets can\'t be met within the parameter bounds, closest values returned.'
+                break
+        else:
+            result.message = 'Reached the maximum number of iterations.'
+
+        result.params = {key: float(value) for key, value in zip(self.keys, x)}
+
+        return result
+
+
+def fitRider(bc, rc, targets, freeParams, **kwargs):
+    """
+    Find free configuration values that put the knee and hip extrema within target bounds. See InverseFit.
+
+    :param bc: The bike configuration dictionary.
+    :param rc: The rider configuration dictionary.
+    :param targets: A dictionary of kneeMin, kneeMax, hipMin or hipMax to (lower, upper) bounds, or a value.
+    :param freeParams: A dictionary of bike or rider configuration keys to their (lower, upper) search bounds.
+    :return: A FitResult.
+    """
+    solveKwargs = {key: kwargs.pop(key) for key in ('xtol', 'ftol', 'maxIterations') if key in kwargs}
+    return InverseFit(bc, rc, targets, freeParams, **kwargs).solve(**solveKwargs)
+
+
+
+if __name__ == '__main__':
+    with open('bike.json') as f:
+        bc = json.load(f)
+    with open('rider.json') as f:
+        rc = json.load(f)['rider1']
+
+    startTime = time.perf_counter()
+    result = fitRider(bc, rc, {'kneeMax': 145.0, 'hipMin': (59.0, None)},
+                      {'seatHeight': (100.0, 300.0), 'seatRiderOffsetX': (-80.0, 80.0)})
+    print(result)
+    print('Fit in %.1f ms' % (1000 * (time.perf_counter() - startTime)))
@@ -0,0 +1,641 @@
+import math
+import numpy as np
+
+from bike import Bike
+from fourBarLink import FourBarLinkBatch
+
+
+class RiderCycle:
+    """
+    Positions and angles of a rider over an array of crank angles, solved without any drawing.
+
+    Values in the frame and rider configurations may be arrays, in which case every result has their broadcast
+    shape S first. Arrays that change with the crank then have a crank angle axis of length N, and positions
+    end with an [x,y] axis. The hip and upper body don't move during a cycle, so have no crank angle axis.
+    """
+    def __init__(self):
+        # Shape (N,)
+        self.crankAngle = None
+        self.footAngle1 = None
+        self.footAngle2 = None
+
+        # Shape S + (N, 2)
+        self.pedal1 = None
+        self.pedal2 = None
+        self.ankle = None
+        self.toe = None
+        self.ankle2 = None
+        self.toe2 = None
+        self.knee = None
+
+        # Shape S + (N, 2, 2), the two ends of each pedal
+        self.pedal1Ends = None
+        self.pedal2Ends = None
+
+        # Shape S + (N,)
+        self.kneeAngle = None
+        self.hipAngle = None
+        self.reachable = None
+
+        # Shape S + (2,)
+        self.hip = None
+        self.shoulder = None
+        self.elbow = None
+        self.hands = None
+
+        # Shape S
+        self.upperReachable = None
+
+    def calcExtrema(self):
+        """
+        Calculate the minimum and maximum knee and hip angles over the cycle.
+
+        :return: A dictionary of arrays with shape S. Angles are NaN where no crank angle could be reached, and
+                 reachable is only True if every crank angle could be reached.
+        """
+        return calcExtrema(self.kneeAngle, self.hipAngle, self.reachable)
+
+
+def calcExtrema(kneeAngle, hipAngle, reachable):
+    """
+    Calculate the minimum and maximum knee and hip angles along the last axis.
+
+    :param kneeAngle: The knee angles, NaN where unreachable.
+    :param hipAngle: The hip angles, NaN where unreachable.
+    :param reachable: The reachable flags.
+    :return: A dictionary of kneeMin, kneeMax, hipMin, hipMax and reachable arrays.
+    """
+    return {'kneeMin': np.fmin.reduce(kneeAngle, axis=-1),
+            'kneeMax': np.fmax.reduce(kneeAngle, axis=-1),
+            'hipMin': np.fmin.reduce(hipAngle, axis=-1),
+            'hipMax': np.fmax.reduce(hipAngle, axis=-1),
+            'reachable': np.all(reachable, axis=-1)}
+
+
+# The frame values the seats depend on, and those the hands depend on
+SEAT_FRAME_KEYS = ('seatTube2HoriAngle', 'xst', 'yst')
+HANDS_FRAME_KEYS = ('handsPosX', 'handsPosY')
+
+
+def frameFromBike(bike):
+    """
+    Collect the frame positions the rider kinematics and clearance checks depend on.
+
+    :param bike: A bike that has had calcBikePositions called.
+    :return: A frame dictionary for solveCycle.
+    """
+    return {'crankLength': bike.bc['crankLength'],
+            'seatTube2HoriAngle': bike.seatTube2HoriAngle,
+            'xst': bike.xst,
+            'yst': bike.yst,
+            'handsPosX': bike.handsPosX,
+            'handsPosY': bike.handsPosY,
+            'rearWheelX': bike.rearWheelLoc[0],
+            'rearWheelY': bike.rearWheelLoc[1],
+            'frontWheelX': bike.frontWheelLoc[0],
+            'frontWheelY': bike.frontWheelLoc[1],
+            'wheelRadius': bike.bc['wheelDiameter'] / 2.0,
+            'forkX': bike.xfork,
+            'forkY': bike.yfork,
+            'frontBarX': bike.xfb,
+            'frontBarY': bike.yfb,
+            'handleBarPostX': bike.handleBarPostPosX,
+            'handleBarPostY': bike.handleBarPostPosY,
+            'handleBarEndX': bike.handleBarEndPosX,
+            'handleBarEndY': bike.handleBarEndPosY,
+            'leverX': bike.leverX,
+            'leverY': bike.leverY}
+
+
+def calcFrame(bc):
+    """
+    Calculate the frame positions the rider kinematics depend on, from a bike configuration.
+
+    :param bc: The bike configuration dictionary.
+    :return: A frame dictionary for solveCycle.
+    """
+    bike = Bike(bc)
+    bike.calcBikePositions()
+
+    return frameFromBike(bike)
+
+
+def solveFrame(bc):
+    """
+    Solve the frame positions for many bike configurations at once, following Bike.calcBikePositions.
+
+    :param bc: The bike configuration dictionary. Values may be arrays, in which case every result has their
+               broadcast shape F.
+    :return: A frame dictionary of arrays with shape F, see calcFrame, and a boolean array with shape F of
+             whether each frame can be built from its lengths. Every value of a frame that can't be built is NaN.
+    """
+    def config(key):
+        return np.asarray(bc[key], dtype=float)
+
+    chainStay = config('chainStay')
+    bottomBracketDrop = config('bottomBracketDrop')
+    wheelBase = config('wheelBase')
+    seatTube = config('seatTube')
+    downTube = config('downTube')
+    topTube = config('topTube')
+    handleBar2FrontWheel = config('handleBar2FrontWheel')
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Wheels
+        rearWheelX = -np.sqrt(chainStay**2 - bottomBracketDrop**2)
+        rearWheelY = bottomBracketDrop
+        frontWheelX = rearWheelX + wheelBase
+        frontWheelY = rearWheelY
+
+        # Seat tube
+        chainStayAngle = np.sin(bottomBracketDrop / chainStay)
+        seatTube2ChainStayAngle = np.arccos((chainStay**2 + seatTube**2 - config('seatStay')**2) / (2*chainStay*seatTube))
+        seatTube2HoriAngle = chainStayAngle + seatTube2ChainStayAngle
+        xst = -seatTube * np.cos(seatTube2HoriAngle)
+        yst = seatTube * np.sin(seatTube2HoriAngle)
+
+        # Top of the fork
+        hub2FrontWheel = np.sqrt(bottomBracketDrop**2 + (wheelBase + rearWheelX)**2)
+        downTubeAngle = np.arccos((downTube**2 + hub2FrontWheel**2 - config('forkLength')**2) / (2*downTube*hub2FrontWheel))
+        downTubeHorzAngle = downTubeAngle + np.arcsin(bottomBracketDrop / hub2FrontWheel)
+        xfork = downTube * np.cos(downTubeHorzAngle)
+        yfork = downTube * np.sin(downTubeHorzAngle)
+
+        # Front bar
+        seatTube2DownTubeAngle = np.pi - seatTube2HoriAngle - downTubeHorzAngle
+        seatTube2FrontForkDist = np.sqrt(seatTube**2 + downTube**2 - (2*seatTube*downTube*np.cos(seatTube2DownTubeAngle)))
+        seatTube2FrontForkAngle = np.sin((yfork - yst) / seatTube2FrontForkDist)
+        topTubeHorzAngle = np.arccos((topTube**2 + seatTube2FrontForkDist**2 - config('headTube')**2) / (2*topTube*seatTube2FrontForkDist)) + seatTube2FrontForkAngle
+        xfb = xst + (topTube * np.cos(topTubeHorzAngle))
+        yfb = yst + (topTube * np.sin(topTubeHorzAngle))
+
+        # Handle bar
+        headTubeAngle = np.arctan((yfork - yfb) / (xfork - xfb)) + np.pi
+        handleBarPostX = xfb + (config('handleBarPost') * np.cos(headTubeAngle))
+        handleBarPostY = yfb + (config('handleBarPost') * np.sin(headTubeAngle))
+        frontWheel2HandleBarPost = np.sqrt((frontWheelX - handleBarPostX)**2 + (frontWheelY - handleBarPostY)**2)
+        frontWheel2HandleBarHorzAngle = -np.arctan((frontWheelY - handleBarPostY) / (frontWheelX - handleBarPostX))
+        hands2WheelForkAngle = np.arccos((handleBar2FrontWheel**2 + frontWheel2HandleBarPost**2 - config('handleBarLength')**2) / (2*handleBar2FrontWheel*frontWheel2HandleBarPost))
+        hands2WheelForkHorzAngle = frontWheel2HandleBarHorzAngle + hands2WheelForkAngle
+        handleBarEndX = frontWheelX + (handleBar2FrontWheel * np.cos(np.pi - hands2WheelForkHorzAngle))
+        handleBarEndY = frontWheelY + (handleBar2FrontWheel * np.sin(np.pi - hands2WheelForkHorzAngle))
+
+        # Levers
+        leverAngle = np.arctan((handleBarEndY - handleBarPostY) / (handleBarEndX - handleBarPostX)) - (np.pi/2.0)
+        leverLength = config('leverLength')
+
+        frame = {'crankLength': config('crankLength'),
+                 'seatTube2HoriAngle': seatTube2HoriAngle,
+                 'xst': xst,
+                 'yst': yst,
+                 'handsPosX': handleBarEndX + (leverLength * np.cos(leverAngle) / 2.0),
+                 'handsPosY': handleBarEndY + (leverLength * np.sin(leverAngle) / 2.0),
+                 'rearWheelX': rearWheelX,
+                 'rearWheelY': rearWheelY,
+                 'frontWheelX': frontWheelX,
+                 'frontWheelY': frontWheelY,
+                 'wheelRadius': config('wheelDiameter') / 2.0,
+                 'forkX': xfork,
+                 'forkY': yfork,
+                 'frontBarX': xfb,
+                 'frontBarY': yfb,
+                 'handleBarPostX': handleBarPostX,
+                 'handleBarPostY': handleBarPostY,
+                 'handleBarEndX': handleBarEndX,
+                 'handleBarEndY': handleBarEndY,
+                 'leverX': handleBarEndX + (leverLength * np.cos(leverAngle)),
+                 'leverY': handleBarEndY + (leverLength * np.sin(leverAngle))}
+
+    # Where Bike would raise, something along the way isn't finite
+    values = np.broadcast_arrays(*frame.values())
+    valid = np.all(np.isfinite(values), axis=0)
+
+    return {key: np.where(valid, value, np.nan) for key, value in zip(frame.keys(), values)}, valid
+
+
+def calcFrames(bcs):
+    """
+    Solve the frame positions for a list of bike configurations at once, such as a size run or a catalogue of
+    frames, see solveFrame.
+
+    :param bcs: A list of bike configuration dictionaries, or a dictionary of names to them.
+    :return: A frame dictionary of arrays with one value per bike, and whether each frame can be built.
+    """
+    if isinstance(bcs, dict):
+        bcs = list(bcs.values())
+
+    return solveFrame({key: np.array([bc[key] for bc in bcs], dtype=float) for key in bcs[0]})
+
+
+def calcFrameArrays(bc, bikeParams, n, baseFrame=None):
+    """
+    Calculate frame positions for many variations of a bike configuration, see solveFrame. Frames that can't be
+    built from their lengths are NaN.
+
+    :param bc: The base bike configuration dictionary.
+    :param bikeParams: A dictionary of bike configuration keys to arrays of n values, replacing those in bc.
+    :param n: The number of variations.
+    :param baseFrame: The frame dictionary for bc, if already calculated.
+    :return: A frame dictionary of arrays with n values, and whether each frame can be built.
+    """
+    geometryKeys = [key for key in bikeParams if key != 'crankLength']
+    if len(geometryKeys) == 0:
+        if baseFrame is None:
+            baseFrame = calcFrame(bc)
+        frame = {key: np.full(n, value, dtype=float) for key, value in baseFrame.items()}
+        if 'crankLength' in bikeParams:
+            frame['crankLength'] = np.broadcast_to(np.asarray(bikeParams['crankLength'], dtype=float), (n,))
+        valid = np.ones(n, dtype=bool)
+    else:
+        bcArrays = dict(bc)
+        bcArrays.update({key: np.broadcast_to(np.asarray(values, dtype=float), (n,)) for key, values in bikeParams.items()})
+        frame, valid = solveFrame(bcArrays)
+
+    return frame, valid
+
+
+def crankArray(value):
+    """
+    Add a crank angle axis to a configuration value, so it broadcasts against arrays of shape S + (N,).
+
+    :param value: The configuration value, with shape S.
+    :return: The value as a float array with shape S + (1,).
+    """
+    return np.asarray(value, dtype=float)[..., np.newaxis]
+
+
+def calcFootAngleRad(crankAngleDeg):
+    """
+    Calculate the foot angle using the experimental relationship in Rider.calculatePedalAndFoot.
+
+    :param crankAngleDeg: The crank angle(s) in degrees.
+    :return: The foot angle(s) in radians.
+    """
+    return np.radians(22 * np.sin(np.radians(-np.asarray(crankAngleDeg, dtype=float) + 190 + 90)) + 20.76)
+
+
+def calcAnkleXY(frame, rc, crankAngleDeg):
+    """
+    Calculate the ankle position of the driven leg relative to the bottom bracket, as in
+    Rider.calculatePedalAndFoot.
+
+    :param frame: The frame dictionary, see calcFrame. Values may be arrays.
+    :param rc: The rider configuration dictionary. Values may be arrays.
+    :param crankAngleDeg: A 1D array of crank angles in degrees, or an array of shape S + (N,).
+    :return: The ankle x and y arrays, with shape S + (N,).
+    """
+    crankAngleDeg = np.asarray(crankAngleDeg, dtype=float)
+    crankRad = np.radians(-crankAngleDeg)
+    footAngle = calcFootAngleRad(crankAngleDeg)
+    crankLength = crankArray(frame['crankLength'])
+    footLeverLength = crankArray(rc['footContactProportion']) * crankArray(rc['footLength'])
+    ankleX = (crankLength * np.cos(crankRad)) - (footLeverLength * np.cos(footAngle))
+    ankleY = (crankLength * np.sin(crankRad)) + (footLeverLength * np.sin(footAngle))
+
+    return ankleX, ankleY
+
+
+def calcToeXY(ankleX, ankleY, rc, crankAngleDeg):
+    """
+    Calculate the toe position of the driven leg, the foot length along the foot from the ankle.
+
+    :param ankleX: The ankle x array, with shape S + (N,), see calcAnkleXY.
+    :param ankleY: The ankle y array, with shape S + (N,).
+    :param rc: The rider configuration dictionary. Values may be arrays.
+    :param crankAngleDeg: The crank angles in degrees, as given to calcAnkleXY.
+    :return: The toe x and y arrays, with shape S + (N,).
+    """
+    footAngle = calcFootAngleRad(crankAngleDeg)
+    footLength = crankArray(rc['footLength'])
+
+    return ankleX + (footLength * np.cos(footAngle)), ankleY - (footLength * np.sin(footAngle))
+
+
+def calcHipPos(frame, rc):
+    """
+    Calculate the position of the rider's hip joint.
+
+    :param frame: The frame dictionary.
+    :param rc: The rider configuration dictionary.
+    :return: The [x,y] hip position with shape S + (2,).
+    """
+    seatHeight = np.asarray(rc['seatHeight'], dtype=float)
+    seatTube2HoriAngle = np.asarray(frame['seatTube2HoriAngle'], dtype=float)
+    hipX = frame['xst'] - (seatHeight * np.cos(seatTube2HoriAngle)) + rc['seatRiderOffsetX']
+    hipY = frame['yst'] + (seatHeight * np.sin(seatTube2HoriAngle)) + rc['seatRiderOffsetY']
+
+    return np.stack(np.broadcast_arrays(hipX, hipY), axis=-1)
+
+
+def calcAnkleOffset(ankleX, ankleY, hip):
+    """
+    Calculate the ankle position relative to the hip, and the squared ankle to hip distance the knee and hip
+    angles depend on.
+
+    :param ankleX: The ankle x array, with shape S + (N,), see calcAnkleXY.
+    :param ankleY: The ankle y array, with shape S + (N,).
+    :param hip: The [x,y] hip positions with shape S + (2,), see calcHipPos.
+    :return: The x and y offsets and the squared distance, with shape S + (N,).
+    """
+    dx = ankleX - hip[..., 0:1]
+    dy = ankleY - hip[..., 1:2]
+    AO4LenSq = dx**2
+    AO4LenSq += dy**2
+
+    return dx, dy, AO4LenSq
+
+
+def calcKneeCosine(AO4LenSq, knee2AnkleLength, hip2KneeLength):
+    """
+    Calculate the cosine of the knee angle, using the cosine rule. The legs can reach where it's strictly between
+    -1 and 1.
+
+    :param AO4LenSq: The squared ankle to hip distances.
+    :param knee2AnkleLength: The knee to ankle length(s), broadcastable against the distances.
+    :param hip2KneeLength: The hip to knee length(s), broadcastable in the same way.
+    :return: The knee cosines.
+    """
+    return (-AO4LenSq + knee2AnkleLength**2 + hip2KneeLength**2) / (2 * knee2AnkleLength * hip2KneeLength)
+
+
+def calcHipCosine(AO4LenSq, knee2AnkleLength, hip2KneeLength):
+    """
+    Calculate the cosine of the angle at the hip between the thigh and the ankle to hip line, using the cosine
+    rule, see calcKneeCosine.
+
+    :return: The hip cosines.
+    """
+    return (-knee2AnkleLength**2 + AO4LenSq + hip2KneeLength**2) / (2 * np.sqrt(AO4LenSq) * hip2KneeLength)
+
+
+def calcLegAngles(cosKnee, cosOpp, hip2HorizontalAngleDeg):
+    """
+    Calculate the knee angle and the signed hip angle from the leg cosines, as in Rider.calcKneeAngle and
+    Rider.calcHipAngle. The hip angle is the magnitude of the signed one.
+
+    :param cosKnee: The knee cosines, see calcKneeCosine.
+    :param cosOpp: The hip cosines, see calcHipCosine.
+    :param hip2HorizontalAngleDeg: The torso angle(s) in degrees, broadcastable against the cosines.
+    :return: The knee angles and signed hip angles in degrees.
+    """
+    kneeAngle = np.degrees(np.arccos(np.clip(cosKnee, -1.0, 1.0)))
+    oppAngle = np.degrees(np.arccos(np.clip(cosOpp, -1.0, 1.0)))
+
+    return kneeAngle, (90 - oppAngle) + hip2HorizontalAngleDeg
+
+
+def calcJointAngles(ankle, hip, knee2AnkleLength, hip2KneeLength, hip2HorizontalAngleDeg):
+    """
+    Calculate the knee and hip angles from the ankle to hip distance, see calcLegAngles.
+
+    :param ankle: The [x,y] ankle positions.
+    :param hip: The [x,y] hip positions.
+    :param knee2AnkleLength: The knee to ankle length(s), broadcastable against the positions without [x,y].
+    :param hip2KneeLength: The hip to knee length(s), broadcastable in the same way.
+    :param hip2HorizontalAngleDeg: The torso angle(s) in degrees, broadcastable in the same way.
+    :return: The knee and hip angles in degrees.
+    """
+    AO4LenSq = np.sum((ankle - hip)**2, axis=-1)
+    cosKnee = calcKneeCosine(AO4LenSq, knee2AnkleLength, hip2KneeLength)
+    cosOpp = calcHipCosine(AO4LenSq, knee2AnkleLength, hip2KneeLength)
+    kneeAngle, hipAngle = calcLegAngles(cosKnee, cosOpp, hip2HorizontalAngleDeg)
+
+    return kneeAngle, np.abs(hipAngle)
+
+
+def solveJointAngles(frame, rc, crankAngleDeg):
+    """
+    Solve only the knee and hip angles for an array of crank angles.
+    This skips the joint positions, so is much cheaper than solveCycle when only the angles are needed. The
+    legs can be assembled exactly when the ankle to hip distance is between the difference and the sum of the
+    leg lengths, so this gives the same reachability as solving the four bar link.
+
+    :param frame: The frame dictionary, see calcFrame. Values may be arrays.
+    :param rc: The rider configuration dictionary. Values may be arrays.
+    :param crankAngleDeg: A 1D array of crank angles in degrees, or an array of shape S + (N,) to give each
+                          configuration its own crank angles.
+    :return: The knee angles, hip angles and reachable flags, with shape S + (N,). Angles are NaN where the legs
+             can't reach.
+    """
+    _, _, AO4LenSq = calcAnkleOffset(*calcAnkleXY(frame, rc, crankAngleDeg), calcHipPos(frame, rc))
+    knee2AnkleLength = crankArray(rc['knee2AnkleLength'])
+    hip2KneeLength = crankArray(rc['hip2KneeLength'])
+    cosKnee = calcKneeCosine(AO4LenSq, knee2AnkleLength, hip2KneeLength)
+    cosOpp = calcHipCosine(AO4LenSq, knee2AnkleLength, hip2KneeLength)
+    reachable = np.abs(cosKnee) < 1.0
+    kneeAngle, hipAngle = calcLegAngles(cosKnee, cosOpp, crankArray(rc['hip2HorizontalAngleDeg']))
+    kneeAngle = np.where(reachable, kneeAngle, np.nan)
+    hipAngle = np.where(reachable, np.abs(hipAngle), np.nan)
+
+    return kneeAngle, hipAngle, reachable
+
+
+# Configuration values that joint angle sensitivities can be calculated for
+SENSITIVITY_PARAMS = ('seatHeight', 'seatRiderOffsetX', 'seatRiderOffsetY', 'crankLength', 'footLength',
+                      'footContactProportion', 'knee2AnkleLength', 'hip2KneeLength', 'hip2HorizontalAngleDeg')
+
+
+class JointAngleDerivatives:
+    """
+    Knee and hip angles over an array of crank angles, with their exact derivatives.
+
+    All arrays have shape S + (N,), as in solveJointAngles. Rates are in degrees per degree of crank angle, and
+    sensitivities are in degrees per unit of each configuration value. Every value is NaN where the legs can't
+    reach.
+    """
+    def __init__(self):
+        self.kneeAngle = None
+        self.hipAngle = None
+        self.reachable = None
+
+        self.kneeRate = None
+        self.hipRate = None
+
+        # Dictionaries of configuration keys to arrays
+        self.kneeSensitivity = {}
+        self.hipSensitivity = {}
+
+
+def solveJointAngleDerivatives(frame, rc, crankAngleDeg, params=()):
+    """
+    Solve the knee and hip angles for an array of crank angles, with their derivatives with respect to the crank
+    angle and to configuration values.
+
+    Both angles only depend on the ankle to hip distance and the leg lengths, so the derivatives follow from
+    differentiating the cosine rule and the ankle position in closed form, alongside the angles themselves.
+
+    :param frame: The frame dictionary, see calcFrame. Values may be arrays.
+    :param rc: The rider configuration dictionary. Values may be arrays.
+    :param crankAngleDeg: The crank angles in degrees, see solveJointAngles.
+    :param params: Configuration keys from SENSITIVITY_PARAMS to calculate sensitivities to.
+    :return: A JointAngleDerivatives.
+    """
+    for param in params:
+        if param not in SENSITIVITY_PARAMS:
+            raise ValueError('Unknown sensitivity parameter %s, must be one of %s.' % (param, ', '.join(SENSITIVITY_PARAMS)))
+
+    # Ankle relative to the hip, and the angles, as in solveJointAngles
+    dx, dy, AO4LenSq = calcAnkleOffset(*calcAnkleXY(frame, rc, crankAngleDeg), calcHipPos(frame, rc))
+    AO4Len = np.sqrt(AO4LenSq)
+    knee2AnkleLength = crankArray(rc['knee2AnkleLength'])
+    hip2KneeLength = crankArray(rc['hip2KneeLength'])
+    cosKnee = calcKneeCosine(AO4LenSq, knee2AnkleLength, hip2KneeLength)
+    cosOpp = calcHipCosine(AO4LenSq, knee2AnkleLength, hip2KneeLength)
+    reachable = np.abs(cosKnee) < 1.0
+    kneeAngle, hipInner = calcLegAngles(cosKnee, cosOpp, crankArray(rc['hip2HorizontalAngleDeg']))
+
+    # Rate of the ankle offset
+    crankAngleDeg = np.asarray(crankAngleDeg, dtype=float)
+    degPerRad = 180.0 / math.pi
+    crankRad = np.radians(-crankAngleDeg)
+    footAngle = calcFootAngleRad(crankAngleDeg)
+    crankRadRate = -1.0 / degPerRad
+    footAngleRate = -22 * np.cos(np.radians(-crankAngleDeg + 190 + 90)) / degPerRad**2
+    crankLength = crankArray(frame['crankLength'])
+    footLength = crankArray(rc['footLength'])
+    footContactProportion = crankArray(rc['footContactProportion'])
+    footLeverLength = footContactProportion * footLength
+    dxRate = (-crankLength * np.sin(crankRad) * crankRadRate) + (footLeverLength * np.sin(footAngle) * footAngleRate)
+    dyRate = (crankLength * np.cos(crankRad) * crankRadRate) + (footLeverLength * np.cos(footAngle) * footAngleRate)
+
+    # Derivatives of the angles with respect to the squared ankle to hip distance
+    sinKnee = np.sqrt(np.where(reachable, 1 - cosKnee**2, 1.0))
+    sinOpp = np.sqrt(np.where(reachable, np.maximum(1 - cosOpp**2, 0.0), 1.0))
+    hipSign = np.sign(hipInner)
+    kneePerLenSq = degPerRad / (2 * knee2AnkleLength * hip2KneeLength * sinKnee)
+    cosOppPerLenSq = (AO4LenSq - hip2KneeLength**2 + knee2AnkleLength**2) / (4 * hip2KneeLength * AO4LenSq * AO4Len)
+    hipPerLenSq = hipSign * degPerRad * cosOppPerLenSq / sinOpp
+
+    def unreachableNaN(value):
+        return np.where(reachable, value, np.nan)
+
+    derivatives = JointAngleDerivatives()
+    derivatives.reachable = reachable
+    derivatives.kneeAngle = unreachableNaN(kneeAngle)
+    derivatives.hipAngle = unreachableNaN(np.abs(hipInner))
+    lenSqRate = 2 * ((dx * dxRate) + (dy * dyRate))
+    derivatives.kneeRate = unreachableNaN(kneePerLenSq * lenSqRate)
+    derivatives.hipRate = unreachableNaN(hipPerLenSq * lenSqRate)
+
+    # Sensitivities, through the ankle to hip offset and directly through the leg lengths and torso angle
+    seatTube2HoriAngle = crankArray(frame['seatTube2HoriAngle'])
+    offsets = {'seatHeight': (np.cos(seatTube2HoriAngle), -np.sin(seatTube2HoriAngle)),
+               'seatRiderOffsetX': (-1.0, 0.0),
+               'seatRiderOffsetY': (0.0, -1.0),
+               'crankLength': (np.cos(crankRad), np.sin(crankRad)),
+               'footLength': (-footContactProportion * np.cos(footAngle), footContactProportion * np.sin(footAngle)),
+               'footContactProportion': (-footLength * np.cos(footAngle), footLength * np.sin(footAngle))}
+    for param in params:
+        kneeDirect = 0.0
+        hipDirect = 0.0
+        lenSqSensitivity = 0.0
+        if param in offsets:
+            dxSensitivity, dySensitivity = offsets[param]
+            lenSqSensitivity = 2 * ((dx * dxSensitivity) + (dy * dySensitivity))
+        elif param == 'knee2AnkleLength':
+            kneeDirect = -degPerRad * ((1 / hip2KneeLength) - (cosKnee / knee2AnkleLength)) / sinKnee
+            hipDirect = -hipSign * degPerRad * knee2AnkleLength / (hip2KneeLength * AO4Len * sinOpp)
+        elif param == 'hip2KneeLength':
+            kneeDirect = -degPerRad * ((1 / knee2AnkleLength) - (cosKnee / hip2KneeLength)) / sinKnee
+            hipDirect = hipSign * degPerRad * ((1 / AO4Len) - (cosOpp / hip2KneeLength)) / sinOpp
+        else:
+            hipDirect = hipSign
+        derivatives.kneeSensitivity[param] = unreachableNaN((kneePerLenSq * lenSqSensitivity) + kneeDirect)
+        derivatives.hipSensitivity[param] = unreachableNaN((hipPerLenSq * lenSqSensitivity) + hipDirect)
+
+    return derivatives
+
+
+def solveUpperReachable(frame, rc):
+    """
+    Check whether the upper body can reach the hands, without solving the joint positions.
+
+    :param frame: The frame dictionary, see calcFrame. Values may be arrays.
+    :param rc: The rider configuration dictionary. Values may be arrays.
+    :return: The reachable flags, with shape S.
+    """
+    hip = calcHipPos(frame, rc)
+    torsoRad = np.radians(rc['hip2HorizontalAngleDeg'])
+    shoulderX = hip[..., 0] + (rc['hip2ShoulderLength'] * np.cos(torsoRad))
+    shoulderY = hip[..., 1] + (rc['hip2ShoulderLength'] * np.sin(torsoRad))
+    shoulder2Hands = np.sqrt((frame['handsPosX'] - shoulderX)**2 + (frame['handsPosY'] - shoulderY)**2)
+    upperArm = np.asarray(rc['shoulder2ElbowLength'], dtype=float)
+    lowerArm = np.asarray(rc['elbow2WristContactLength'], dtype=float)
+
+    return (shoulder2Hands > np.abs(upperArm - lowerArm)) & (shoulder2Hands < upperArm + lowerArm)
+
+
+def solveCycle(frame, rc, crankAngleDeg):
+    """
+    Solve the rider kinematics for an array of crank angles.
+
+    :param frame: The frame dictionary, see calcFrame. Values may be arrays.
+    :param rc: The rider configuration dictionary. Values may be arrays.
+    :param crankAngleDeg: A 1D array of crank angles in degrees, using the same convention as
+                          Rider.calcRiderLowerBody.
+    :return: A RiderCycle.
+    """
+    cycle = RiderCycle()
+    cycle.crankAngle = np.asarray(crankAngleDeg, dtype=float)
+    cycle.footAngle1 = calcFootAngleRad(cycle.crankAngle)
+    cycle.footAngle2 = calcFootAngleRad(cycle.crankAngle + 180)
+
+    # Cranks turn the opposite way to the crank angle, see main.py
+    crankLength = crankArray(frame['crankLength'])
+    crankRad = np.radians(-cycle.crankAngle)
+    cycle.pedal1 = np.stack(np.broadcast_arrays(crankLength * np.cos(crankRad), crankLength * np.sin(crankRad)), axis=-1)
+    cycle.pedal2 = np.stack(np.broadcast_arrays(crankLength * np.cos(crankRad + math.pi), crankLength * np.sin(crankRad + math.pi)), axis=-1)
+
+    # Pedal ends
+    halfPedal = crankArray(rc['pedalLength']) / 2.0
+    pedal1Offset = np.stack(np.broadcast_arrays(halfPedal * np.cos(cycle.footAngle1), -halfPedal * np.sin(cycle.footAngle1)), axis=-1)
+    pedal2Offset = np.stack(np.broadcast_arrays(halfPedal * np.cos(cycle.footAngle2 + math.pi), -halfPedal * np.sin(cycle.footAngle2 + math.pi)), axis=-1)
+    cycle.pedal1Ends = np.stack(np.broadcast_arrays(cycle.pedal1 - pedal1Offset, cycle.pedal1 + pedal1Offset), axis=-2)
+    cycle.pedal2Ends = np.stack(np.broadcast_arrays(cycle.pedal2 - pedal2Offset, cycle.pedal2 + pedal2Offset), axis=-2)
+
+    # Ankle and toe
+    footLength = crankArray(rc['footLength'])
+    footLeverLength = crankArray(rc['footContactProportion']) * footLength
+    footDir = np.stack([np.cos(cycle.footAngle1), -np.sin(cycle.footAngle1)], axis=-1)
+    cycle.ankle = cycle.pedal1 - (footLeverLength[..., np.newaxis] * footDir)
+    cycle.toe = cycle.ankle + (footLength[..., np.newaxis] * footDir)
+    footDir2 = np.stack([np.cos(cycle.footAngle2), -np.sin(cycle.footAngle2)], axis=-1)
+    cycle.ankle2 = cycle.pedal2 - (footLeverLength[..., np.newaxis] * footDir2)
+    cycle.toe2 = cycle.ankle2 + (footLength[..., np.newaxis] * footDir2)
+
+    # Legs, O2 is the pedal, A is the ankle, B is the knee and O4 is the hip
+    cycle.hip = calcHipPos(frame, rc)
+    knee2AnkleLength = crankArray(rc['knee2AnkleLength'])
+    hip2KneeLength = crankArray(rc['hip2KneeLength'])
+    legs = FourBarLinkBatch(cycle.pedal1, cycle.hip[..., np.newaxis, :], footLeverLength, knee2AnkleLength,
+                            hip2KneeLength, math.pi - cycle.footAngle1)
+    cycle.knee = legs.Bnn1
+    cycle.reachable = legs.valid
+
+    kneeAngle, hipAngle = calcJointAngles(cycle.ankle, cycle.hip[..., np.newaxis, :], knee2AnkleLength,
+                                          hip2KneeLength, crankArray(rc['hip2HorizontalAngleDeg']))
+    cycle.kneeAngle = np.where(cycle.reachable, kneeAngle, np.nan)
+    cycle.hipAngle = np.where(cycle.reachable, hipAngle, np.nan)
+
+    # Upper body, O2 is the hip, A is the shoulder, B is the elbow and O4 is the hands
+    cycle.hands = np.stack(np.broadcast_arrays(np.asarray(frame['handsPosX'], dtype=float),
+                                               np.asarray(frame['handsPosY'], dtype=float)), axis=-1)
+    upper = FourBarLinkBatch(cycle.hip, cycle.hands, rc['hip2ShoulderLength'], rc['shoulder2ElbowLength'],
+                             rc['elbow2WristContactLength'], np.radians(rc['hip2HorizontalAngleDeg']))
+    cycle.shoulder = upper.Ann
+    cycle.elbow = upper.Bnn1
+    cycle.upperReachable = upper.valid
+
+    return cycle
+
+
+def calcRiderCycle(bc, rc, crankAngleDeg):
+    """
+    Solve a rider over an array of crank angles, straight from the bike and rider configurations.
+
+    :param bc: The bike configuration dictionary.
+    :param rc: The rider configuration dictionary.
+    :param crankAngleDeg: A 1D array of crank angles in degrees.
+    :return: A RiderCycle.
+    """
+    return solveCycle(calcFrame(bc), rc, crankAngleDeg)
@@ -1,25 +1,36 @@
-import matplotlib.pyplot as plt
 import numpy as np
+import argparse
 import math
 import json
 
-from bike import Bike
-from rider import Rider
+from extrema import findExtrema
+from kinematics import calcFrame
+from population import RiderBatch
 
 
 
-if __name__ == '__main__':
+def readConfigs(bikePath, ridersPath, verbose=True):
+    """
+    Read the bike and rider configuration files.
+
+    :param bikePath: The path to the bike configuration file.
+    :param ridersPath: The path to the rider configuration file.
+    :param verbose: Whether to print the configurations.
+    :return: The bike configuration dictionary, and a dictionary of rider names to rider configurations.
+    """
     # Read bike configuration
-    with open('bike.json') as f:
+    with open(bikePath) as f:
         bc = json.load(f)
+    if verbose:
         print('Read bike configuration file:')
         for key, val in bc.items():
             print(key+":", val)
         print()
 
     # Read rider configurations
-    with open('rider.json') as f:
+    with open(ridersPath) as f:
         rcs = json.load(f)
+    if verbose:
         print('Read rider configuration file:')
         for riderName, rc in rcs.items():
             print("Rider: %s" % riderName)
@@ -27,23 +38,48 @@ if __name__ == '__main__':
                 print(key+":", val)
             print()
 
+    return bc, rcs
+
+
+def printReport(bc, rcs, samples=360):
+    """
+    Print the knee and hip angle extrema of every rider over one crank revolution, and the crank angles they occur
+    at, without drawing anything.
+
+    :param bc: The bike configuration dictionary.
+    :param rcs: A dictionary of rider names to rider configurations.
+    :param samples: The number of crank angles in the coarse pass before refining the extrema.
+    """
+    batch = RiderBatch.fromConfigs(rcs)
+    extrema = findExtrema(calcFrame(bc), batch.arrays, coarseSamples=samples)
+
+    for i, riderName in enumerate(batch.names):
+        print('%20s. Knee Min: %.2f deg at %.2f, Knee Max: %.2f deg at %.2f, Hip Min: %.2f deg at %.2f, Hip Max: %.2f deg at %.2f%s' % (
+            riderName, extrema['kneeMin'][i], extrema['kneeMinCrankAngle'][i], extrema['kneeMax'][i],
+            extrema['kneeMaxCrankAngle'][i], extrema['hipMin'][i], extrema['hipMinCrankAngle'][i], extrema['hipMax'][i],
+            extrema['hipMaxCrankAngle'][i], '' if extrema['reachable'][i] else ', can\'t reach the pedals at every crank angle'))
+
+
+def animate(bc, rcs, args, instrumentation=None):
+    """
+    Animate the riders on the bike through the crank cycle.
+
+    :param bc: The bike configuration dictionary.
+    :param rcs: A dictionary of rider names to rider configurations, which must include rider1 to rider4.
+    :param args: The parsed command line arguments.
+    :param instrumentation: Optional Instrumentation to time the animation stages with.
+    """
+    # Only load matplotlib when drawing
+    import matplotlib.pyplot as plt
+    from bike import Bike
+    from rider import Rider
+    from renderer import RIDER_COLORS, BlitRenderer, createFigure
 
     # Create figure
-    fig = plt.figure(figsize=(13*1.5, 5*1.5))
-    ax1 = plt.subplot(121)
-    ax2 = plt.subplot(222)
-    ax3 = plt.subplot(224, sharex=ax2)
-    ax3.set_xlabel('Crank Angle (Deg)')
-    ax2.set_ylabel('Knee Angle (Deg)')
-    ax3.set_ylabel('Hip Angle (Deg)')
-    ax2.grid(axis='y', ls='--')
-    ax3.grid(axis='y', ls='--')
-    plt.tight_layout()
-    ax1.axis('equal')
-    ax1.set_xlim([-950, 1200])
-    ax1.set_ylim([-400, 1050])
-    ax1.axis('off')
+    fig, ax1, ax2, ax3 = createFigure()
     plt.ion()
+    if instrumentation is not None:
+        instrumentation.enable()
 
 
 
@@ -54,10 +90,16 @@ if __name__ == '__main__':
     bike.calcBikePositions()
 
     # Create riders
-    rider1 = Rider(rcs['rider1'], bike, seatColor='royalblue', riderColor='blueviolet', riderAlpha=0.5, ax=ax1)
-    rider2 = Rider(rcs['rider2'], bike, seatColor='lime', riderColor='darkgreen', riderAlpha=0.5, ax=ax1)
-    rider3 = Rider(rcs['rider3'], bike, seatColor='purple', riderColor='red', riderAlpha=0.5, ax=ax1)
-    rider4 = Rider(rcs['rider4'], bike, seatColor='cyan', riderColor='lime', riderAlpha=0.5, ax=ax1)
+    riders = []
+    for name, (seatColor, riderColor) in zip(('rider1', 'rider2', 'rider3', 'rider4'), RIDER_COLORS):
+        riders.append(Rider(rcs[name], bike, seatColor=seatColor, riderColor=riderColor, riderAlpha=0.5, ax=ax1))
+    if args.cache_samples > 0:
+        resultCache = None
+        if args.result_cache is not None:
+            from resultCache import CycleCache
+            resultCache = CycleCache(args.result_cache)
+        for rider in riders:
+            rider.usePoseCache(args.cache_samples, resultCache)
 
 
 
@@ -65,38 +107,79 @@ if __name__ == '__main__':
     bike.drawBikePositions()
 
     # Draw Seat
-    rider1.drawSeat()
-    rider2.drawSeat()
-    rider3.drawSeat()
-    rider4.drawSeat()
-
-    # Draw pedal and feet
-    for crankAngleDeg in np.linspace(-2, 360*40, 360*20):
-        # Draw cranks
-        bike.calcCrankLoc(theta=-crankAngleDeg)
-        bike.drawCrank()
-
-        # Draw rider lower body
-        rider1.calcAndDrawAll(crankAngleDeg)
-        rider2.calcAndDrawAll(crankAngleDeg)
-        rider3.calcAndDrawAll(crankAngleDeg)
-        rider4.calcAndDrawAll(crankAngleDeg)
-
-        # Draw angle lines
-        rider1.drawAngleLines(ax2, ax3)
-        rider2.drawAngleLines(ax2, ax3)
-        rider3.drawAngleLines(ax2, ax3)
-        rider4.drawAngleLines(ax2, ax3)
-
-        # Update Axes Limits
-        ax2.relim()
-        ax2.autoscale_view()
-        ax3.relim()
-        ax3.autoscale_view()
-
-        plt.pause(0.01)
+    for rider in riders:
+        rider.drawSeat()
+
+    crankAngles = np.linspace(-2, 360*40, 360*20)[:args.frames]
+    if args.blit:
+        # Only redraw moving artists
+        plt.show(block=False)
+        renderer = BlitRenderer(fig, bike, riders, ax2, ax3, fps=args.fps)
+        renderer.setup(crankAngles[0])
+        for crankAngleDeg in crankAngles:
+            renderer.drawFrame(crankAngleDeg)
+    else:
+        # Draw pedal and feet
+        for crankAngleDeg in crankAngles:
+            # Draw cranks
+            bike.calcCrankLoc(theta=-crankAngleDeg)
+            bike.drawCrank()
+
+            # Draw rider lower body
+            for rider in riders:
+                rider.calcAndDrawAll(crankAngleDeg)
+
+            # Draw angle lines
+            for rider in riders:
+                rider.drawAngleLines(ax2, ax3)
+
+            # Update Axes Limits
+            ax2.relim()
+            ax2.autoscale_view()
+            ax3.relim()
+            ax3.autoscale_view()
+
+            plt.pause(0.01)
+
+    if instrumentation is not None:
+        instrumentation.disable()
+        print(instrumentation.formatSummary())
+        instrumentation.writeChromeTrace(args.trace)
+        print('Wrote Chrome trace to %s' % args.trace)
 
     plt.axis('equal')
     plt.show()
 
 
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Visualise riders on a bike through the crank cycle.')
+    parser.add_argument('--bike', default='bike.json', help='The bike configuration file.')
+    parser.add_argument('--riders', default='rider.json', help='The rider configuration file.')
+    parser.add_argument('--headless', action='store_true', help='Print the knee and hip angle extrema of each rider without drawing.')
+    parser.add_argument('--samples', type=int, default=36, help='The number of coarse crank angles per revolution in headless mode, before refining the extrema.')
+    parser.add_argument('--blit', action='store_true', help='Only redraw the moving artists each frame, with fixed angle axes.')
+    parser.add_argument('--fps', type=float, default=60.0, help='The maximum frame rate when blitting, or 0 to draw as fast as possible.')
+    parser.add_argument('--cache-samples', type=int, default=0, help='Solve one revolution with this many crank angles per rider, and replay it for every frame.')
+    parser.add_argument('--result-cache', help='A directory to keep the revolutions solved with --cache-samples in, so later runs load them instead.')
+    parser.add_argument('--profile', action='store_true', help='Time every compute and draw stage of the animation, and print a summary.')
+    parser.add_argument('--trace', default='trace.json', help='The Chrome trace file written with --profile.')
+    parser.add_argument('--frames', type=int, default=360*20, help='The number of frames to animate.')
+    parser.add_argument('--interactive', action='store_true', help='Show the riders at one crank angle, with sliders to change the bike and rider configurations.')
+    args = parser.parse_args()
+
+    bc, rcs = readConfigs(args.bike, args.riders, verbose=not args.headless)
+    if args.headless:
+        printReport(bc, rcs, args.samples)
+    elif args.interactive:
+        import matplotlib.pyplot as plt
+        from interactive import InteractiveFit
+        fit = InteractiveFit(bc, rcs)
+        fit.setup()
+        plt.show()
+    else:
+        instrumentation = None
+        if args.profile:
+            from instrumentation import Instrumentation
+            instrumentation = Instrumentation()
+        animate(bc, rcs, args, instrumentation)
@@ -0,0 +1,165 @@
+import json
+import time
+import numpy as np
+
+from feasibility import FEASIBILITY_FLAGS, FEASIBILITY_STATS, screenFeasibility
+from kinematics import calcExtrema, calcFrame, calcFrames, solveCycle, solveJointAngles, solveUpperReachable
+
+
+POPULATION_STATS = ('kneeMin', 'kneeMax', 'hipMin', 'hipMax', 'kneeMinCrankAngle', 'kneeMaxCrankAngle',
+                    'hipMinCrankAngle', 'hipMaxCrankAngle', 'reachable', 'upperReachable') + FEASIBILITY_STATS
+POPULATION_FLAGS = ('reachable', 'upperReachable') + FEASIBILITY_FLAGS
+
+
+class RiderBatch:
+    """
+    Many rider configurations packed as a struct of arrays, with one array per configuration key, so that they
+    can be solved against a bike as 2D arrays of riders by crank angles.
+    """
+    def __init__(self, arrays, names=None):
+        """
+        :param arrays: A dictionary of rider configuration keys to 1D arrays, with one value per rider.
+        :param names: Optional names for the riders.
+        """
+        self.arrays = {key: np.asarray(values, dtype=float) for key, values in arrays.items()}
+        self.size = len(next(iter(self.arrays.values())))
+        self.names = list(range(self.size)) if names is None else list(names)
+
+    @classmethod
+    def fromConfigs(cls, rcs):
+        """
+        Pack rider configuration dictionaries into a batch.
+
+        :param rcs: A dictionary of rider names to rider configurations, as in rider.json, or a list of rider
+                    configurations.
+        :return: A RiderBatch.
+        """
+        if isinstance(rcs, dict):
+            names = list(rcs.keys())
+            rcs = list(rcs.values())
+        else:
+            names = None
+        keys = rcs[0].keys()
+
+        return cls({key: [rc[key] for rc in rcs] for key in keys}, names)
+
+    def __len__(self):
+        return self.size
+
+    def getConfigs(self, start, stop):
+        """
+        Get a contiguous slice of the riders as a rider configuration dictionary of arrays.
+
+        :param start: The first rider index.
+        :param stop: One past the last rider index.
+        """
+        return {key: values[start:stop] for key, values in self.arrays.items()}
+
+    def solveCycle(self, frame, crankAngleDeg):
+        """
+        Solve every rider's positions and angles. Arrays in the result have a leading rider axis.
+
+        :param frame: The frame dictionary, see kinematics.calcFrame.
+        :param crankAngleDeg: A 1D array of crank angles in degrees.
+        :return: A RiderCycle.
+        """
+        return solveCycle(frame, self.arrays, crankAngleDeg)
+
+    def evaluate(self, frame, crankAngleDeg, chunkSize=4096, traces=False):
+        """
+        Calculate the joint angle extrema of every rider, and the crank angles they occur at.
+        Riders are solved in chunks, so memory use stays bounded however many riders there are. Riders are
+        screened first, and those whose legs can't reach the pedals at any crank angle, on any of the frames, aren't
+        solved.
+
+        Frame values may be arrays with shape F, such as from kinematics.solveFrame, to fit every rider to every
+        frame in one call. Frames that can't be built are NaN, so no rider can reach on them.
+
+        :param frame: The frame dictionary, see kinematics.calcFrame.
+        :param crankAngleDeg: A 1D array of crank angles in degrees.
+        :param chunkSize: The number of riders to solve at once, across every frame.
+        :param traces: Whether to also return the knee and hip angles at every crank angle.
+        :return: A dictionary of POPULATION_STATS to arrays of shape F + (riders,). With traces, also a float32
+                 array of shape F + (riders, 2, crank angles) holding the knee then hip angles.
+        """
+        crankAngleDeg = np.asarray(crankAngleDeg, dtype=float)
+
+        # Add a rider axis to the frames
+        frameShape = np.broadcast_shapes(*[np.shape(value) for value in frame.values()])
+        if len(frameShape) > 0:
+            frame = {key: np.asarray(value, dtype=float)[..., np.newaxis] for key, value in frame.items()}
+            chunkSize = max(1, chunkSize // int(np.prod(frameShape)))
+
+        metrics = {stat: np.empty(frameShape + (self.size,), dtype=bool if stat in POPULATION_FLAGS else float)
+                   for stat in POPULATION_STATS}
+        angleTraces = np.empty(frameShape + (self.size, 2, len(crankAngleDeg)), dtype=np.float32) if traces else None
+
+        for start in range(0, self.size, chunkSize):
+            stop = min(start + chunkSize, self.size)
+            rc = self.getConfigs(start, stop)
+            for stat, value in screenFeasibility(frame, rc).items():
+                metrics[stat][..., start:stop] = value
+            metrics['upperReachable'][..., start:stop] = solveUpperReachable(frame, rc)
+
+            # Only solve riders that can reach on some frame
+            feasible = np.any(metrics['legFeasible'][..., start:stop].reshape(-1, stop - start), axis=0)
+            if not np.all(feasible):
+                for stat in POPULATION_STATS:
+                    if stat not in FEASIBILITY_STATS and stat != 'upperReachable':
+                        metrics[stat][..., start:stop] = False if stat in POPULATION_FLAGS else np.nan
+                if traces:
+                    angleTraces[..., start:stop, :, :] = np.nan
+                riders = start + np.flatnonzero(feasible)
+                if len(riders) == 0:
+                    continue
+                rc = {key: values[riders] for key, values in self.arrays.items()}
+            else:
+                riders = slice(start, stop)
+
+            kneeAngle, hipAngle, reachable = solveJointAngles(frame, rc, crankAngleDeg)
+            if traces:
+                angleTraces[..., riders, 0, :] = kneeAngle
+                angleTraces[..., riders, 1, :] = hipAngle
+
+            for stat, value in calcExtrema(kneeAngle, hipAngle, reachable).items():
+                metrics[stat][..., riders] = value
+
+            # Crank angles of the extrema, ignoring unreachable angles
+            for stat, angles, fill, argFunc in (('kneeMin', kneeAngle, np.inf, np.argmin), ('kneeMax', kneeAngle, -np.inf, np.argmax),
+                                                ('hipMin', hipAngle, np.inf, np.argmin), ('hipMax', hipAngle, -np.inf, np.argmax)):
+                idx = argFunc(np.where(reachable, angles, fill), axis=-1)
+                metrics[stat + 'CrankAngle'][..., riders] = np.where(np.any(reachable, axis=-1), crankAngleDeg[idx], np.nan)
+
+        if traces:
+            return metrics, angleTraces
+        return metrics
+
+
+
+if __name__ == '__main__':
+    with open('bike.json') as f:
+        bc = json.load(f)
+    with open('rider.json') as f:
+        rcs = json.load(f)
+
+    # Scatter the example riders into a large population
+    rng = np.random.default_rng(0)
+    batch = RiderBatch.fromConfigs(rcs)
+    idx = rng.integers(0, len(batch), 100000)
+    population = RiderBatch({key: values[idx] * rng.normal(1.0, 0.03, len(idx)) for key, values in batch.arrays.items()})
+
+    startTime = time.perf_counter()
+    metrics = population.evaluate(calcFrame(bc), np.linspace(0, 360, 360, endpoint=False))
+    print('Evaluated %d riders in %.2f s, %d can reach the pedals at every crank angle' % (
+        len(population), time.perf_counter() - startTime, np.count_nonzero(metrics['reachable'])))
+
+    # Fit the example riders to a size run of the example frame
+    scales = np.linspace(0.88, 1.12, 7)
+    frameKeys = ('seatTube', 'seatStay', 'downTube', 'topTube', 'headTube', 'forkLength', 'chainStay', 'wheelBase')
+    sizes = [dict(bc, **{key: bc[key] * scale for key in frameKeys}) for scale in scales]
+    frames, valid = calcFrames(sizes)
+    fit = batch.evaluate(frames, np.linspace(0, 360, 360, endpoint=False))
+    print('Max knee angle (deg) by frame size and rider:')
+    print('%6s %5s ' % ('scale', 'built') + ' '.join('%8s' % name for name in batch.names))
+    for i, scale in enumerate(scales):
+        print('%6.2f %5s ' % (scale, valid[i]) + ' '.join('%8.1f' % value for value in fit['kneeMax'][i]))
@@ -0,0 +1,73 @@
+import numpy as np
+
+from kinematics import calcFrame, solveCycle
+from riderPose import RiderPose
+
+
+class PeriodicPoseCache:
+    """
+    Solves one crank revolution of a rider once, then serves any crank angle from it.
+
+    The kinematics are periodic in the crank angle, so angles are wrapped modulo 360 degrees and linearly
+    interpolated between the stored samples. The table uses the RiderPose buffer layout, so a pose is
+    interpolated straight into a RiderPose.
+    """
+    def __init__(self, bc, rc, samples=360, pose=None, frame=None, resultCache=None):
+        """
+        :param bc: The bike configuration dictionary.
+        :param rc: The rider configuration dictionary.
+        :param samples: The number of crank angles to solve per revolution.
+        :param pose: Optional RiderPose to interpolate into, such as the rider's own. A new one is used if None.
+        :param frame: The frame dictionary for bc, if already calculated, such as from Bike.getFrame.
+        :param resultCache: Optional resultCache.CycleCache to load the revolution from, or store it in.
+        """
+        self.samples = samples
+        self.step = 360.0 / samples
+        self.resultCache = resultCache
+
+        # Include 360 degrees so interpolating across the wrap needs no special case
+        crankAngles = np.linspace(0, 360, samples + 1)
+        if resultCache is not None:
+            self.cycle, _ = resultCache.calcRiderCycle(bc, rc, crankAngles, frame)
+        else:
+            if frame is None:
+                frame = calcFrame(bc)
+            self.cycle = solveCycle(frame, rc, crankAngles)
+
+        # Pack every field into one table, so a pose is interpolated in a single operation
+        columns = []
+        for name, shape in RiderPose.FIELDS:
+            values = np.broadcast_to(getattr(self.cycle, name), (samples + 1,) + shape)
+            columns.append(values.reshape(samples + 1, -1))
+        self.table = np.concatenate(columns, axis=1)
+
+        self.pose = RiderPose() if pose is None else pose
+        self.scratch = np.empty(RiderPose.SIZE)
+        self.crankAngleDeg = None
+
+    def calcPose(self, crankAngleDeg):
+        """
+        Interpolate the pose for a crank angle into the pose buffer.
+
+        :param crankAngleDeg: The crank angle in degrees, which may be outside 0 to 360.
+        :return: The RiderPose.
+        """
+        if crankAngleDeg != self.crankAngleDeg:
+            position = (crankAngleDeg % 360.0) / self.step
+            idx = min(int(position), self.samples - 1)
+            weight = position - idx
+            np.multiply(self.table[idx], 1.0 - weight, out=self.pose.buffer)
+            np.multiply(self.table[idx + 1], weight, out=self.scratch)
+            self.pose.buffer += self.scratch
+            self.crankAngleDeg = crankAngleDeg
+
+        return self.pose
+
+    def getField(self, name):
+        """
+        Get a field of the current pose.
+
+        :param name: A name from RiderPose.FIELDS.
+        :return: A view of the field in the pose buffer.
+        """
+        return getattr(self.pose, name)
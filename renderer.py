@@ -0,0 +1,165 @@
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+
+from kinematics import solveCycle
+
+
+# Seat and rider colors, used in turn
+RIDER_COLORS = (('royalblue', 'blueviolet'), ('lime', 'darkgreen'), ('purple', 'red'), ('cyan', 'lime'))
+
+
+def createFigure():
+    """
+    Create the figure used by main.py, with the bike on the left and the knee and hip angles on the right.
+
+    :return: The figure, bike axes, knee angle axes and hip angle axes.
+    """
+    fig = plt.figure(figsize=(13*1.5, 5*1.5))
+    ax1 = plt.subplot(121)
+    ax2 = plt.subplot(222)
+    ax3 = plt.subplot(224, sharex=ax2)
+    ax3.set_xlabel('Crank Angle (Deg)')
+    ax2.set_ylabel('Knee Angle (Deg)')
+    ax3.set_ylabel('Hip Angle (Deg)')
+    ax2.grid(axis='y', ls='--')
+    ax3.grid(axis='y', ls='--')
+    plt.tight_layout()
+    ax1.axis('equal')
+    ax1.set_xlim([-950, 1200])
+    ax1.set_ylim([-400, 1050])
+    ax1.axis('off')
+
+    return fig, ax1, ax2, ax3
+
+
+class BlitRenderer:
+    """
+    Animates the bike and riders by caching the static background once, then only redrawing the moving artists
+    each frame. The knee and hip curves are precomputed for a whole cycle, so the angle axes limits are fixed.
+    """
+    def __init__(self, fig, bike, riders, axKnee, axHip, fps=60.0, cycleSamples=361):
+        """
+        :param fig: The figure to draw on.
+        :param bike: The bike, which has had calcBikePositions and drawBikePositions called.
+        :param riders: A list of riders, which have had drawSeat called.
+        :param axKnee: The axes to draw the knee angles on.
+        :param axHip: The axes to draw the hip angles on.
+        :param fps: The maximum frame rate to draw at, or None or 0 to draw as fast as possible.
+        :param cycleSamples: The number of crank angles to precompute the angle curves with.
+        """
+        self.fig = fig
+        self.bike = bike
+        self.riders = riders
+        self.axKnee = axKnee
+        self.axHip = axHip
+        self.frameInterval = None if fps is None or fps <= 0 else 1.0 / fps
+        self.cycleSamples = cycleSamples
+
+        self.canvas = fig.canvas
+        self.background = None
+        self.movingArtists = []
+        self.nextFrameTime = None
+        self.drawCid = None
+
+    def setup(self, crankAngleDeg):
+        """
+        Draw the first frame, set the angle curves and axes limits, and cache the static background.
+
+        :param crankAngleDeg: The crank angle of the first frame.
+        """
+        crankAngles = np.linspace(0, 360, self.cycleSamples)
+        kneeRange = [np.inf, -np.inf]
+        hipRange = [np.inf, -np.inf]
+
+        # Create artists
+        self.bike.calcCrankLoc(theta=-crankAngleDeg)
+        self.bike.drawCrank()
+        for rider in self.riders:
+            rider.calcAndDrawAll(crankAngleDeg)
+            rider.drawAngleLines(self.axKnee, self.axHip)
+
+            # Draw the whole cycle as static curves
+            if rider.poseCache is None:
+                cycle = solveCycle(self.bike.getFrame(), rider.rc, crankAngles)
+            else:
+                cycle = rider.poseCache.cycle
+            rider.kneeAngleLine.set_data(cycle.crankAngle, cycle.kneeAngle)
+            rider.hipAngleLine.set_data(cycle.crankAngle, cycle.hipAngle)
+            kneeRange = [np.fmin(kneeRange[0], np.nanmin(cycle.kneeAngle)), np.fmax(kneeRange[1], np.nanmax(cycle.kneeAngle))]
+            hipRange = [np.fmin(hipRange[0], np.nanmin(cycle.hipAngle)), np.fmax(hipRange[1], np.nanmax(cycle.hipAngle))]
+
+        # Fix axes limits
+        self.axKnee.set_xlim([0, 360])
+        self.axKnee.set_ylim(self.padRange(kneeRange))
+        self.axHip.set_ylim(self.padRange(hipRange))
+
+        # Collect artists that move each frame
+        self.movingArtists = [self.bike.crankLine]
+        for rider in self.riders:
+            self.movingArtists += [rider.pedalLine1, rider.pedalLine2, rider.footLine1, rider.footLine2, rider.legLine1,
+                                   rider.currKneeAngleDot, rider.currHipAngleDot]
+        for artist in self.movingArtists:
+            artist.set_animated(True)
+
+        # Recapture the background whenever the whole figure is redrawn, such as on resizing
+        self.drawCid = self.canvas.mpl_connect('draw_event', self.onDraw)
+        self.canvas.draw()
+        self.canvas.flush_events()
+        self.nextFrameTime = time.perf_counter()
+
+    @staticmethod
+    def padRange(valueRange, padding=0.05):
+        """
+        Pad an axes range by a proportion of its size.
+
+        :param valueRange: The [min, max] of the values.
+        :param padding: The proportion to pad each end by.
+        :return: The padded [min, max].
+        """
+        size = max(valueRange[1] - valueRange[0], 1.0)
+        return [valueRange[0] - (padding * size), valueRange[1] + (padding * size)]
+
+    def onDraw(self, event):
+        """
+        Cache the static background after a full redraw, then draw the moving artists back over it.
+        """
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.drawMovingArtists()
+
+    def drawMovingArtists(self):
+        """
+        Draw only the moving artists over the cached background.
+        """
+        for artist in self.movingArtists:
+            artist.axes.draw_artist(artist)
+
+    def drawFrame(self, crankAngleDeg):
+        """
+        Calculate and draw a single frame.
+
+        :param crankAngleDeg: The crank angle to draw at.
+        """
+        # Update moving artists
+        self.bike.calcCrankLoc(theta=-crankAngleDeg)
+        self.bike.drawCrank()
+        for rider in self.riders:
+            rider.calcRiderLowerBody(crankAngleDeg)
+            rider.drawRiderLowerBody()
+            rider.currKneeAngleDot.set_data([rider.currCrankAngle], [rider.currKneeAngle])
+            rider.currHipAngleDot.set_data([rider.currCrankAngle], [rider.currHipAngle])
+
+        # Blit over the cached background
+        self.canvas.restore_region(self.background)
+        self.drawMovingArtists()
+        self.canvas.blit(self.fig.bbox)
+        self.canvas.flush_events()
+
+        # Hold the frame rate
+        if self.frameInterval is not None:
+            self.nextFrameTime += self.frameInterval
+            delay = self.nextFrameTime - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.nextFrameTime = time.perf_counter()
@@ -0,0 +1,287 @@
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import time
+import numpy as np
+
+from streaming import iterRiderConfigs
+
+
+REPORT_FORMATS = ('.png', '.pdf')
+
+# The extrema table rows, as (label, extrema stat)
+TABLE_ROWS = (('Knee min', 'kneeMin'), ('Knee max', 'kneeMax'), ('Hip min', 'hipMin'), ('Hip max', 'hipMax'))
+
+
+class ReportWriter:
+    """
+    Renders fit reports with the Agg backend: the rider on the bike, the knee and hip angle curves over a crank
+    revolution, and a table of the angle extrema and the crank angles they occur at.
+
+    The figure, bike and rider are created once, on the first report. Every later report only changes their
+    configurations and moves the existing artists, so no figure is built per report.
+    """
+    def __init__(self, outDir, extension='.png', crankAngleDeg=0.0, samples=360, dpi=None):
+        """
+        :param outDir: The directory to write the reports to.
+        :param extension: The report file type, from REPORT_FORMATS.
+        :param crankAngleDeg: The crank angle to draw the rider at.
+        :param samples: The number of crank angles per revolution to solve the curves at.
+        :param dpi: The resolution of PNG reports, defaults to the figure's own.
+        """
+        # Pyplot is only imported here, after the backend is chosen
+        import matplotlib
+        matplotlib.use('Agg', force=True)
+        import matplotlib.pyplot as plt
+        from renderer import RIDER_COLORS
+
+        self.outDir = outDir
+        self.extension = extension
+        self.crankAngleDeg = crankAngleDeg
+        self.samples = samples
+        self.seatColor, self.riderColor = RIDER_COLORS[0]
+
+        # Bike on the left, the angle curves and extrema table on the right
+        self.fig = plt.figure(figsize=(16, 9))
+        if dpi is not None:
+            self.fig.set_dpi(dpi)
+        grid = self.fig.add_gridspec(3, 2, width_ratios=(1.2, 1.0), height_ratios=(1.0, 1.0, 0.7))
+        self.axBike = self.fig.add_subplot(grid[:, 0])
+        self.axKnee = self.fig.add_subplot(grid[0, 1])
+        self.axHip = self.fig.add_subplot(grid[1, 1], sharex=self.axKnee)
+        axTable = self.fig.add_subplot(grid[2, 1])
+        self.axKnee.set_ylabel('Knee Angle (Deg)')
+        self.axHip.set_ylabel('Hip Angle (Deg)')
+        self.axHip.set_xlabel('Crank Angle (Deg)')
+        self.axKnee.grid(axis='y', ls='--')
+        self.axHip.grid(axis='y', ls='--')
+        self.axKnee.set_xlim([0, 360])
+        # Shrink the bike axes to fit an equal aspect, so the whole bike is shown whatever the page shape
+        self.axBike.set_xlim([-950, 1200])
+        self.axBike.set_ylim([-400, 1050])
+        self.axBike.set_aspect('equal', adjustable='box')
+        self.axBike.axis('off')
+        axTable.axis('off')
+
+        self.table = axTable.table(cellText=[['', '']] * len(TABLE_ROWS), rowLabels=[label for label, _ in TABLE_ROWS],
+                                   colLabels=['Angle (Deg)', 'Crank Angle (Deg)'], loc='upper center', cellLoc='center')
+        self.table.scale(1.0, 1.6)
+        self.titleText = self.fig.suptitle('')
+        self.statusText = self.fig.text(0.55, 0.03, '')
+        self.fig.tight_layout(rect=(0.0, 0.05, 1.0, 0.95))
+
+        self.bike = None
+        self.rider = None
+
+    def setup(self, bc, rc):
+        """
+        Create the bike and rider, and their artists.
+
+        :param bc: The bike configuration dictionary.
+        :param rc: The rider configuration dictionary.
+        """
+        from bike import Bike
+        from rider import Rider
+
+        bike = Bike(dict(bc), ax=self.axBike)
+        try:
+            bike.calcBikePositions()
+        except ValueError:
+            raise ValueError('The frame can\'t be built.')
+        self.bike = bike
+        self.rider = Rider(dict(rc), self.bike, seatColor=self.seatColor, riderColor=self.riderColor, ax=self.axBike)
+        self.rider.usePoseCache(self.samples)
+        self.rider.drawAngleLines(self.axKnee, self.axHip)
+
+    def drawReport(self, title, bc, rc):
+        """
+        Move the template's artists to a bike and rider.
+
+        :param title: The report title.
+        :param bc: The bike configuration dictionary.
+        :param rc: The rider configuration dictionary.
+        :return: The extrema dictionary, see extrema.findExtrema.
+        """
+        from extrema import findExtrema
+        from renderer import BlitRenderer
+
+        # Solve the bike and a revolution of the rider, reusing the existing ones after the first report
+        if self.bike is None:
+            self.setup(bc, rc)
+        else:
+            self.bike.setConfig({key: value for key, value in bc.items() if self.bike.bc.get(key) != value})
+            self.rider.setConfig(rc)
+        rider = self.rider
+
+        # Bike and rider at the drawn crank angle
+        self.bike.drawBikePositions()
+        self.bike.calcCrankLoc(theta=-self.crankAngleDeg)
+        self.bike.drawCrank()
+        rider.drawSeat()
+        rider.calcRiderHipPos()
+        rider.currCrankAngle = self.crankAngleDeg % 360
+        rider.setPoseFromCache(self.crankAngleDeg)
+        rider.drawRiderLowerBody()
+        rider.calcUpperBody()
+        rider.drawUpperBody()
+        del rider.crankAngle[:], rider.kneeAngle[:], rider.hipAngle[:]
+
+        # Angle curves
+        cycle = rider.poseCache.cycle
+        rider.kneeAngleLine.set_data(cycle.crankAngle, cycle.kneeAngle)
+        rider.hipAngleLine.set_data(cycle.crankAngle, cycle.hipAngle)
+        rider.currKneeAngleDot.set_data([rider.currCrankAngle], [rider.currKneeAngle])
+        rider.currHipAngleDot.set_data([rider.currCrankAngle], [rider.currHipAngle])
+        for ax, angles in ((self.axKnee, cycle.kneeAngle), (self.axHip, cycle.hipAngle)):
+            if np.any(np.isfinite(angles)):
+                ax.set_ylim(BlitRenderer.padRange([np.nanmin(angles), np.nanmax(angles)]))
+
+        # Extrema table, refined past the sampled curves
+        extrema = findExtrema(self.bike.getFrame(), rider.rc)
+        for row, (label, stat) in enumerate(TABLE_ROWS):
+            for col, value in enumerate((extrema[stat], extrema[stat + 'CrankAngle'])):
+                self.table[row + 1, col].get_text().set_text('-' if np.isnan(value) else '%.1f' % value)
+
+        self.titleText.set_text(title)
+        unreachable = 1.0 - np.mean(cycle.reachable)
+        if unreachable > 0.0:
+            self.statusText.set_text('The legs can\'t reach the pedals over %.0f%% of the crank revolution.' % (100.0 * unreachable))
+        else:
+            self.statusText.set_text('')
+
+        return extrema
+
+    def writeReport(self, name, bc, rc):
+        """
+        Draw a report and save it.
+
+        :param name: The report name, used for its title and file name.
+        :param bc: The bike configuration dictionary.
+        :param rc: The rider configuration dictionary.
+        :return: The report's file path.
+        """
+        from PIL import Image
+
+        self.drawReport(name, bc, rc)
+        path = os.path.join(self.outDir, re.sub(r'[^\w.-]', '_', name) + self.extension)
+        if self.extension == '.png':
+            # Draw once and save the canvas with fast compression, as savefig would draw again
+            canvas = self.fig.canvas
+            canvas.draw()
+            image = Image.frombuffer('RGBA', canvas.get_width_height(), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+            image.convert('RGB').save(path, compress_level=1)
+        else:
+            self.fig.savefig(path)
+
+        return path
+
+    def close(self):
+        import matplotlib.pyplot as plt
+
+        plt.close(self.fig)
+
+
+# The report writer of this worker process
+workerWriter = None
+
+
+def initWorker(outDir, extension, crankAngleDeg, samples, dpi):
+    """
+    Set up a worker process's report template once, so only the configurations need to be sent per report.
+    """
+    global workerWriter
+    workerWriter = ReportWriter(outDir, extension, crankAngleDeg, samples, dpi)
+
+
+def writeReport(job):
+    """
+    Write a report in a worker.
+
+    :param job: The (name, bike config, rider config) tuple.
+    :return: The name, the report's file path, and None, or the name, None and the error message if the frame
+             can't be built.
+    """
+    name, bc, rc = job
+    try:
+        return name, workerWriter.writeReport(name, bc, rc), None
+    except ValueError as e:
+        return name, None, str(e)
+
+
+def generateReports(pairs, outDir, extension='.png', processes=None, crankAngleDeg=0.0, samples=360, dpi=None,
+                    chunkSize=1, progress=None):
+    """
+    Write a fit report for every bike and rider pair, across a process pool.
+
+    Each worker keeps one report template, solves its pairs headlessly and draws them with the Agg backend, so
+    reports are independent and scale with the number of processes.
+
+    :param pairs: An iterable of (name, bike config, rider config) tuples.
+    :param outDir: The directory to write the reports to, created if it doesn't exist.
+    :param extension: The report file type, from REPORT_FORMATS.
+    :param processes: The number of worker processes, defaults to the CPU count.
+    :param crankAngleDeg: The crank angle to draw the riders at.
+    :param samples: The number of crank angles per revolution to solve the curves at.
+    :param dpi: The resolution of PNG reports, defaults to the figure's own.
+    :param chunkSize: The number of reports sent to a worker per task.
+    :param progress: Optional callable, called with (name, path, error) as each report completes.
+    :return: A list of (name, path, error) tuples, in the order the reports completed. The path is None and error
+             holds the message for pairs whose frame can't be built.
+    """
+    if extension not in REPORT_FORMATS:
+        raise ValueError('Unknown report format %s, must be one of %s.' % (extension, ', '.join(REPORT_FORMATS)))
+    os.makedirs(outDir, exist_ok=True)
+
+    results = []
+    initArgs = (outDir, extension, crankAngleDeg, samples, dpi)
+    with multiprocessing.Pool(processes or os.cpu_count(), initializer=initWorker, initargs=initArgs) as pool:
+        for result in pool.imap_unordered(writeReport, pairs, chunkSize):
+            results.append(result)
+            if progress is not None:
+                progress(*result)
+
+    return results
+
+
+def iterPairs(bc, ridersPath):
+    """
+    Read bike and rider pairs from a rider file, see streaming.iterRiderConfigs. A rider may hold a "bike" key of
+    bike configuration values, which replace those of the default bike for that rider only.
+
+    :param bc: The default bike configuration dictionary.
+    :param ridersPath: The path to the rider file.
+    :return: A generator of (name, bike config, rider config) tuples.
+    """
+    for name, rc in iterRiderConfigs(ridersPath):
+        pairBc = dict(bc)
+        pairBc.update(rc.pop('bike', {}))
+        yield name, pairBc, rc
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a PNG or PDF fit report for every rider on the bike.')
+    parser.add_argument('out', help='The directory to write the reports to.')
+    parser.add_argument('--bike', default='bike.json', help='The bike configuration file.')
+    parser.add_argument('--riders', default='rider.json', help='The rider file, as JSON or JSON Lines. Riders may '
+                                                               'override bike values with a "bike" key.')
+    parser.add_argument('--format', choices=[extension[1:] for extension in REPORT_FORMATS], default='png', help='The report file type.')
+    parser.add_argument('--crank-angle', type=float, default=0.0, help='The crank angle to draw the riders at.')
+    parser.add_argument('--dpi', type=float, default=None, help='The resolution of PNG reports, defaults to the figure\'s own.')
+    parser.add_argument('--processes', type=int, default=None, help='The number of worker processes, defaults to the CPU count.')
+    args = parser.parse_args()
+
+    with open(args.bike) as f:
+        bc = json.load(f)
+
+    startTime = time.perf_counter()
+    results = generateReports(iterPairs(bc, args.riders), args.out, extension='.' + args.format, processes=args.processes,
+                              crankAngleDeg=args.crank_angle, dpi=args.dpi)
+    elapsed = time.perf_counter() - startTime
+    for name, path, error in results:
+        if error is not None:
+            print('%s: %s' % (name, error))
+    print('Wrote %d reports to %s in %.2f s, %.1f reports/s' % (
+        sum(error is None for _, _, error in results), args.out, elapsed, len(results) / elapsed))
@@ -0,0 +1,298 @@
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+import numpy as np
+
+from kinematics import RiderCycle, calcFrame, solveCycle
+
+
+# Bump when the layout of cached files changes
+CACHE_FORMAT_VERSION = 1
+
+# The modules the cycle results depend on. Any change to their source gives a new model version.
+MODEL_FILES = ('bike.py', 'fourBarLink.py', 'kinematics.py')
+
+# The arrays stored for every cycle
+CYCLE_FIELDS = tuple(RiderCycle().__dict__.keys())
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Temporary files older than this many seconds are left over from writers that died, and are removed when evicting
+STALE_TEMP_SECONDS = 3600.0
+
+
+def calcModelVersion(files=MODEL_FILES):
+    """
+    Hash the source of the modules the cycle results depend on.
+
+    :param files: The module file names, relative to this file's directory.
+    :return: The hex digest.
+    """
+    digest = hashlib.sha256(b'%d' % CACHE_FORMAT_VERSION)
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in files:
+        with open(os.path.join(directory, name), 'rb') as f:
+            digest.update(name.encode('utf-8'))
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+MODEL_VERSION = calcModelVersion()
+
+
+def canonicalConfig(config):
+    """
+    Convert the numbers in a configuration dictionary to floats, so 170 and 170.0 give the same key.
+    """
+    return {key: float(value) if isinstance(value, (int, float)) else value for key, value in config.items()}
+
+
+def calcCacheKey(bc, rc, crankAngleDeg, modelVersion=MODEL_VERSION):
+    """
+    Calculate the content address of a cycle result.
+
+    :param bc: The bike configuration dictionary.
+    :param rc: The rider configuration dictionary.
+    :param crankAngleDeg: A 1D array of crank angles in degrees.
+    :param modelVersion: The model version, see calcModelVersion.
+    :return: The hex SHA-256 digest of the canonical JSON of every input.
+    """
+    spec = {'bike': canonicalConfig(bc),
+            'rider': canonicalConfig(rc),
+            'crankAngles': np.asarray(crankAngleDeg, dtype=float).tolist(),
+            'model': modelVersion}
+
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+class CycleCache:
+    """
+    A persistent cache of cycle results on disk, addressed by the hash of the bike and rider configurations, the
+    crank angles and the model version.
+
+    Each result is one file holding a JSON header line then the raw bytes of the RiderCycle arrays and their
+    extrema, in a subdirectory named by the first two characters of its key, so loading is a single read. Files
+    are written to a temporary file and renamed into place, so readers in other processes only ever see complete
+    results. Reading a result updates its modification time, and the
+    least recently used results are removed once the cache grows past its size cap.
+    """
+    def __init__(self, path, maxBytes=DEFAULT_MAX_BYTES, modelVersion=MODEL_VERSION):
+        """
+        :param path: The cache directory, created if it doesn't exist.
+        :param maxBytes: The size cap of the cache.
+        :param modelVersion: The model version results are stored against, see calcModelVersion.
+        """
+        self.path = path
+        self.maxBytes = maxBytes
+        self.modelVersion = modelVersion
+        self.hits = 0
+        self.misses = 0
+
+        # Only scan the cache size once this process has written a fraction of the cap since the last scan
+        self.evictBytes = max(1, maxBytes // 20)
+        self.unscannedBytes = self.evictBytes
+
+        os.makedirs(path, exist_ok=True)
+
+    def getPath(self, key):
+        """
+        :return: The file path of a result.
+        """
+        return os.path.join(self.path, key[:2], key + '.cycle')
+
+    def load(self, key):
+        """
+        Load a result.
+
+        :param key: The result key, see calcCacheKey.
+        :return: The RiderCycle and its extrema dictionary, or None if the result isn't cached. The arrays are
+                 read only views of the file contents.
+        """
+        path = self.getPath(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            headerEnd = data.index(b'\n')
+            header = json.loads(data[:headerEnd])
+            arrays = {}
+            for name, dtype, shape, offset in header['arrays']:
+                count = int(np.prod(shape))
+                arrays[name] = np.frombuffer(data, dtype=dtype, count=count, offset=headerEnd + 1 + offset).reshape(shape)
+        except (OSError, ValueError, KeyError):
+            # Missing, evicted by another process, or unreadable
+            return None
+
+        cycle = RiderCycle()
+        for name in CYCLE_FIELDS:
+            setattr(cycle, name, arrays[name])
+        extrema = {name[len('extrema.'):]: value for name, value in arrays.items() if name.startswith('extrema.')}
+
+        # Mark the result as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return cycle, extrema
+
+    def store(self, key, cycle, extrema):
+        """
+        Store a result, replacing any with the same key.
+
+        :param key: The result key, see calcCacheKey.
+        :param cycle: The RiderCycle.
+        :param extrema: The extrema dictionary, see RiderCycle.calcExtrema.
+        """
+        path = self.getPath(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {name: getattr(cycle, name) for name in CYCLE_FIELDS}
+        arrays.update({'extrema.' + name: value for name, value in extrema.items()})
+
+        # Lay out the arrays one after another after the header
+        header = {'arrays': []}
+        blocks = []
+        offset = 0
+        for name, value in arrays.items():
+            value = np.ascontiguousarray(value)
+            header['arrays'].append([name, value.dtype.str, list(value.shape), offset])
+            blocks.append(value.tobytes())
+            offset += value.nbytes
+
+        headerBytes = json.dumps(header).encode('utf-8') + b'\n'
+        fd, tempPath = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(headerBytes)
+                for block in blocks:
+                    f.write(block)
+            os.replace(tempPath, path)
+        except BaseException:
+            os.unlink(tempPath)
+            raise
+
+        # Count the bytes written, as another process may already have evicted the file
+        self.unscannedBytes += len(headerBytes) + offset
+        if self.unscannedBytes >= self.evictBytes:
+            self.evict()
+
+    def calcRiderCycle(self, bc, rc, crankAngleDeg, frame=None):
+        """
+        Get a rider's cycle from the cache, solving and storing it if it isn't cached.
+
+        :param bc: The bike configuration dictionary.
+        :param rc: The rider configuration dictionary.
+        :param crankAngleDeg: A 1D array of crank angles in degrees.
+        :param frame: The frame dictionary for bc, if already calculated.
+        :return: The RiderCycle and its extrema dictionary, see RiderCycle.calcExtrema.
+        """
+        key = calcCacheKey(bc, rc, crankAngleDeg, self.modelVersion)
+        result = self.load(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        cycle = solveCycle(calcFrame(bc) if frame is None else frame, rc, crankAngleDeg)
+        extrema = cycle.calcExtrema()
+        self.store(key, cycle, extrema)
+
+        return cycle, extrema
+
+    def listFiles(self):
+        """
+        List the cached results and temporary files.
+
+        :return: A list of (path, size, modification time) tuples.
+        """
+        files = []
+        with os.scandir(self.path) as shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                try:
+                    with os.scandir(shard.path) as entries:
+                        for entry in entries:
+                            try:
+                                stat = entry.stat()
+                            except FileNotFoundError:
+                                continue
+                            files.append((entry.path, stat.st_size, stat.st_mtime))
+                except FileNotFoundError:
+                    continue
+
+        return files
+
+    def evict(self):
+        """
+        Remove the least recently used results until the cache is under its size cap, and any stale temporary
+        files. Other processes may be evicting at the same time, so files that have already gone are skipped.
+
+        :return: The number of bytes in the cache afterwards.
+        """
+        files = self.listFiles()
+        now = time.time()
+        results = []
+        totalBytes = 0
+        for path, size, mtime in files:
+            if path.endswith('.tmp'):
+                if now - mtime > STALE_TEMP_SECONDS:
+                    self.removeFile(path)
+                continue
+            results.append((mtime, size, path))
+            totalBytes += size
+
+        results.sort()
+        for mtime, size, path in results:
+            if totalBytes <= self.maxBytes:
+                break
+            self.removeFile(path)
+            totalBytes -= size
+
+        self.unscannedBytes = 0
+        return totalBytes
+
+    @staticmethod
+    def removeFile(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """
+        Remove every cached result.
+        """
+        for path, size, mtime in self.listFiles():
+            self.removeFile(path)
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve the example riders through the cycle result cache.')
+    parser.add_argument('--bike', default='bike.json', help='The bike configuration file.')
+    parser.add_argument('--riders', default='rider.json', help='The rider configuration file.')
+    parser.add_argument('--cache', default='.cycleCache', help='The cache directory.')
+    parser.add_argument('--samples', type=int, default=360, help='The number of crank angles per revolution.')
+    parser.add_argument('--clear', action='store_true', help='Clear the cache first.')
+    args = parser.parse_args()
+
+    with open(args.bike) as f:
+        bc = json.load(f)
+    with open(args.riders) as f:
+        rcs = json.load(f)
+
+    cache = CycleCache(args.cache)
+    if args.clear:
+        cache.clear()
+    crankAngles = np.linspace(0, 360, args.samples, endpoint=False)
+    for run in ('First', 'Second'):
+        startTime = time.perf_counter()
+        for name, rc in rcs.items():
+            cycle, extrema = cache.calcRiderCycle(bc, rc, crankAngles)
+        print('%s run: %d riders in %.2f ms, %d hits, %d misses' % (
+            run, len(rcs), 1e3 * (time.perf_counter() - startTime), cache.hits, cache.misses))
+    print('Model version %s, %d bytes cached' % (MODEL_VERSION[:12], cache.evict()))
@@ -2,6 +2,8 @@ import math
 import numpy as np
 
 from fourBarLink import FourBarLink
+from poseCache import PeriodicPoseCache
+from riderPose import RiderPose
 
 
 
@@ -16,7 +18,7 @@ class Rider:
         :param seatColor: The named color to use for drawing the seat.
         :param riderColor: The named color to use for drawing the rider.
         :param Alpha: The alpha transparency value for the rider, from 0 to 1.
-        :param ax: The axes object to plot on.
+        :param ax: The axes object to plot on, or None to use the bike's axes.
         """
         self.rc = rc
         self.bike = bike
@@ -29,43 +31,26 @@ class Rider:
         self.seatExtY = None
         self.seatPosX = None
         self.seatPosY = None
+        self.seatPostLine = None
+        self.seatLine = None
 
         self.hipX = None
         self.hipY = None
 
-        self.ped1x1 = None
-        self.ped1y1 = None
-        self.ped1x2 = None
-        self.ped1y2 = None
-        self.ped2x1 = None
-        self.ped2y1 = None
-        self.ped2x2 = None
-        self.ped2y2 = None
-
-        self.anklePos1 = None
-        self.endOfFoot1 = None
-        self.anklePos2 = None
-        self.endOfFoot2 = None
+        # Pedal, foot and leg positions and joint angles, written in place every frame
+        self.pose = RiderPose()
 
         self.pedalLine1 = None
         self.pedalLine2 = None
         self.footLine1 = None
         self.footLine2 = None
         self.footAngleRad1 = None
-        self.footAngleRad1 = None
+        self.footAngleRad2 = None
 
         self.fourBarLegs = None
         self.fourBarUpper = None
-
-        self.ankle1 = None
-        self.knee1 = None
-
-        self.O2s = None
-        self.O4s = None
-        self.O2n = None
-        self.Ann = None
-        self.Bnn = None
-        self.O4n = None
+        self.upperBodyInputs = None
+        self.upperBodyDirty = True
 
         self.legLine1 = None
         self.legLine2 = None
@@ -86,8 +71,21 @@ class Rider:
 
         self.printedMinMaxes = False
 
+        self.poseCache = None
+
         self.calcSeatExtensionPos()
 
+    def getAxes(self):
+        """
+        Get the axes to draw on, using the bike's axes if none were given. Pyplot is only imported when drawing.
+
+        :return: The axes object.
+        """
+        if self.ax is None:
+            self.ax = self.bike.getAxes()
+
+        return self.ax
+
     def calcSeatExtensionPos(self):
         """
         Calculate the position for the seat post and seat.
@@ -102,59 +100,102 @@ class Rider:
         """
         Draw the seat and seat post.
         """
+        if self.seatPostLine is None:
+            self.seatPostLine, = self.getAxes().plot([], [], c=self.seatColor)
+        if self.seatLine is None:
+            self.seatLine, = self.getAxes().plot([], [], c=self.seatColor)
+
         # Plot Seat post
-        self.ax.plot([self.bike.xst, self.seatPosX], [self.bike.yst, self.seatPosY], c=self.seatColor)
+        self.seatPostLine.set_data([self.bike.xst, self.seatPosX], [self.bike.yst, self.seatPosY])
 
         # Plot Seat (Assumes flat seat)
-        self.ax.plot([self.seatPosX - self.rc['seatLengthAft'], self.seatPosX + self.rc['seatLengthFwd']], [self.seatPosY, self.seatPosY], c=self.seatColor)
+        self.seatLine.set_data([self.seatPosX - self.rc['seatLengthAft'], self.seatPosX + self.rc['seatLengthFwd']], [self.seatPosY, self.seatPosY])
+
+    def setConfig(self, changes):
+        """
+        Change rider configuration values, or update the rider after the bike configuration changed. The seat is
+        placed again, the stored angle history is cleared, and a pose cache is solved again with the same number
+        of samples, reusing the bike's frame.
+
+        :param changes: A dictionary of rider configuration keys to their new values, which may be empty.
+        """
+        self.rc = dict(self.rc)
+        self.rc.update(changes)
+        self.calcSeatExtensionPos()
+
+        # Angles stored for another configuration
+        del self.crankAngle[:], self.kneeAngle[:], self.hipAngle[:]
+        self.printedMinMaxes = False
+
+        if self.poseCache is not None:
+            self.usePoseCache(self.poseCache.samples, self.poseCache.resultCache)
 
     def calculatePedalAndFoot(self, crankAngleDeg):
         """
         Calculate the positions of the pedals and feet.
+        These only depend on the crank and the rider's pedal and foot sizes, so are shared through the bike's crank
+        context with any other rider with the same sizes, and only calculated once per crank angle.
 
         :param crankAngleDeg: The angle of the main crank.
         """
-        # Calculate foot angle using experimental relationship
-        # footAngleDeg = 22*math.sin(math.radians(crankAngleDeg + 190)) + 20.76
-        footAngleDeg1 = 22 * math.sin(math.radians(-(crankAngleDeg) + 190 + 90)) + 20.76
-        self.footAngleRad1 = math.radians(footAngleDeg1)
-        footAngleDeg2 = 22 * math.sin(math.radians(-(crankAngleDeg + 180) + 190 + 90)) + 20.76
-        self.footAngleRad2 = math.radians(footAngleDeg2)
+        context = self.bike.getCrankContext(crankAngleDeg)
+        self.footAngleRad1 = context.footAngleRad1
+        self.footAngleRad2 = context.footAngleRad2
+
+        feetKey = ('feet', self.rc['pedalLength'], self.rc['footLength'], self.rc['footContactProportion'])
+        feet, solved = context.getShared(feetKey, RiderPose.FEET.stop - RiderPose.FEET.start)
+        if not solved:
+            self.calcFeet(context, feet)
+
+        # Copy into the pose
+        self.pose.buffer[RiderPose.FEET] = feet
+
+    def calcFeet(self, context, feet):
+        """
+        Calculate the positions of the pedals and feet into a shared array.
+
+        :param context: The bike's CrankContext.
+        :param feet: The array to write to, in RiderPose.FEET_FIELDS order.
+        """
+        c1x, c1y, c2x, c2y = context.crankLoc
 
         # Calculate pedal locations
-        # Pedal 1
-        self.ped1x1 = self.bike.c1x - ((self.rc['pedalLength'] / 2.0) * math.cos(self.footAngleRad1))
-        self.ped1x2 = self.bike.c1x + ((self.rc['pedalLength'] / 2.0) * math.cos(self.footAngleRad1))
-        self.ped1y1 = self.bike.c1y + ((self.rc['pedalLength'] / 2.0) * math.sin(self.footAngleRad1))
-        self.ped1y2 = self.bike.c1y - ((self.rc['pedalLength'] / 2.0) * math.sin(self.footAngleRad1))
-        # Pedal 2
-        self.ped2x1 = self.bike.c2x - ((self.rc['pedalLength'] / 2.0) * math.cos(self.footAngleRad2 + math.pi))
-        self.ped2x2 = self.bike.c2x + ((self.rc['pedalLength'] / 2.0) * math.cos(self.footAngleRad2 + math.pi))
-        self.ped2y1 = self.bike.c2y + ((self.rc['pedalLength'] / 2.0) * math.sin(self.footAngleRad2 + math.pi))
-        self.ped2y2 = self.bike.c2y - ((self.rc['pedalLength'] / 2.0) * math.sin(self.footAngleRad2 + math.pi))
+        halfPedalLength = self.rc['pedalLength'] / 2.0
+        pedal1DX = halfPedalLength * math.cos(self.footAngleRad1)
+        pedal1DY = halfPedalLength * math.sin(self.footAngleRad1)
+        pedal2DX = halfPedalLength * math.cos(self.footAngleRad2 + math.pi)
+        pedal2DY = halfPedalLength * math.sin(self.footAngleRad2 + math.pi)
 
         # Calculate ankle positions
-        # Ankle 1
         footLeverLength = self.rc['footContactProportion'] * self.rc['footLength']
-        anklePosX = self.bike.c1x - (footLeverLength * math.cos(self.footAngleRad1))
-        anklePosY = self.bike.c1y + (footLeverLength * math.sin(self.footAngleRad1))
-        self.anklePos1 = [anklePosX, anklePosY]
-        endOfFootX = self.anklePos1[0] + (self.rc['footLength'] * math.cos(self.footAngleRad1))
-        endOfFootY = self.anklePos1[1] - (self.rc['footLength'] * math.sin(self.footAngleRad1))
-        self.endOfFoot1 = [endOfFootX, endOfFootY]
-        # Ankle 2
-        footLeverLength = self.rc['footContactProportion'] * self.rc['footLength']
-        anklePosX = self.bike.c2x - (footLeverLength * math.cos(self.footAngleRad2))
-        anklePosY = self.bike.c2y + (footLeverLength * math.sin(self.footAngleRad2))
-        self.anklePos2 = [anklePosX, anklePosY]
-        endOfFootX = self.anklePos2[0] + (self.rc['footLength'] * math.cos(self.footAngleRad2))
-        endOfFootY = self.anklePos2[1] - (self.rc['footLength'] * math.sin(self.footAngleRad2))
-        self.endOfFoot2 = [endOfFootX, endOfFootY]
+        ankle1X = c1x - (footLeverLength * math.cos(self.footAngleRad1))
+        ankle1Y = c1y + (footLeverLength * math.sin(self.footAngleRad1))
+        ankle2X = c2x - (footLeverLength * math.cos(self.footAngleRad2))
+        ankle2Y = c2y + (footLeverLength * math.sin(self.footAngleRad2))
+
+        feet[:] = (
+            self.footAngleRad1, self.footAngleRad2,
+            # Pedal 1
+            c1x - pedal1DX, c1y + pedal1DY, c1x + pedal1DX, c1y - pedal1DY,
+            # Pedal 2
+            c2x - pedal2DX, c2y + pedal2DY, c2x + pedal2DX, c2y - pedal2DY,
+            # Ankle and toe 2
+            ankle2X, ankle2Y,
+            ankle2X + (self.rc['footLength'] * math.cos(self.footAngleRad2)),
+            ankle2Y - (self.rc['footLength'] * math.sin(self.footAngleRad2)),
+            # Toe, foot-pedal contact point and ankle 1
+            ankle1X + (self.rc['footLength'] * math.cos(self.footAngleRad1)),
+            ankle1Y - (self.rc['footLength'] * math.sin(self.footAngleRad1)),
+            c1x, c1y,
+            ankle1X, ankle1Y)
 
     def calcKneeAngle(self):
         """
-        Calculate the knee angle in degrees.
+        Calculate the knee angle in degrees. This is NaN when the legs can't reach.
         """
+        if not self.fourBarLegs.fourBar.reachable:
+            return math.nan
+
         # Find the distance from A to O4
         AO4Len = math.sqrt((self.fourBarLegs.Ann[0] - self.fourBarLegs.O4n[0])**2 + (self.fourBarLegs.Ann[1] - self.fourBarLegs.O4n[1])**2)
         # Using the cosine rule
@@ -164,8 +205,11 @@ class Rider:
 
     def calcHipAngle(self):
         """
-        Calculate the hip angle in degrees.
+        Calculate the hip angle in degrees. This is NaN when the legs can't reach.
         """
+        if not self.fourBarLegs.fourBar.reachable:
+            return math.nan
+
         # Find the distance from A to O4
         AO4Len = math.sqrt((self.fourBarLegs.Ann[0] - self.fourBarLegs.O4n[0]) ** 2 + (
                     self.fourBarLegs.Ann[1] - self.fourBarLegs.O4n[1]) ** 2)
@@ -175,11 +219,57 @@ class Rider:
 
         return hipAngle
 
+    def usePoseCache(self, samples=360, resultCache=None):
+        """
+        Solve one crank revolution now, and serve all later crank angles from it instead of solving each frame.
+        The bike's frame positions are reused, so only the rider is solved.
+
+        :param samples: The number of crank angles to solve per revolution.
+        :param resultCache: Optional resultCache.CycleCache, so the revolution is only solved once across runs.
+        """
+        self.poseCache = PeriodicPoseCache(self.bike.bc, self.rc, samples, pose=self.pose, frame=self.bike.getFrame(),
+                                           resultCache=resultCache)
+
+    def setPoseFromCache(self, crankAngleDeg):
+        """
+        Set the pedal, foot and leg positions and the joint angles from the pose cache.
+        The cache interpolates straight into the rider's pose.
+
+        :param crankAngleDeg: The angle of the main crank.
+        """
+        self.poseCache.calcPose(crankAngleDeg)
+        self.footAngleRad1 = float(self.pose.footAngle1)
+        self.footAngleRad2 = float(self.pose.footAngle2)
+        self.currKneeAngle = float(self.pose.kneeAngle)
+        self.currHipAngle = float(self.pose.hipAngle)
+
     def calcRiderLowerBody(self, crankAngleDeg):
         """
         Calculate all points of the rider.
         """
         self.calcRiderHipPos()
+        self.currCrankAngle = crankAngleDeg % 360
+        if self.poseCache is None:
+            self.solveRiderLowerBody(crankAngleDeg)
+        else:
+            self.setPoseFromCache(crankAngleDeg)
+
+        # Store values
+        if crankAngleDeg < 360.1 and crankAngleDeg > -1:
+            # Store values
+            self.crankAngle.append(crankAngleDeg)
+            self.kneeAngle.append(abs(self.currKneeAngle))
+            self.hipAngle.append(abs(self.currHipAngle))
+        elif not self.printedMinMaxes and len(self.crankAngle) > 0:
+            print('%20s. Knee Min: %.2f deg, Knee Max: %.2f deg, Hip Min: %.2f deg, Hip Max: %.2f deg' % (self.riderColor, np.nanmin(self.kneeAngle), np.nanmax(self.kneeAngle), np.nanmin(self.hipAngle), np.nanmax(self.hipAngle)))
+            self.printedMinMaxes = True
+
+    def solveRiderLowerBody(self, crankAngleDeg):
+        """
+        Solve the pedal, foot and leg positions, and the knee and hip angles.
+
+        :param crankAngleDeg: The angle of the main crank.
+        """
         self.calculatePedalAndFoot(crankAngleDeg)
 
         # Setup four bar
@@ -187,8 +277,8 @@ class Rider:
         # A is the ankle joint
         # B is the knee joint
         # O4 is the hip joint
-        O2 = np.array([self.bike.c1x, self.bike.c1y])
-        O4 = np.array([self.hipX, self.hipY])
+        O2 = self.pose.pedal1
+        O4 = self.pose.hip
         O2ALen = self.rc['footContactProportion']*self.rc['footLength']
         ABLen = self.rc['knee2AnkleLength']
         BO4Len = self.rc['hip2KneeLength']
@@ -198,22 +288,16 @@ class Rider:
         if self.fourBarLegs is None:
             self.fourBarLegs = FourBarLink(O2, O4, O2ALen, ABLen, BO4Len, adjustedFootAngle)
         else:
+            self.fourBarLegs.setLinkLengths(O2ALen, ABLen, BO4Len)
             self.fourBarLegs.setO2O4Pt(O2, O4, adjustedFootAngle)
 
+        self.pose.knee[:] = self.fourBarLegs.Bnn
+
         # Calculate Knee angle
-        self.currCrankAngle = crankAngleDeg % 360
         self.currKneeAngle = abs(self.calcKneeAngle())
         self.currHipAngle = abs(self.calcHipAngle())
-
-        # Store values
-        if crankAngleDeg < 360.1 and crankAngleDeg > -1:
-            # Store values
-            self.crankAngle.append(crankAngleDeg)
-            self.kneeAngle.append(abs(self.currKneeAngle))
-            self.hipAngle.append(abs(self.currHipAngle))
-        elif not self.printedMinMaxes and len(self.crankAngle) > 0:
-            print('%20s. Knee Min: %.2f deg, Knee Max: %.2f deg, Hip Min: %.2f deg, Hip Max: %.2f deg' % (self.riderColor, min(self.kneeAngle), max(self.kneeAngle), min(self.hipAngle), max(self.hipAngle)))
-            self.printedMinMaxes = True
+        self.pose.kneeAngle[...] = self.currKneeAngle
+        self.pose.hipAngle[...] = self.currHipAngle
 
 
     def drawAngleLines(self, axKnee, axHip):
@@ -244,21 +328,21 @@ class Rider:
         Draw the stationary top half of the rider.
         """
         if self.pedalLine1 is None:
-            self.pedalLine1, = self.ax.plot([], [], c=self.riderColor)
+            self.pedalLine1, = self.getAxes().plot([], [], c=self.riderColor)
         if self.pedalLine2 is None:
-            self.pedalLine2, = self.ax.plot([], [], c=self.riderColor)
+            self.pedalLine2, = self.getAxes().plot([], [], c=self.riderColor)
         if self.footLine1 is None:
-            self.footLine1, = self.ax.plot([], [], c=self.riderColor)
+            self.footLine1, = self.getAxes().plot([], [], c=self.riderColor)
         if self.footLine2 is None:
-            self.footLine2, = self.ax.plot([], [], c=self.riderColor)
+            self.footLine2, = self.getAxes().plot([], [], c=self.riderColor)
 
-        # Draw foot
-        self.footLine1.set_data([self.anklePos1[0], self.endOfFoot1[0]], [self.anklePos1[1], self.endOfFoot1[1]])
-        #self.footLine2.set_data([self.anklePos2[0], self.endOfFoot2[0]], [self.anklePos2[1], self.endOfFoot2[1]])
+        # Draw foot, from the toe through the pedal to the ankle
+        self.footLine1.set_data(self.pose.foot1[:, 0], self.pose.foot1[:, 1])
+        #self.footLine2.set_data([self.pose.ankle2[0], self.pose.toe2[0]], [self.pose.ankle2[1], self.pose.toe2[1]])
 
         # Draw Pedal
-        self.pedalLine1.set_data([self.ped1x1, self.ped1x2], [self.ped1y1, self.ped1y2])
-        self.pedalLine2.set_data([self.ped2x1, self.ped2x2], [self.ped2y1, self.ped2y2])
+        self.pedalLine1.set_data(self.pose.pedal1Ends[:, 0], self.pose.pedal1Ends[:, 1])
+        self.pedalLine2.set_data(self.pose.pedal2Ends[:, 0], self.pose.pedal2Ends[:, 1])
 
 
 
@@ -268,18 +352,19 @@ class Rider:
         """
         self.hipX = self.seatPosX + self.rc['seatRiderOffsetX']
         self.hipY = self.seatPosY + self.rc['seatRiderOffsetY']
+        self.pose.hip[0] = self.hipX
+        self.pose.hip[1] = self.hipY
 
 
     def drawRiderLegs(self):
         """
-        Draw the riders legs using positions from the 4-bar link.
+        Draw the riders legs using positions from the 4-bar link or pose cache.
         """
         if self.legLine1 is None:
-            self.legLine1, = self.ax.plot([], [], c=self.riderColor)
+            self.legLine1, = self.getAxes().plot([], [], c=self.riderColor)
 
 
-        self.legLine1.set_data([self.fourBarLegs.O2n[0], self.fourBarLegs.Ann[0], self.fourBarLegs.Bnn[0], self.fourBarLegs.O4n[0]],
-                               [self.fourBarLegs.O2n[1], self.fourBarLegs.Ann[1], self.fourBarLegs.Bnn[1], self.fourBarLegs.O4n[1]])
+        self.legLine1.set_data(self.pose.leg[:, 0], self.pose.leg[:, 1])
 
 
     def drawRiderLowerBody(self):
@@ -294,6 +379,14 @@ class Rider:
         """
         Calculate the positions of the rider upper body using a Four Bar Link.
         """
+        # The upper body doesn't move during a cycle, so only solve it again when its inputs change
+        upperBodyInputs = (self.hipX, self.hipY, self.bike.handsPosX, self.bike.handsPosY, self.rc['hip2ShoulderLength'],
+                           self.rc['shoulder2ElbowLength'], self.rc['elbow2WristContactLength'], self.rc['hip2HorizontalAngleDeg'])
+        if upperBodyInputs == self.upperBodyInputs:
+            return
+        self.upperBodyInputs = upperBodyInputs
+        self.upperBodyDirty = True
+
         # Setup four bar
         # O2 is the hip joint
         # A is the shoulder joint
@@ -310,6 +403,7 @@ class Rider:
         if self.fourBarUpper is None:
             self.fourBarUpper = FourBarLink(O2, O4, O2ALen, ABLen, BO4Len, adjustedHipAngle)
         else:
+            self.fourBarUpper.setLinkLengths(O2ALen, ABLen, BO4Len)
             self.fourBarUpper.setO2O4Pt(O2, O4, adjustedHipAngle)
 
 
@@ -318,8 +412,10 @@ class Rider:
         Draw the riders upper body.
         """
         if self.upperLine1 is None:
-            self.upperLine1, = self.ax.plot([], [], c=self.riderColor)
-
+            self.upperLine1, = self.getAxes().plot([], [], c=self.riderColor)
+        elif not self.upperBodyDirty:
+            return
+        self.upperBodyDirty = False
 
         self.upperLine1.set_data([self.fourBarUpper.O2n[0], self.fourBarUpper.Ann[0], self.fourBarUpper.Bnn[0], self.fourBarUpper.O4n[0]],
                                 [self.fourBarUpper.O2n[1], self.fourBarUpper.Ann[1], self.fourBarUpper.Bnn[1], self.fourBarUpper.O4n[1]])
@@ -0,0 +1,68 @@
+import numpy as np
+
+
+def calcLayout(fields):
+    """
+    Calculate where each field sits in a flat buffer.
+
+    :param fields: A sequence of (name, shape) tuples, in buffer order.
+    :return: A dictionary of names to (offset, shape) tuples, and the total buffer size.
+    """
+    layout = {}
+    offset = 0
+    for name, shape in fields:
+        layout[name] = (offset, shape)
+        offset += int(np.prod(shape, dtype=int))
+
+    return layout, offset
+
+
+class RiderPose:
+    """
+    The pedal, foot and leg positions and joint angles of one rider at one crank angle, held in one float64 buffer.
+
+    Each field is a NumPy view into the buffer, so poses are written in place and nothing is allocated per frame.
+    The buffer can be handed straight to NumPy, or to shared memory by passing a view of it in. The toe, pedal
+    contact point, ankle, knee and hip are stored next to each other, so the foot and leg lines are single views.
+    """
+    # Fields in buffer order, with their shapes. Positions are [x,y], and the pedal ends are one [x,y] per row.
+    FIELDS = (('footAngle1', ()), ('footAngle2', ()), ('pedal1Ends', (2, 2)), ('pedal2Ends', (2, 2)), ('ankle2', (2,)),
+              ('toe2', (2,)), ('toe', (2,)), ('pedal1', (2,)), ('ankle', (2,)), ('knee', (2,)), ('hip', (2,)),
+              ('kneeAngle', ()), ('hipAngle', ()))
+
+    # The leading fields set from the crank angle alone, written as the one slice FEET
+    FEET_FIELDS = ('footAngle1', 'footAngle2', 'pedal1Ends', 'pedal2Ends', 'ankle2', 'toe2', 'toe', 'pedal1', 'ankle')
+
+    # Lines through consecutive points, as (name, first field, number of points)
+    LINES = (('foot1', 'toe', 3), ('leg', 'pedal1', 4))
+
+    __slots__ = ('buffer',) + tuple(name for name, _ in FIELDS) + tuple(name for name, _, _ in LINES)
+
+    def __init__(self, buffer=None):
+        """
+        :param buffer: Optional contiguous float64 array of length SIZE to hold the pose, such as a row of a larger
+                       array or a shared memory buffer. A new zeroed buffer is used if None.
+        """
+        if buffer is None:
+            buffer = np.zeros(self.SIZE)
+        elif buffer.dtype != np.float64 or buffer.shape != (self.SIZE,) or not buffer.flags.c_contiguous:
+            raise ValueError('A pose buffer must be a contiguous float64 array of length %d.' % self.SIZE)
+        self.buffer = buffer
+
+        for name, (offset, shape) in self.LAYOUT.items():
+            setattr(self, name, buffer[offset:offset + int(np.prod(shape, dtype=int))].reshape(shape))
+        for name, first, points in self.LINES:
+            offset = self.LAYOUT[first][0]
+            setattr(self, name, buffer[offset:offset + 2 * points].reshape(points, 2))
+
+    def copyFrom(self, other):
+        """
+        Copy another pose into this one.
+
+        :param other: The RiderPose to copy.
+        """
+        np.copyto(self.buffer, other.buffer)
+
+
+RiderPose.LAYOUT, RiderPose.SIZE = calcLayout(RiderPose.FIELDS)
+RiderPose.FEET = slice(RiderPose.LAYOUT[RiderPose.FEET_FIELDS[0]][0], RiderPose.LAYOUT['knee'][0])
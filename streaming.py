@@ -0,0 +1,356 @@
+import argparse
+import collections
+import concurrent.futures
+import csv
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+from kinematics import calcFrame
+from population import POPULATION_STATS, RiderBatch
+
+
+class JsonStreamError(ValueError):
+    """
+    Raised when a streamed rider file isn't valid JSON or JSON Lines.
+    """
+
+
+def iterJsonLines(f):
+    """
+    Read rider configurations from a JSON Lines file, one rider per line.
+    A rider may give its name with a "name" key, otherwise riders are named by their line index.
+
+    :param f: The open text file.
+    :return: A generator of (name, rider config) tuples.
+    """
+    for i, line in enumerate(f):
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        rc = json.loads(line)
+        yield rc.pop('name', str(i)), rc
+
+
+def iterJsonContainer(f, readSize=1 << 16):
+    """
+    Incrementally read rider configurations from a JSON file holding either an object of rider names to
+    configurations, like rider.json, or an array of configurations. Only one rider is held in memory at a time.
+
+    :param f: The open text file.
+    :param readSize: The number of characters to read at once.
+    :return: A generator of (name, rider config) tuples.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        # Drop consumed text and read more, returning False at the end of the file
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        data = f.read(readSize)
+        buffer = buffer[pos:] + data
+        pos = 0
+        eof = len(data) == 0
+        return not eof
+
+    def skip(chars):
+        # Move past whitespace and the given separators, returning the next character
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] in chars):
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                return ''
+
+    def decode():
+        # Decode the next value, reading more until it is complete
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            # A number may be cut off at the end of the buffer
+            if end == len(buffer) and not eof and fill():
+                continue
+            pos = end
+            return value
+
+    start = skip('')
+    if start not in ('{', '['):
+        raise JsonStreamError('Expected a JSON object or array of riders.')
+    pos += 1
+    close = '}' if start == '{' else ']'
+
+    i = 0
+    while True:
+        char = skip(',')
+        if char == close:
+            return
+        if char == '':
+            raise JsonStreamError('Unexpected end of rider file.')
+        if start == '{':
+            name = decode()
+            if skip('') != ':':
+                raise JsonStreamError('Expected ":" after rider name %s.' % name)
+            pos += 1
+            skip('')
+        else:
+            name = str(i)
+        yield name, decode()
+        i += 1
+
+
+def iterRiderConfigs(path):
+    """
+    Read rider configurations one at a time from a JSON Lines (.jsonl) or JSON file.
+
+    :param path: The path to the rider file.
+    :return: A generator of (name, rider config) tuples.
+    """
+    with open(path) as f:
+        if os.path.splitext(path)[1] in ('.jsonl', '.ndjson'):
+            yield from iterJsonLines(f)
+        else:
+            yield from iterJsonContainer(f)
+
+
+def iterBatches(riders, batchSize):
+    """
+    Group rider configurations into batches.
+
+    :param riders: An iterable of (name, rider config) tuples.
+    :param batchSize: The maximum number of riders per batch.
+    :return: A generator of (names, rider config arrays) tuples.
+    """
+    names = []
+    rcs = []
+    for name, rc in riders:
+        names.append(name)
+        rcs.append(rc)
+        if len(rcs) == batchSize:
+            yield names, RiderBatch.fromConfigs(rcs).arrays
+            names = []
+            rcs = []
+    if len(rcs) > 0:
+        yield names, RiderBatch.fromConfigs(rcs).arrays
+
+
+class CsvResultWriter:
+    """
+    Writes per rider results as CSV rows.
+    """
+    def __init__(self, path):
+        self.f = open(path, 'w', newline='')
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(('name',) + POPULATION_STATS)
+
+    def write(self, chunkIdx, names, metrics):
+        columns = [metrics[stat] for stat in POPULATION_STATS]
+        for i, name in enumerate(names):
+            self.writer.writerow([name] + [('%.4f' % column[i]) if column.dtype.kind == 'f' else int(column[i]) for column in columns])
+
+    def close(self):
+        self.f.close()
+
+
+class NpyResultWriter:
+    """
+    Writes per rider results as numbered .npy chunks of structured arrays.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, chunkIdx, names, metrics):
+        dtype = [('name', 'U%d' % max(1, max(len(str(name)) for name in names)))]
+        dtype += [(stat, metrics[stat].dtype) for stat in POPULATION_STATS]
+        results = np.empty(len(names), dtype=dtype)
+        results['name'] = names
+        for stat in POPULATION_STATS:
+            results[stat] = metrics[stat]
+        np.save(os.path.join(self.directory, 'results_%06d.npy' % chunkIdx), results)
+
+    def close(self):
+        pass
+
+
+class StreamPipeline:
+    """
+    Streams rider configurations through cycle evaluation and out to result files, holding only a bounded number of
+    batches in memory.
+
+    The reader only reads another batch when fewer than maxInFlight batches are being computed, and results wait
+    for the writer in a queue of at most writeQueueSize batches. A slow writer therefore stalls the compute
+    workers, which in turn stall the reader. Results are written in the same order the riders were read.
+    """
+    def __init__(self, bc, crankSamples=360, batchSize=4096, workers=None, maxInFlight=None, writeQueueSize=2):
+        """
+        :param bc: The bike configuration dictionary.
+        :param crankSamples: The number of crank angles to evaluate per revolution.
+        :param batchSize: The number of riders evaluated together.
+        :param workers: The number of worker processes, defaults to the CPU count. Use 0 to compute in this process.
+        :param maxInFlight: The maximum number of batches being computed at once, defaults to twice the workers.
+        :param writeQueueSize: The maximum number of computed batches waiting to be written.
+        """
+        self.frame = calcFrame(bc)
+        self.crankAngles = np.linspace(0, 360, crankSamples, endpoint=False)
+        self.batchSize = batchSize
+        self.workers = os.cpu_count() if workers is None else workers
+        self.maxInFlight = max(1, 2 * self.workers) if maxInFlight is None else maxInFlight
+        self.writeQueueSize = writeQueueSize
+
+    def run(self, riders, resultWriter, traceDirectory=None, progress=None):
+        """
+        Evaluate every rider and write the results.
+
+        :param riders: An iterable of (name, rider config) tuples, such as from iterRiderConfigs.
+        :param resultWriter: A CsvResultWriter or NpyResultWriter.
+        :param traceDirectory: Optional directory to write the knee and hip angles at every crank angle to, as
+                               numbered .npy chunks of shape (riders, 2, crank angles).
+        :param progress: Optional callable, called with the number of riders written so far.
+        :return: The number of riders evaluated.
+        """
+        if traceDirectory is not None:
+            os.makedirs(traceDirectory, exist_ok=True)
+            np.save(os.path.join(traceDirectory, 'crank_angles.npy'), self.crankAngles)
+        traces = traceDirectory is not None
+
+        # Writer thread
+        writeQueue = queue.Queue(maxsize=self.writeQueueSize)
+        written = [0]
+        writeErrors = []
+
+        def writeResults():
+            while True:
+                item = writeQueue.get()
+                if item is None:
+                    return
+                chunkIdx, names, metrics, angleTraces = item
+                try:
+                    resultWriter.write(chunkIdx, names, metrics)
+                    if traces:
+                        np.save(os.path.join(traceDirectory, 'traces_%06d.npy' % chunkIdx), angleTraces)
+                except Exception as e:
+                    writeErrors.append(e)
+                    return
+                written[0] += len(names)
+                if progress is not None:
+                    progress(written[0])
+
+        writer = threading.Thread(target=writeResults, daemon=True)
+        writer.start()
+
+        if self.workers > 0:
+            executor = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=initWorker,
+                                                              initargs=(self.frame, self.crankAngles, traces))
+        else:
+            initWorker(self.frame, self.crankAngles, traces)
+            executor = None
+
+        def queueResult(chunkIdx, names, future):
+            metrics, angleTraces = future.result() if executor is not None else future
+            # Blocks while the writer is behind
+            while not self.putResult(writeQueue, (chunkIdx, names, metrics, angleTraces)):
+                if len(writeErrors) > 0:
+                    raise writeErrors[0]
+
+        inFlight = collections.deque()
+        try:
+            for chunkIdx, (names, arrays) in enumerate(iterBatches(riders, self.batchSize)):
+                # Wait for the oldest batch before reading more
+                if len(inFlight) >= self.maxInFlight:
+                    queueResult(*inFlight.popleft())
+                if executor is not None:
+                    inFlight.append((chunkIdx, names, executor.submit(evaluateBatch, arrays)))
+                else:
+                    inFlight.append((chunkIdx, names, evaluateBatch(arrays)))
+            while len(inFlight) > 0:
+                queueResult(*inFlight.popleft())
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            if writer.is_alive():
+                writeQueue.put(None)
+                writer.join()
+            resultWriter.close()
+
+        if len(writeErrors) > 0:
+            raise writeErrors[0]
+
+        return written[0]
+
+    @staticmethod
+    def putResult(writeQueue, item, timeout=0.5):
+        """
+        Put a result on the write queue, giving up after a timeout so writer errors can be checked.
+        """
+        try:
+            writeQueue.put(item, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+
+# The frame, crank angles and trace flag used by this worker process
+workerState = None
+
+
+def initWorker(frame, crankAngles, traces):
+    """
+    Store the shared inputs in a worker process, so only rider batches need to be sent per task.
+    """
+    global workerState
+    workerState = (frame, crankAngles, traces)
+
+
+def evaluateBatch(arrays):
+    """
+    Evaluate a batch of riders in a worker.
+
+    :param arrays: A dictionary of rider configuration keys to arrays.
+    :return: The metrics dictionary and the angle traces, or None without traces.
+    """
+    frame, crankAngles, traces = workerState
+    result = RiderBatch(arrays).evaluate(frame, crankAngles, traces=traces)
+    if traces:
+        return result
+    return result, None
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream riders from a JSON or JSON Lines file through cycle evaluation.')
+    parser.add_argument('riders', help='The rider file, either JSON Lines (.jsonl) or JSON like rider.json.')
+    parser.add_argument('--bike', default='bike.json', help='The bike configuration file.')
+    parser.add_argument('--out', default='results.csv', help='A .csv file, or a directory for .npy result chunks.')
+    parser.add_argument('--traces', default=None, help='A directory to write per crank angle knee and hip traces to.')
+    parser.add_argument('--samples', type=int, default=360, help='The number of crank angles per revolution.')
+    parser.add_argument('--batch-size', type=int, default=4096, help='The number of riders evaluated together.')
+    parser.add_argument('--workers', type=int, default=None, help='The number of worker processes.')
+    args = parser.parse_args()
+
+    with open(args.bike) as f:
+        bc = json.load(f)
+
+    if args.out.endswith('.csv'):
+        resultWriter = CsvResultWriter(args.out)
+    else:
+        resultWriter = NpyResultWriter(args.out)
+
+    pipeline = StreamPipeline(bc, crankSamples=args.samples, batchSize=args.batch_size, workers=args.workers)
+    startTime = time.perf_counter()
+    count = pipeline.run(iterRiderConfigs(args.riders), resultWriter, traceDirectory=args.traces,
+                         progress=lambda n: print('\rWritten %d riders' % n, end=''))
+    print('\nEvaluated %d riders in %.2f s' % (count, time.perf_counter() - startTime))
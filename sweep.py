@@ -0,0 +1,172 @@
+import json
+import multiprocessing
+import time
+import numpy as np
+
+from clearance import CLEARANCE_STATS, solveClearance
+from feasibility import FEASIBILITY_FLAGS, FEASIBILITY_STATS, screenFeasibility, takeConfigs
+from kinematics import calcExtrema, calcFrame, calcFrameArrays, solveJointAngles, solveUpperReachable
+
+
+SWEEP_STATS = ('kneeMin', 'kneeMax', 'hipMin', 'hipMax', 'reachable', 'upperReachable', 'frameBuildable') + FEASIBILITY_STATS
+SWEEP_FLAGS = ('reachable', 'upperReachable', 'frameBuildable') + FEASIBILITY_FLAGS
+
+
+class FitSweep:
+    """
+    Evaluates a full crank cycle for every point on a grid of bike and rider configuration values.
+    """
+    def __init__(self, bc, rc, paramRanges, crankSamples=360, clearance=False):
+        """
+        :param bc: The base bike configuration dictionary.
+        :param rc: The base rider configuration dictionary.
+        :param paramRanges: A dictionary of bike or rider configuration keys to the values to sweep over. The
+                            grid is ordered with the first key changing slowest.
+        :param crankSamples: The number of crank angles to evaluate per revolution.
+        :param clearance: Whether to also find the smallest toe and knee clearances, see clearance.solveClearance.
+        """
+        self.bc = bc
+        self.rc = rc
+        self.keys = list(paramRanges.keys())
+        self.values = [np.asarray(paramRanges[key], dtype=float) for key in self.keys]
+        self.shape = tuple(len(values) for values in self.values)
+        self.size = int(np.prod(self.shape))
+        self.crankAngles = np.linspace(0, 360, crankSamples, endpoint=False)
+        self.clearance = clearance
+        self.stats = SWEEP_STATS + CLEARANCE_STATS if clearance else SWEEP_STATS
+
+        for key in self.keys:
+            if key not in rc and key not in bc:
+                raise ValueError('Unknown sweep parameter %s, must be a bike or rider configuration key.' % key)
+
+        self.baseFrame = calcFrame(bc)
+
+    def evaluateChunk(self, start, stop):
+        """
+        Evaluate a contiguous range of grid points.
+        Points are screened first, and those where the legs can't reach the pedals at any crank angle aren't solved.
+
+        :param start: The first flat grid index.
+        :param stop: One past the last flat grid index.
+        :return: A dictionary of the sweep stats, as arrays for each grid point.
+        """
+        gridIdx = np.unravel_index(np.arange(start, stop), self.shape)
+        rc = dict(self.rc)
+        bikeParams = {}
+        for key, values, idx in zip(self.keys, self.values, gridIdx):
+            if key in self.rc:
+                rc[key] = values[idx]
+            else:
+                bikeParams[key] = values[idx]
+
+        frame, buildable = calcFrameArrays(self.bc, bikeParams, stop - start, self.baseFrame)
+        stats = screenFeasibility(frame, rc)
+        stats['frameBuildable'] = buildable
+        feasible = np.broadcast_to(stats['legFeasible'], (stop - start,))
+        if np.all(feasible):
+            stats.update(calcExtrema(*solveJointAngles(frame, rc, self.crankAngles)))
+        else:
+            # Only solve the feasible points, the rest can't reach at any crank angle
+            for stat in ('kneeMin', 'kneeMax', 'hipMin', 'hipMax'):
+                stats[stat] = np.full(stop - start, np.nan)
+            stats['reachable'] = np.zeros(stop - start, dtype=bool)
+            if np.any(feasible):
+                extrema = calcExtrema(*solveJointAngles(takeConfigs(frame, feasible), takeConfigs(rc, feasible), self.crankAngles))
+                for stat, value in extrema.items():
+                    stats[stat][feasible] = value
+        stats['upperReachable'] = solveUpperReachable(frame, rc)
+        if self.clearance:
+            stats.update(solveClearance(frame, rc, self.crankAngles))
+
+        return {stat: np.broadcast_to(stats[stat], (stop - start,)) for stat in self.stats}
+
+    def run(self, processes=None, chunkSize=2000, progress=None):
+        """
+        Evaluate every grid point, split into chunks across a process pool.
+
+        :param processes: The number of worker processes, defaults to the CPU count. Use 1 to run in this process.
+        :param chunkSize: The number of grid points evaluated together by a worker.
+        :param progress: Optional callable, called with (pointsDone, totalPoints) as chunks complete.
+        :return: A dictionary of column arrays in grid order, holding the swept parameter values and sweep stats.
+        """
+        table = {}
+        gridIdx = np.unravel_index(np.arange(self.size), self.shape)
+        for key, values, idx in zip(self.keys, self.values, gridIdx):
+            table[key] = values[idx]
+        for stat in self.stats:
+            table[stat] = np.empty(self.size, dtype=bool if stat in SWEEP_FLAGS else float)
+
+        chunks = [(start, min(start + chunkSize, self.size)) for start in range(0, self.size, chunkSize)]
+        done = 0
+        if processes == 1 or len(chunks) <= 1:
+            initWorker(self)
+            pool = None
+            results = map(evaluateChunk, chunks)
+        else:
+            pool = multiprocessing.Pool(processes, initializer=initWorker, initargs=(self,))
+            results = pool.imap_unordered(evaluateChunk, chunks)
+
+        try:
+            # Chunks may finish in any order, but are placed by index so the table order is fixed
+            for (start, stop), stats in results:
+                for stat in self.stats:
+                    table[stat][start:stop] = stats[stat]
+                done += stop - start
+                if progress is not None:
+                    progress(done, self.size)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        return table
+
+
+# The sweep being evaluated by this worker process
+workerSweep = None
+
+
+def initWorker(sweep):
+    """
+    Store the sweep in a worker process, so only chunk ranges need to be sent per task.
+
+    :param sweep: The FitSweep to evaluate.
+    """
+    global workerSweep
+    workerSweep = sweep
+
+
+def evaluateChunk(chunk):
+    """
+    Evaluate a chunk of the worker's sweep.
+
+    :param chunk: The (start, stop) flat grid indices.
+    :return: The chunk and its sweep stats.
+    """
+    return chunk, workerSweep.evaluateChunk(*chunk)
+
+
+def printProgress(done, total):
+    """
+    Print the sweep progress on a single line.
+    """
+    print('\rEvaluated %d/%d configurations (%.0f%%)' % (done, total, 100.0 * done / total), end='' if done < total else '\n')
+
+
+
+if __name__ == '__main__':
+    with open('bike.json') as f:
+        bc = json.load(f)
+    with open('rider.json') as f:
+        rc = json.load(f)['rider1']
+
+    sweep = FitSweep(bc, rc, {'seatHeight': np.linspace(150, 260, 56),
+                              'seatRiderOffsetX': np.linspace(-60, 60, 25),
+                              'crankLength': np.linspace(160, 180, 9),
+                              'footContactProportion': np.linspace(0.6, 0.8, 9)})
+    startTime = time.perf_counter()
+    table = sweep.run(progress=printProgress)
+    print('Swept %d configurations in %.2f s' % (sweep.size, time.perf_counter() - startTime))
+
+    best = np.nanargmin(np.abs(np.where(table['reachable'], table['kneeMax'], np.nan) - 145.0))
+    print('Closest to 145 deg max knee angle:', {key: float(table[key][best]) for key in sweep.keys})
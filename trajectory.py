@@ -0,0 +1,339 @@
+import argparse
+import json
+import struct
+import time
+import numpy as np
+
+from kinematics import RiderCycle, calcFrame, solveCycle
+from population import RiderBatch
+from riderPose import RiderPose
+
+
+# Every file starts with the magic bytes, then the format version and header length as little endian uint32s
+TRAJECTORY_MAGIC = b'BFVTRAJ\x00'
+TRAJECTORY_VERSION = 1
+PREAMBLE = struct.Struct('<8sII')
+
+# Data blocks start on multiples of this many bytes
+ALIGNMENT = 64
+
+
+class TrajectoryFormatError(ValueError):
+    """
+    Raised when a file isn't a valid trajectory file.
+    """
+
+
+def alignOffset(offset):
+    """
+    :return: The offset rounded up to the next multiple of ALIGNMENT.
+    """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def writeTrajectory(path, bc, riders, samples=360, chunkSize=1024, progress=None):
+    """
+    Solve riders over one crank revolution and write their poses to a trajectory file.
+
+    The file holds a JSON header, then a float32 array of shape (riders, samples, RiderPose.SIZE) with a pose in
+    the RiderPose buffer layout for every rider and crank angle, then a float64 array of shape (riders, keys) of
+    the rider configurations. Riders are solved and written in chunks, so memory use stays bounded however many
+    riders there are.
+
+    :param path: The file to write.
+    :param bc: The bike configuration dictionary.
+    :param riders: A RiderBatch, a dictionary of rider names to configurations, or a list of configurations.
+    :param samples: The number of evenly spaced crank angles per revolution, starting at 0 degrees.
+    :param chunkSize: The number of riders to solve at once.
+    :param progress: Optional callable, called with the number of riders written so far.
+    """
+    batch = riders if isinstance(riders, RiderBatch) else RiderBatch.fromConfigs(riders)
+    frame = calcFrame(bc)
+    crankAngles = np.arange(samples) * (360.0 / samples)
+    configKeys = list(batch.arrays.keys())
+
+    # Lay out the header and the data blocks
+    posesShape = (len(batch), samples, RiderPose.SIZE)
+    configsShape = (len(batch), len(configKeys))
+    header = {'bike': bc,
+              'names': [str(name) for name in batch.names],
+              'samples': samples,
+              'fields': [[name, list(shape)] for name, shape in RiderPose.FIELDS],
+              'configKeys': configKeys,
+              'poses': {'dtype': '<f4', 'shape': list(posesShape)},
+              'configs': {'dtype': '<f8', 'shape': list(configsShape)}}
+
+    # The block offsets are part of the header, so allow room for their digits when laying out
+    headerSize = len(json.dumps(header).encode('utf-8')) + 64
+    posesOffset = alignOffset(PREAMBLE.size + headerSize)
+    configsOffset = alignOffset(posesOffset + int(np.prod(posesShape)) * 4)
+    fileSize = configsOffset + int(np.prod(configsShape)) * 8
+    header['poses']['offset'] = posesOffset
+    header['configs']['offset'] = configsOffset
+    headerBytes = json.dumps(header).encode('utf-8')
+    headerBytes += b' ' * (posesOffset - PREAMBLE.size - len(headerBytes))
+
+    with open(path, 'wb') as f:
+        f.write(PREAMBLE.pack(TRAJECTORY_MAGIC, TRAJECTORY_VERSION, len(headerBytes)))
+        f.write(headerBytes)
+        f.truncate(fileSize)
+
+    # Fill in the data blocks through memory maps
+    poses = np.memmap(path, dtype='<f4', mode='r+', offset=posesOffset, shape=posesShape)
+    configs = np.memmap(path, dtype='<f8', mode='r+', offset=configsOffset, shape=configsShape)
+    for key, values in batch.arrays.items():
+        configs[:, configKeys.index(key)] = values
+
+    for start in range(0, len(batch), chunkSize):
+        stop = min(start + chunkSize, len(batch))
+        cycle = solveCycle(frame, batch.getConfigs(start, stop), crankAngles)
+        for name, (offset, shape) in RiderPose.LAYOUT.items():
+            values = getattr(cycle, name)
+            if name == 'hip':
+                # The hip doesn't move, so has no crank angle axis
+                values = values[..., np.newaxis, :]
+            size = int(np.prod(shape, dtype=int))
+            poses[start:stop, :, offset:offset + size] = np.broadcast_to(values, (stop - start, samples) + shape).reshape(stop - start, samples, size)
+        if progress is not None:
+            progress(stop)
+
+    poses.flush()
+    configs.flush()
+    del poses, configs
+
+
+class TrajectoryFile:
+    """
+    Reads a trajectory file written by writeTrajectory.
+
+    The pose and configuration blocks are memory mapped, so opening a file is instant and only the riders that
+    are used are read from disk. Everything returned is a view of the mapped file.
+    """
+    def __init__(self, path):
+        """
+        :param path: The trajectory file to open.
+        """
+        self.path = path
+
+        with open(path, 'rb') as f:
+            preamble = f.read(PREAMBLE.size)
+            if len(preamble) != PREAMBLE.size:
+                raise TrajectoryFormatError('%s is too short to be a trajectory file.' % path)
+            magic, version, headerLength = PREAMBLE.unpack(preamble)
+            if magic != TRAJECTORY_MAGIC:
+                raise TrajectoryFormatError('%s is not a trajectory file.' % path)
+            if version != TRAJECTORY_VERSION:
+                raise TrajectoryFormatError('%s has trajectory format version %d, expected %d.' % (path, version, TRAJECTORY_VERSION))
+            self.header = json.loads(f.read(headerLength).decode('utf-8'))
+
+        if [[name, list(shape)] for name, shape in RiderPose.FIELDS] != self.header['fields']:
+            raise TrajectoryFormatError('%s has a different pose layout to RiderPose.' % path)
+
+        self.bc = self.header['bike']
+        self.names = self.header['names']
+        self.samples = self.header['samples']
+        self.crankAngles = np.arange(self.samples) * (360.0 / self.samples)
+        self.configKeys = self.header['configKeys']
+        self.poses = self.mapBlock('poses')
+        self.configs = self.mapBlock('configs')
+
+    def mapBlock(self, name):
+        """
+        Memory map a data block read-only.
+
+        :param name: The block name in the header.
+        :return: The mapped array.
+        """
+        block = self.header[name]
+        shape = tuple(block['shape'])
+        if 0 in shape:
+            return np.zeros(shape, dtype=block['dtype'])
+
+        return np.memmap(self.path, dtype=block['dtype'], mode='r', offset=block['offset'], shape=shape)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Release the memory maps. Views taken from them keep the file mapped until they are deleted.
+        """
+        self.poses = None
+        self.configs = None
+
+    def getField(self, name):
+        """
+        Get a pose field for every rider and crank angle.
+
+        :param name: A name from RiderPose.FIELDS.
+        :return: A view with shape (riders, samples) + the field shape.
+        """
+        offset, shape = RiderPose.LAYOUT[name]
+        size = int(np.prod(shape, dtype=int))
+
+        return self.poses[:, :, offset:offset + size].reshape(self.poses.shape[:2] + shape)
+
+    def getConfig(self, index):
+        """
+        Get a rider configuration.
+
+        :param index: The rider index.
+        :return: The rider configuration dictionary.
+        """
+        return {key: float(value) for key, value in zip(self.configKeys, self.configs[index])}
+
+    def findRider(self, name):
+        """
+        :param name: A rider name.
+        :return: The index of the rider.
+        """
+        return self.names.index(str(name))
+
+    def createBike(self, ax=None):
+        """
+        Create the bike the riders were solved on.
+
+        :param ax: The axes object to plot on.
+        :return: The Bike, with calcBikePositions called.
+        """
+        from bike import Bike
+
+        bike = Bike(self.bc, ax=ax)
+        bike.calcBikePositions()
+
+        return bike
+
+    def createRider(self, index, bike, **kwargs):
+        """
+        Create a rider whose poses are replayed from this file instead of being solved.
+
+        :param index: The rider index.
+        :param bike: The bike to put the rider on, see createBike.
+        :param kwargs: Other Rider arguments, such as colours and axes.
+        :return: The Rider.
+        """
+        from rider import Rider
+
+        rider = Rider(self.getConfig(index), bike, **kwargs)
+        rider.poseCache = TrajectoryPoses(self, index, rider.pose)
+
+        return rider
+
+
+class TrajectoryPoses:
+    """
+    Serves one rider's poses from a trajectory file in place of a PeriodicPoseCache, so Rider and BlitRenderer
+    replay them through the same artists they draw solved poses with.
+
+    Crank angles are wrapped modulo 360 degrees and linearly interpolated between the stored samples, straight
+    from the memory mapped file into the rider's pose.
+    """
+    def __init__(self, trajectory, index, pose=None):
+        """
+        :param trajectory: The TrajectoryFile.
+        :param index: The rider index.
+        :param pose: Optional RiderPose to interpolate into. A new one is used if None.
+        """
+        self.samples = trajectory.samples
+        self.step = 360.0 / self.samples
+        self.poses = trajectory.poses[index]
+
+        # Angle curves for BlitRenderer, as views of the file
+        self.cycle = RiderCycle()
+        self.cycle.crankAngle = trajectory.crankAngles
+        self.cycle.kneeAngle = trajectory.getField('kneeAngle')[index]
+        self.cycle.hipAngle = trajectory.getField('hipAngle')[index]
+
+        self.pose = RiderPose() if pose is None else pose
+        self.scratch = np.empty(RiderPose.SIZE)
+        self.crankAngleDeg = None
+
+    def calcPose(self, crankAngleDeg):
+        """
+        Interpolate the pose for a crank angle into the pose buffer.
+
+        :param crankAngleDeg: The crank angle in degrees, which may be outside 0 to 360.
+        :return: The RiderPose.
+        """
+        if crankAngleDeg != self.crankAngleDeg:
+            position = (crankAngleDeg % 360.0) / self.step
+            idx = min(int(position), self.samples - 1)
+            weight = position - idx
+            np.multiply(self.poses[idx], 1.0 - weight, out=self.pose.buffer)
+            np.multiply(self.poses[(idx + 1) % self.samples], weight, out=self.scratch)
+            self.pose.buffer += self.scratch
+            self.crankAngleDeg = crankAngleDeg
+
+        return self.pose
+
+
+def replay(trajectory, indices, crankAngles, fps=60.0):
+    """
+    Animate riders from a trajectory file with blitting, without solving any kinematics per frame.
+
+    :param trajectory: The TrajectoryFile.
+    :param indices: The indices of the riders to draw.
+    :param crankAngles: The crank angle of each frame.
+    :param fps: The maximum frame rate, or None or 0 to draw as fast as possible.
+    """
+    import matplotlib.pyplot as plt
+    from renderer import BlitRenderer, createFigure
+
+    fig, ax1, ax2, ax3 = createFigure()
+    plt.ion()
+
+    bike = trajectory.createBike(ax=ax1)
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    riders = [trajectory.createRider(index, bike, seatColor=colors[i % len(colors)], riderColor=colors[i % len(colors)], ax=ax1)
+              for i, index in enumerate(indices)]
+    bike.drawBikePositions()
+    for rider in riders:
+        rider.drawSeat()
+
+    plt.show(block=False)
+    renderer = BlitRenderer(fig, bike, riders, ax2, ax3, fps=fps)
+    renderer.setup(crankAngles[0])
+    for crankAngleDeg in crankAngles:
+        renderer.drawFrame(crankAngleDeg)
+
+    plt.show()
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write rider poses over a crank revolution to a trajectory file, or replay one.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    writeParser = subparsers.add_parser('write', help='Solve riders and write a trajectory file.')
+    writeParser.add_argument('out', help='The trajectory file to write.')
+    writeParser.add_argument('--bike', default='bike.json', help='The bike configuration file.')
+    writeParser.add_argument('--riders', default='rider.json', help='The rider configuration file, JSON or JSON Lines.')
+    writeParser.add_argument('--samples', type=int, default=360, help='The number of crank angles per revolution.')
+    replayParser = subparsers.add_parser('replay', help='Animate riders from a trajectory file.')
+    replayParser.add_argument('path', help='The trajectory file to replay.')
+    replayParser.add_argument('--names', nargs='+', default=None, help='The riders to draw, defaults to the first four.')
+    replayParser.add_argument('--frames', type=int, default=360*20, help='The number of frames to animate.')
+    replayParser.add_argument('--fps', type=float, default=60.0, help='The maximum frame rate, or 0 to draw as fast as possible.')
+    args = parser.parse_args()
+
+    if args.command == 'write':
+        from streaming import iterRiderConfigs
+
+        with open(args.bike) as f:
+            bc = json.load(f)
+        riders = dict(iterRiderConfigs(args.riders))
+        startTime = time.perf_counter()
+        writeTrajectory(args.out, bc, riders, samples=args.samples, progress=lambda n: print('\rWritten %d riders' % n, end=''))
+        print('\nWrote %d riders in %.2f s' % (len(riders), time.perf_counter() - startTime))
+    else:
+        trajectory = TrajectoryFile(args.path)
+        if args.names is None:
+            indices = range(min(4, len(trajectory)))
+        else:
+            indices = [trajectory.findRider(name) for name in args.names]
+        replay(trajectory, indices, np.linspace(-2, 360*40, 360*20)[:args.frames], fps=args.fps)